@@ -1,13 +1,25 @@
 import streamlit as st
 import pandas as pd
-import pulp
+import numpy as np
 import streamlit.components.v1 as components
 import html as html_lib
+import hashlib
 import pickle
 import io
 from datetime import datetime
-from collections import defaultdict
-import math
+from collections import OrderedDict
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from solver import (
+    build_status_matrix, build_roster, get_member_grade_map, sort_members_by_roster, read_bounds, diagnose_infeasibility,
+    solve_fingerprint, read_cbc_progress, read_sweep_progress, solve_worker, SOLVER_PROFILES, SOLVER_BACKENDS,
+)
+from editor import apply_grid_edit, is_member_locked, member_ranks, schedule_from_df, copy_schedule, schedule_assignments, schedule_to_df
 
 # ==========================================
 # ページ設定
@@ -42,75 +54,25 @@ js_code = """
     }
     setAppleTouchIcon('🍵');
 
-    // 2. ボタンの色付け & 入力欄の強調ロジック (常時監視)
+    // 2. 選択中のボタンの色付け & 入力欄の強調ロジック (常時監視)
     function applyStyles() {
         const doc = window.parent.document;
-        
-        // --- ボタンの色付け ---
-        const buttons = doc.querySelectorAll('button');
-        buttons.forEach(btn => {
-            const text = btn.innerText;
-            
-            // 日付ボタン
-            if (text.includes('\\u200E')) {
-                if (text.includes('\\u200b\\u200b')) {
-                    if (text.includes('(△)')) {
-                        btn.style.setProperty('background-color', '#ffc107', 'important'); // 黄
-                        btn.style.setProperty('color', 'black', 'important');
-                        btn.style.setProperty('border-color', '#ffc107', 'important');
-                    } else {
-                        // 緑色 (移動可能)
-                        btn.style.setProperty('background-color', '#28a745', 'important'); // 緑
-                        btn.style.setProperty('color', 'white', 'important');
-                        btn.style.setProperty('border-color', '#28a745', 'important');
-                    }
-                } 
-                else if (text.includes('\\u200b')) {
-                    // 赤色
-                    btn.style.setProperty('background-color', '#ff4b4b', 'important'); // 赤
-                    btn.style.setProperty('color', 'white', 'important');
-                    btn.style.setProperty('border-color', '#ff4b4b', 'important');
-                } 
-                else {
-                    btn.style.setProperty('background-color', '#5D6D7E', 'important'); // グレー
-                    btn.style.setProperty('color', 'white', 'important');
-                    btn.style.setProperty('border-color', '#5D6D7E', 'important');
-                }
-                return;
-            }
 
-            // メンバーボタン
-            if (text.includes('\\u200b')) {
-                if (!text.includes('\\u200b\\u200b')) {
-                    btn.style.setProperty('background-color', '#ff4b4b', 'important'); // 赤
-                    btn.style.setProperty('color', 'white', 'important');
-                    btn.style.setProperty('border-color', '#ff4b4b', 'important');
-                    btn.style.setProperty('opacity', '1.0', 'important');
-                    return;
-                }
-            } 
-
-            if (text.includes('\\u200b\\u200b')) {
-                if (text.includes('(△)')) {
-                    btn.style.setProperty('background-color', '#ffc107', 'important'); // 黄
-                    btn.style.setProperty('color', 'black', 'important');
-                    btn.style.setProperty('border-color', '#ffc107', 'important');
-                } else {
-                    btn.style.setProperty('background-color', '#28a745', 'important'); // 緑
-                    btn.style.setProperty('color', 'white', 'important');
-                    btn.style.setProperty('border-color', '#28a745', 'important');
-                }
-                return;
-            } 
-
-            // それ以外 (リセット)
-            if (!text.includes('生成') && !text.includes('解除') && !text.includes('保存') && !text.includes('リセット') && !text.includes('はい') && !text.includes('いいえ') && !text.includes('キャンセル') && !text.includes('CSV') && !text.includes('名簿') && !text.includes('バックアップ')) {
-                 btn.style.removeProperty('background-color');
-                 btn.style.removeProperty('color');
-                 btn.style.removeProperty('border-color');
+        // --- 選択中のボタン (ラベルの末尾に\u200bを付けたもの) を赤にする ---
+        doc.querySelectorAll('button').forEach(btn => {
+            if (btn.innerText.includes('\u200b')) {
+                btn.style.setProperty('background-color', '#ff4b4b', 'important'); // 赤
+                btn.style.setProperty('color', 'white', 'important');
+                btn.style.setProperty('border-color', '#ff4b4b', 'important');
+                btn.dataset.selected = "1";
+            } else if (btn.dataset.selected) {
+                btn.style.removeProperty('background-color');
+                btn.style.removeProperty('color');
+                btn.style.removeProperty('border-color');
+                delete btn.dataset.selected;
             }
         });
-
+        
         // --- 参加回数入力欄の強調 (1以外の場合) ---
         const numberInputs = doc.querySelectorAll('input[type="number"]');
         numberInputs.forEach(input => {
@@ -196,23 +158,6 @@ st.markdown("""
         background-color: #732d91 !important;
     }
 
-    /* --- マーカー判定ルール (JS優先) --- */
-    div[data-testid="column"]:nth-of-type(1) div.stButton button:not([aria-label*="\u200b"]) {
-        background-color: #2c3e50 !important; border-color: #2c3e50 !important; color: white !important;
-    }
-    div[data-testid="column"]:nth-of-type(1) div.stButton button:not([aria-label*="\u200b"]):hover { background-color: #1a252f !important; }
-    div[data-testid="column"]:nth-of-type(1) div.stButton button:disabled {
-        background-color: #2c3e50 !important; border-color: #2c3e50 !important; color: rgba(255, 255, 255, 0.5) !important; opacity: 1.0 !important;
-    }
-
-    .locked-member {
-        display: flex; align-items: center; justify-content: center;
-        width: 100%; height: 34px; background-color: #e9ecef; color: #adb5bd;
-        border: 1px solid rgba(49, 51, 63, 0.2); border-radius: 4px;
-        font-size: 13px; font-weight: bold; margin-bottom: 2px;
-        white-space: nowrap; overflow: hidden; box-sizing: border-box; cursor: not-allowed;
-    }
-    
     .comment-container {
         border: 1px solid rgba(49, 51, 63, 0.2);
         border-radius: 0.25rem;
@@ -286,82 +231,133 @@ def apply_global_settings():
             st.session_state[f"min_{i}"] = val_min
             st.session_state[f"max_{i}"] = val_max
 
+def format_solver_profile(name):
+    """計算モードの選択肢の表示 (時間の上限も添える)"""
+    time_limit = SOLVER_PROFILES[name]['time_limit']
+    return f"{PROFILE_LABELS[name]} ({time_limit}秒まで)" if time_limit is not None else f"{PROFILE_LABELS[name]} (時間制限なし)"
+
 def get_circle_number(n):
     if 1 <= n <= 20: return chr(0x2460 + n - 1)
     return f"({n})"
 
+PROFILE_LABELS = {'quick': "速さ優先", 'balanced': "バランス", 'exact': "最適解を保証"}
+STATUS_LABELS = {'optimal': "最適解", 'gap': "許容ギャップ内の解", 'time_limit': "時間の上限で打ち切った解", 'stopped': "中断した解", 'heuristic': "近似解法の解", 'infeasible': "解なし", 'not_solved': "時間内に解が見つからず"}
+ALTERNATIVE_COUNT = 3  # 一度の生成で作る別案の数
+SOLVE_CACHE_SIZE = 64  # 全セッションで共有する求解結果キャッシュの件数
+SOLVE_PENDING_TIMEOUT = 15  # 計算中のセッションからこの秒数知らせが無ければ、待っているセッションが自分で計算する
+
+def derived_data_key(clean_df, roster, name_mappings):
+    """伝助(clean_df)・部員名簿・名前の紐付けから作る指紋。変わったときだけ update_static_caches で作り直す"""
+    digest = hashlib.sha256(repr((clean_df.shape, clean_df.columns.tolist())).encode())
+    digest.update(pd.util.hash_pandas_object(clean_df, index=False).to_numpy().tobytes())
+    digest.update(repr((roster['names'], sorted(roster['grade'].items())) if roster is not None else None).encode())
+    digest.update(repr(sorted(name_mappings.items())).encode())
+    return digest.hexdigest()
+
+def build_derived_data(clean_df, roster):
+    """
+    読み込んだデータだけで決まる集計をまとめて作る (画面を描き直すたびには計算しない)。
+    status_matrix, 参加者(attendees)・名簿順の参加者, 人数の初期値, 1日しか参加できない部員がいる日程(mandatory_dates),
+    名簿があるときは 名簿に無い名前・未回答者・回答状況の表
+    """
+    status_matrix = build_status_matrix(clean_df)
+    members_list = status_matrix['members'].tolist()
+    dates_list = status_matrix['dates'].tolist()
+    candidate_counts = status_matrix['candidate_counts']
+    attendees = status_matrix['members'][candidate_counts > 0].tolist()
+    total_members = int(len(members_list))
+    total_days = int(len(dates_list))
+
+    if total_days > 0 and len(attendees) > 0:
+        default_bulk_max = (len(attendees) // total_days) + 1
+        default_bulk_min = max(0, default_bulk_max - 2)
+    else:
+        default_bulk_max = 1; default_bulk_min = 0
+    safe_input_max = total_members if total_members > 0 else 1
+
+    # 1日しか参加できない部員 (その日程は外せない)
+    mandatory_dates = {}
+    single_cols = np.flatnonzero(candidate_counts == 1)
+    single_rows = (status_matrix['matrix'][:, single_cols] > 0).argmax(axis=0)
+    for col_idx, row_idx in zip(single_cols.tolist(), single_rows.tolist()):
+        mandatory_dates.setdefault(dates_list[row_idx], []).append(members_list[col_idx])
+
+    derived = {
+        'status_matrix': status_matrix,
+        'attendees': attendees,
+        'sorted_attendees': sort_members_by_roster(list(attendees), roster),
+        'sorted_members': sort_members_by_roster(clean_df.columns[1:].tolist(), roster),
+        'default_bulk_min': min(default_bulk_min, safe_input_max),
+        'default_bulk_max': min(default_bulk_max, safe_input_max),
+        'safe_input_max': safe_input_max,
+        'mandatory_dates': mandatory_dates,
+        'unknown_in_densuke': [],
+        'unanswered_members': [],
+        'status_table': None,
+    }
+    if roster is not None:
+        densuke_members = clean_df.columns[1:].tolist()
+        densuke_member_set = set(densuke_members)
+        member_index = status_matrix['member_index']
+        status_data = []
+        for name in roster['names']:
+            if not name: continue
+            if name not in member_index: answer = "未回答"
+            elif candidate_counts[member_index[name]] > 0: answer = "〇"
+            else: answer = "欠席"
+            status_data.append({"氏名": name, "状況": answer})
+        derived['unknown_in_densuke'] = sorted([m for m in densuke_members if m not in roster['rank']])
+        derived['unanswered_members'] = [m for m in roster['names'] if m not in densuke_member_set]
+        derived['status_table'] = pd.DataFrame(status_data) if status_data else None
+    return derived
+
 def update_static_caches():
     """
-    clean_dfが変更されたときに一度だけ実行し、
-    編集中に変わらない情報(status_map, valid_dates)を計算してsession_stateに保存する。
+    clean_df・部員名簿・名前の紐付けが変更されたときに一度だけ実行し、
+    編集中に変わらない情報(status_matrix と build_derived_data の集計)を計算してsession_stateに保存する。
     """
     if st.session_state.clean_df is None:
         return
-        
-    df = st.session_state.clean_df
-    members_list = df.columns[1:].tolist()
-    
-    # status_map: {(date, member): status}
-    status_map = {}
-    date_col_vals = df.iloc[:, 0].astype(str).str.strip().tolist()
-    for m in members_list:
-        m_vals = df[m].astype(str).str.strip().tolist()
-        for d_val, s_val in zip(date_col_vals, m_vals):
-            if s_val in ['○', '△']:
-                status_map[(d_val, m)] = s_val
-    
-    # valid_dates: {member: {d1, d2...}}
-    valid_dates_for_member = {}
-    for m in members_list:
-        s_series = df[m].astype(str).str.strip()
-        valid_days_bool = s_series.isin(['○', '△']).tolist()
-        valid_set = {d for d, is_valid in zip(date_col_vals, valid_days_bool) if is_valid}
-        valid_dates_for_member[m] = valid_set
-
-    st.session_state.status_map_cache = status_map
-    st.session_state.valid_dates_cache = valid_dates_for_member
-
-def refresh_editor_cache(current_df):
+    derived = build_derived_data(st.session_state.clean_df, st.session_state.roster_index)
+    derived['key'] = derived_data_key(st.session_state.clean_df, st.session_state.roster_index, st.session_state.name_mappings)
+    st.session_state.derived = derived
+    st.session_state.status_matrix = derived['status_matrix']
+    st.session_state.diagnosis = None
+
+def refresh_editor_cache(schedule):
     """
-    お稽古表(current_df)が変更されたときに実行し、表示用の辞書を一括更新する
+    生成・バックアップの読み込み・別案の切り替えでお稽古(schedule)が入れ替わったときに実行し、表示用の辞書を一括で作り直す
+    (手で移動・交換したときは update_editor_cache で部分的に更新する)
     """
-    if current_df is None: return
+    if schedule is None: return
 
-    # 1. 登場回数カウント & 表示名マップ
+    # 2回以上入っている部員に、日程順に丸数字を付ける {(部員インデックス, 日程インデックス): 表示名}
+    members = st.session_state.status_matrix['members']
+    assigned = schedule['assigned']
     display_name_map = {}
-    member_appearances = defaultdict(list)
-    curr_dates = current_df["日程"].tolist()
-    curr_assigns = current_df["担当者"].fillna("").astype(str).tolist()
-    
-    # 2. 現在のシフト状況（重複チェック用）
-    current_assignments_map = {} 
-
-    for d, assigned_str in zip(curr_dates, curr_assigns):
-        if assigned_str:
-            m_list = assigned_str.split(", ")
-            current_assignments_map[d] = set(m_list)
-            for m in m_list:
-                member_appearances[m].append(d)
-        else:
-            current_assignments_map[d] = set()
-            
-    # 日付順ランク
-    all_dates = st.session_state.settings_df["日程"].tolist()
-    date_rank_map = {d: i for i, d in enumerate(all_dates)}
-
-    for member, dates in member_appearances.items():
-        if len(dates) > 1:
-            dates.sort(key=lambda d: date_rank_map.get(d, 99999))
-            for i, d in enumerate(dates):
-                display_name_map[(member, d)] = f"{member}{get_circle_number(i+1)}"
-        else:
-            if dates: display_name_map[(member, dates[0])] = member
-            
-    st.session_state.editor_cache = {
-        'display_name_map': display_name_map,
-        'current_assignments_map': current_assignments_map,
-        'date_to_row': {row['日程']: idx for idx, row in current_df.iterrows()}
-    }
+    for j in np.flatnonzero(assigned.sum(axis=0) > 1).tolist():
+        for i, d in enumerate(np.flatnonzero(assigned[:, j]).tolist()):
+            display_name_map[(j, d)] = f"{members[j]}{get_circle_number(i + 1)}"
+
+    st.session_state.editor_cache = {'display_name_map': display_name_map}
+
+def update_editor_cache(schedule, moves):
+    """
+    移動・交換のあとに実行し、動かした部員の表示名(丸数字)だけを付け直す。
+    moves: editor.edit_transition が返す [(部員インデックス, 元の日程インデックス, 移動先の日程インデックス)]
+    """
+    if not st.session_state.editor_cache:
+        refresh_editor_cache(schedule)
+        return
+    members = st.session_state.status_matrix['members']
+    display_name_map = st.session_state.editor_cache['display_name_map']
+    for j, src, dst in moves:
+        days = np.flatnonzero(schedule['assigned'][:, j]).tolist()
+        for d in days + [src]:
+            display_name_map.pop((j, d), None)
+        if len(days) > 1:
+            for i, d in enumerate(days):
+                display_name_map[(j, d)] = f"{members[j]}{get_circle_number(i + 1)}"
 
 @st.cache_data(show_spinner=False)
 def load_and_clean_data(file):
@@ -412,17 +408,6 @@ def process_data_with_mapping(raw_df, name_mapping):
         
     return clean_df, comments_data, has_comment_row
 
-def sort_members_by_roster(member_list, roster_df):
-    if not member_list: return []
-    if roster_df is None:
-        member_list.sort()
-        return member_list
-    roster_names = [str(n).strip() for n in roster_df['氏名'].tolist()]
-    rank_map = {name: i for i, name in enumerate(roster_names)}
-    def get_rank(name): return rank_map.get(name, 999999)
-    member_list.sort(key=get_rank)
-    return member_list
-
 def format_comment_text(text):
     if not text: return ""
     safe_text = html_lib.escape(text)
@@ -433,171 +418,363 @@ def format_comment_text(text):
     safe_text = safe_text.replace("早退", f"<span style='{style_early}'>早退</span>")
     return safe_text
 
-def solve_shift_schedule(df, min_list, max_list, roster_df=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
-    dates = df.iloc[:, 0].fillna("").astype(str).str.strip().tolist()
-    members = df.columns[1:].tolist()
-    if len(dates) != len(min_list) or len(dates) != len(max_list): return None, False
-    
-    if member_targets is None:
-        member_targets = {}
+@st.cache_resource
+def get_solve_cache():
+    """
+    サーバー上の全セッションで共有する求解結果のLRUキャッシュ。
+    pending には計算中の入力のハッシュと、計算しているセッションが最後に知らせてきた時刻 (time.time()) を置く。
+    """
+    return {'entries': OrderedDict(), 'pending': {}, 'lock': threading.Lock()}
 
-    prob = pulp.LpProblem("Shift_Scheduler", pulp.LpMaximize)
-    x = pulp.LpVariable.dicts("assign", ((d, m) for d in range(len(dates)) for m in range(len(members))), cat='Binary')
-    
-    active_members_indices = []
-    for m_idx, member in enumerate(members):
-        s_series = df[member].astype(str).str.strip()
-        if any(s in ['○', '△'] for s in s_series):
-            active_members_indices.append(m_idx)
-
-    preference_scores = {}
-    for d_idx, date in enumerate(dates):
-        for m_idx, member in enumerate(members):
-            val = df.iloc[d_idx, m_idx + 1]
-            status = str(val).strip() if pd.notna(val) else "-"
-            score = 0
-            if status == "○": score = 2
-            elif status == "△": score = 1
-            else: prob += x[d_idx, m_idx] == 0
-            preference_scores[(d_idx, m_idx)] = score
-            
-    # ペナルティ設定（学年、連続勤務）
-    penalty_term = 0
-    
-    # 1. 学年重複ペナルティ
-    freshmen_indices = []
-    if roster_df is not None and '学年' in roster_df.columns:
-        member_grade_map = {str(row['氏名']).strip(): str(row['学年']).strip() for _, row in roster_df.iterrows()}
-        unique_grades = {g for g in set(member_grade_map.values()) if g and g.lower() != 'nan'}
-        
-        for m_idx, member in enumerate(members):
-            g_str = member_grade_map.get(member, "")
-            if g_str == "1" or "1年" in g_str:
-                freshmen_indices.append(m_idx)
-        
-        excess = pulp.LpVariable.dicts("excess", ((d, g) for d in range(len(dates)) for g in unique_grades), lowBound=0, cat='Integer')
-        for d in range(len(dates)):
-            for g in unique_grades:
-                grade_member_indices = [i for i, m in enumerate(members) if member_grade_map.get(m) == g]
-                if grade_member_indices:
-                    prob += pulp.lpSum([x[d, i] for i in grade_member_indices]) <= 1 + excess[d, g]
-        penalty_term += pulp.lpSum([excess[d, g] for d in range(len(dates)) for g in unique_grades]) * 10
-
-    # 2. 連続勤務ペナルティ (2回以上入る人のみ)
-    consecutive_penalty_vars = []
-    for m_idx, member in enumerate(members):
-        target = member_targets.get(member, 1)
-        if target > 1:
-             # 隣接する日程 (d, d+1)
-            for d in range(len(dates) - 1):
-                y_con = pulp.LpVariable(f"con_{d}_{m_idx}", cat='Binary')
-                prob += y_con >= x[d, m_idx] + x[d+1, m_idx] - 1
-                consecutive_penalty_vars.append(y_con)
-            
-            # 1日空き (d, d+2) も少しペナルティを与える
-            for d in range(len(dates) - 2):
-                y_gap1 = pulp.LpVariable(f"gap1_{d}_{m_idx}", cat='Binary')
-                prob += y_gap1 >= x[d, m_idx] + x[d+2, m_idx] - 1
-                consecutive_penalty_vars.append(y_gap1 * 0.5)
+def lookup_solve_cache(key):
+    """
+    共有キャッシュから、入力のハッシュ(solve_fingerprint)が key の結果 (お稽古のリスト, 成功したか, 全体の結果) を返す (無ければ None)。
+    各セッションで書き換えられるよう、返すDataFrameは毎回コピーする。
+    """
+    cache = get_solve_cache()
+    with cache['lock']:
+        if key not in cache['entries']: return None
+        cache['entries'].move_to_end(key)
+        schedules, success, report = cache['entries'][key]
+    return ([df.copy() for df in schedules] if schedules is not None else None), success, dict(report)
+
+def store_solve_cache(key, result):
+    """求解結果を共有キャッシュに入れる。条件を満たせないと分かった結果も入れる"""
+    cache = get_solve_cache()
+    with cache['lock']:
+        cache['entries'][key] = result
+        cache['entries'].move_to_end(key)
+        while len(cache['entries']) > SOLVE_CACHE_SIZE:
+            cache['entries'].popitem(last=False)
+
+def claim_solve_cache(key):
+    """
+    入力のハッシュが key の計算をこのセッションで始めることを登録する。
+    ほかのセッションが同じ入力を計算中なら登録せずに False を返す (その結果が共有キャッシュに入るのを待つ)。
+    """
+    cache = get_solve_cache()
+    now = time.time()
+    with cache['lock']:
+        seen = cache['pending'].get(key)
+        if seen is not None and now - seen < SOLVE_PENDING_TIMEOUT: return False
+        cache['pending'][key] = now
+    return True
+
+def touch_solve_cache(key):
+    """計算中であることを知らせ直す (計算中の経過を表示するたびに呼ぶ。途絶えると、待っているセッションが自分で計算する)"""
+    cache = get_solve_cache()
+    with cache['lock']:
+        if key in cache['pending']: cache['pending'][key] = time.time()
+
+def is_solve_pending(key):
+    """ほかのセッションが入力のハッシュ key を計算中か"""
+    cache = get_solve_cache()
+    with cache['lock']:
+        seen = cache['pending'].get(key)
+    return seen is not None and time.time() - seen < SOLVE_PENDING_TIMEOUT
+
+def release_solve_cache(key):
+    """計算が終わった (結果を共有キャッシュに入れたか、入れずに終えた) ことを登録する"""
+    cache = get_solve_cache()
+    with cache['lock']:
+        cache['pending'].pop(key, None)
+
+def get_solve_worker():
+    """
+    このセッション専用の計算用プロセス(solver.solve_worker)を返す。まだ無いか、終了していれば起動し直す。
+    Streamlitのスクリプトを止めずに計算でき、中断(SIGINT)もこのプロセスにだけ送れる。
+    """
+    worker = st.session_state.get('solve_worker')
+    if worker is None or not worker['process'].is_alive():
+        context = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=solve_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = {'process': process, 'conn': parent_conn}
+        st.session_state.solve_worker = worker
+    return worker
+
+def apply_solve_result(schedules, settings, repair_report=None):
+    """計算できたお稽古(別案のDataFrameのリスト)を、編集用の形にして画面の状態に反映する"""
+    status_matrix = st.session_state.status_matrix
+    ranks = member_ranks(status_matrix, st.session_state.roster_index)
+    st.session_state.shift_alternatives = [schedule_from_df(status_matrix, df, ranks) for df in schedules]
+    st.session_state.alternative_index = 0
+    st.session_state.shift_result = copy_schedule(st.session_state.shift_alternatives[0])
+    st.session_state.solved_settings = settings
+    st.session_state.repair_report = repair_report
+    st.session_state.edit_revision += 1
+    st.session_state.diagnosis = None
+    st.session_state.solve_notice = None
+    refresh_editor_cache(st.session_state.shift_result)
+
+def apply_cached_solve(status_matrix, settings, cached):
+    """共有キャッシュにあった結果 (お稽古のリスト, 成功したか, 全体の結果) を反映する。解けない結果なら原因を調べる"""
+    st.session_state.solve_log.append({'cached': True})
+    schedules, success, st.session_state.solve_report = cached
+    if success:
+        apply_solve_result(schedules, settings)
+    else:
+        st.session_state.diagnosis = diagnose_infeasibility(status_matrix, settings['min'], settings['max'], st.session_state.roster_index, settings['fmin'], settings['fmax'], member_targets=st.session_state.member_targets)
+
+def start_solve_job(status_matrix, settings, initial_solution=None):
+    """
+    お稽古の計算をバックグラウンドで始める。同じ条件の結果が共有キャッシュにあれば、計算せずにそのまま反映する。
+    ほかのセッションが同じ条件を計算中なら、計算せずにその結果を待つ。
+    計算中の情報は st.session_state.solve_job に置き、結果は finish_solve_job で受け取る。
+    """
+    roster = st.session_state.roster_index
+    member_targets = st.session_state.member_targets
+    profile = st.session_state.solver_profile
+    st.session_state.solve_log = []
+    st.session_state.solve_report = None
+    st.session_state.solve_notice = None
+    key = solve_fingerprint(status_matrix, settings['min'], settings['max'], roster, settings['fmin'], settings['fmax'], member_targets, ALTERNATIVE_COUNT, profile, initial_solution=initial_solution)
+    cached = lookup_solve_cache(key)
+    if cached is not None:
+        apply_cached_solve(status_matrix, settings, cached)
+        return
+    if not claim_solve_cache(key):
+        st.session_state.solve_job = {
+            'kind': 'wait', 'key': key, 'settings': settings, 'status_matrix': status_matrix, 'initial_solution': initial_solution,
+            'progress_dir': None, 'started': time.time(), 'cancelled': False,
+        }
+        return
 
-    if consecutive_penalty_vars:
-        penalty_term += pulp.lpSum(consecutive_penalty_vars) * 50
+    worker = get_solve_worker()
+    progress_dir = tempfile.mkdtemp(prefix="okeiko_")
+    worker['conn'].send({
+        'status_matrix': status_matrix, 'min_list': settings['min'], 'max_list': settings['max'], 'roster': roster,
+        'fresh_min_list': settings['fmin'], 'fresh_max_list': settings['fmax'], 'member_targets': member_targets,
+        'k': ALTERNATIVE_COUNT, 'initial_solution': initial_solution, 'progress_dir': progress_dir, 'profile': profile,
+    })
+    st.session_state.solve_job = {
+        'kind': 'solve', 'key': key, 'settings': settings, 'status_matrix': status_matrix, 'progress_dir': progress_dir,
+        'started': time.time(), 'cancelled': False,
+    }
 
-    base_score = pulp.lpSum([x[d, m] * preference_scores[(d, m)] for d in range(len(dates)) for m in range(len(members))])
-    prob += base_score - penalty_term
-    
-    # 制約: 各メンバーの合計参加回数
-    for m_idx, member in enumerate(members):
-        if m_idx in active_members_indices:
-            target = member_targets.get(member, 1)
-            prob += pulp.lpSum([x[d, m_idx] for d in range(len(dates))]) == target
+def start_repair_job(status_matrix, settings, changed_dates):
+    """
+    手で編集したお稽古を残したまま、影響のある部分だけをバックグラウンドで解き直す (solver.repair_shift_schedule)。
+    結果は finish_solve_job で受け取る。編集中のお稽古に対する計算なので、共有キャッシュは使わない。
+    """
+    st.session_state.solve_log = []
+    st.session_state.solve_report = None
+    st.session_state.solve_notice = None
+    worker = get_solve_worker()
+    progress_dir = tempfile.mkdtemp(prefix="okeiko_")
+    worker['conn'].send({
+        'status_matrix': status_matrix, 'current_df': schedule_to_df(status_matrix, st.session_state.shift_result),
+        'min_list': settings['min'], 'max_list': settings['max'], 'roster': st.session_state.roster_index,
+        'fresh_min_list': settings['fmin'], 'fresh_max_list': settings['fmax'], 'member_targets': st.session_state.member_targets,
+        'changed_dates': changed_dates, 'profile': st.session_state.solver_profile,
+    })
+    st.session_state.solve_job = {
+        'kind': 'repair', 'settings': settings, 'status_matrix': status_matrix, 'progress_dir': progress_dir,
+        'started': time.time(), 'cancelled': False,
+    }
+
+def start_sweep_job(status_matrix, points):
+    """
+    人数設定の組み合わせ (points: [{'min', 'max', 'fmin', 'fmax', 'settings'}]) をまとめてバックグラウンドで解き比べる。
+    共有キャッシュにある設定は解かずに使い、結果は st.session_state.sweep_result に置く (finish_solve_job で受け取る)。
+    """
+    roster = st.session_state.roster_index
+    member_targets = st.session_state.member_targets
+    profile = st.session_state.solver_profile
+    pending = []
+    for point in points:
+        settings = point['settings']
+        point['key'] = solve_fingerprint(status_matrix, settings['min'], settings['max'], roster, settings['fmin'], settings['fmax'], member_targets, ALTERNATIVE_COUNT, profile)
+        cached = lookup_solve_cache(point['key'])
+        if cached is None:
+            point['success'], point['status'], point['objective'] = False, None, None
+            pending.append(point)
         else:
-            prob += pulp.lpSum([x[d, m_idx] for d in range(len(dates))]) == 0
-    
-    # 制約: 各日程の人数
-    for d in range(len(dates)):
-        total_assigned = pulp.lpSum([x[d, m] for m in range(len(members))])
-        val_min = int(min_list[d]) if pd.notna(min_list[d]) else 0
-        val_max = int(max_list[d]) if pd.notna(max_list[d]) else 1
-        prob += total_assigned >= val_min
-        prob += total_assigned <= val_max
-        
-        if freshmen_indices:
-            if fresh_min_list is not None and pd.notna(fresh_min_list[d]):
-                f_min = int(fresh_min_list[d])
-                prob += pulp.lpSum([x[d, m] for m in freshmen_indices]) >= f_min
-            if fresh_max_list is not None and pd.notna(fresh_max_list[d]):
-                f_max = int(fresh_max_list[d])
-                prob += pulp.lpSum([x[d, m] for m in freshmen_indices]) <= f_max
-
-    prob.solve(pulp.PULP_CBC_CMD(msg=0))
-    
-    if pulp.LpStatus[prob.status] == "Optimal":
-        results = []
-        for d in range(len(dates)):
-            assigned = [members[m] for m in range(len(members)) if pulp.value(x[d, m]) == 1]
-            assigned = sort_members_by_roster(assigned, roster_df)
-            results.append({"日程": dates[d], "担当者": ", ".join(assigned), "人数": len(assigned)})
-        return pd.DataFrame(results), True
-    return None, False
-
-def get_status(df, date_val, member_name):
-    row = df[df.iloc[:, 0].astype(str).str.strip() == date_val]
-    if row.empty: return "-"
-    val = row.iloc[0][member_name]
-    return str(val).strip() if pd.notna(val) else "-"
-
-def can_member_move(df, current_date, member_name):
-    dates_col = df.iloc[:, 0].astype(str).str.strip()
-    status_col = df[member_name].astype(str).str.strip()
-    movable_days = df[(dates_col != current_date) & (status_col.isin(['○', '△']))]
-    return not movable_days.empty
-
-def get_member_display_name(member_name, current_date, result_df):
-    member_dates = []
-    for _, row in result_df.iterrows():
-        assigned_str = str(row['担当者'])
-        if pd.notna(assigned_str):
-            assigned_list = assigned_str.split(", ")
-            if member_name in assigned_list:
-                member_dates.append(row['日程'])
-    
-    total_shifts = len(member_dates)
-    if total_shifts <= 1:
-        return member_name
-    
+            _, point['success'], report = cached
+            point['status'], point['objective'] = report['status'], report['objective']
+    st.session_state.sweep_result = {'status_matrix': status_matrix, 'points': points}
+    if not pending: return
+
+    worker = get_solve_worker()
+    progress_dir = tempfile.mkdtemp(prefix="okeiko_")
+    worker['conn'].send({
+        'status_matrix': status_matrix, 'settings_list': [point['settings'] for point in pending], 'roster': roster,
+        'member_targets': member_targets, 'k': ALTERNATIVE_COUNT, 'progress_dir': progress_dir, 'profile': profile,
+    })
+    st.session_state.solve_job = {
+        'kind': 'sweep', 'points': pending, 'status_matrix': status_matrix, 'progress_dir': progress_dir,
+        'started': time.time(), 'cancelled': False,
+    }
+
+def apply_sweep_point(index):
+    """比較表で押された人数設定を全日程の設定に反映し、計算済みのお稽古を表示する"""
+    point = st.session_state.sweep_result['points'][index]
+    st.session_state.global_min = point['min']
+    st.session_state.global_max = point['max']
+    apply_global_settings()
+    st.session_state.settings_df["1年生最小"] = point['fmin']
+    st.session_state.settings_df["1年生最大"] = point['fmax']
+    for i in range(len(st.session_state.settings_df)):
+        # 1年生の人数の入力欄は settings_df の値から作り直させる
+        st.session_state.pop(f"fmin_{i}", None)
+        st.session_state.pop(f"fmax_{i}", None)
+    st.session_state.confirm_overwrite = False
+    st.session_state.diagnosis = None
+    start_solve_job(st.session_state.status_matrix, point['settings'])
+
+def cancel_solve_job():
+    """計算を中断する。CBCは途中で見つけた最良の解を返す"""
+    job = st.session_state.get('solve_job')
+    worker = st.session_state.get('solve_worker')
+    if job is not None and job['kind'] == 'wait':
+        job['cancelled'] = True  # 計算しているのはほかのセッションなので、待つのをやめるだけ
+        return
+    if job is None or worker is None: return
+    job['cancelled'] = True
     try:
-        idx = member_dates.index(current_date)
-        return f"{member_name}{get_circle_number(idx + 1)}"
-    except ValueError:
-        return member_name
+        os.killpg(worker['process'].pid, signal.SIGINT)  # 計算用プロセスとCBCは同じプロセスグループ
+    except (AttributeError, ProcessLookupError, PermissionError):
+        worker['process'].terminate()
 
-# --- UI部分 ---
-st.title("🍵 お稽古メーカー")
-st.write("PCもしくはiPadでの操作をお勧めします。スマートフォンの場合は画面を横向きにすると操作しやすいです。")
+def finish_solve_job(status_matrix):
+    """
+    バックグラウンドの計算が終わっていれば結果を受け取って反映する。終わっていなければ何もしない。
+    計算中に出欠表が変わっていれば結果は捨てる。中断して得た解や、時間切れで解けなかった結果は共有キャッシュには入れない。
+    ほかのセッションの計算を待っているときは、結果が共有キャッシュに入るか、その計算が結果を残さずに終わるまで待つ。
+    """
+    job = st.session_state.get('solve_job')
+    if job is None: return
+    if job['kind'] == 'wait':
+        # 計算中かを先に見る (結果を入れてから計算中の登録を消すので、この順なら結果を見落とさない)
+        pending = is_solve_pending(job['key'])
+        cached = lookup_solve_cache(job['key'])
+        if cached is None and pending and not job['cancelled']: return
+        st.session_state.solve_job = None
+        if job['status_matrix'] is not status_matrix: return
+        if job['cancelled']:
+            st.session_state.solve_notice = ('warning', "計算を中断しました。")
+        elif cached is None:
+            # 中断・時間切れ・画面を閉じたなどで結果が残らなかったので、このセッションで計算する
+            start_solve_job(status_matrix, job['settings'], job['initial_solution'])
+        else:
+            apply_cached_solve(status_matrix, job['settings'], cached)
+        return
+    worker = st.session_state.get('solve_worker')
+    try:
+        if worker is not None and worker['process'].is_alive() and not worker['conn'].poll():
+            return
+        kind, payload = worker['conn'].recv() if worker is not None else ('error', "計算用のプロセスがありません。")
+    except (EOFError, OSError):
+        kind, payload = 'error', "計算用のプロセスが終了しました。"
+    st.session_state.solve_job = None
+    shutil.rmtree(job['progress_dir'], ignore_errors=True)
+    if kind == 'error':
+        if job['kind'] == 'solve': release_solve_cache(job['key'])
+        st.session_state.solve_notice = ('warning', "計算を中断しました。") if job['cancelled'] else ('error', f"計算中にエラーが発生しました: {payload}")
+        return
+    if job['kind'] == 'sweep':
+        results, stopped = payload
+        if stopped: st.session_state.solve_notice = ('warning', "比較を中断しました。計算し終えた設定だけを表示しています。")
+        for point, result in zip(job['points'], results):
+            if result is None: continue
+            schedules, success, report = result
+            point['success'], point['status'], point['objective'] = success, report['status'], report['objective']
+            # 表から選んだときに計算し直さずに済むよう、お稽古生成と同じ条件で共有キャッシュに入れる
+            if not stopped and (success or report['status'] == 'infeasible'):
+                store_solve_cache(point['key'], (schedules, success, report))
+        return
+    if job['kind'] == 'repair':
+        schedule, success, moved_members, stopped = payload
+        if job['status_matrix'] is not status_matrix: return
+        settings = job['settings']
+        if success:
+            # ほかの別案は古い条件で作ったものなので捨てる
+            apply_solve_result([schedule], settings, repair_report=moved_members)
+            if stopped: st.session_state.solve_notice = ('warning', "計算を中断しました。それまでに見つかった割り当てで直しています(最適とは限りません)。")
+        elif stopped:
+            st.session_state.solve_notice = ('warning', "計算を中断しました。お稽古は変更していません。")
+        else:
+            st.session_state.diagnosis = diagnose_infeasibility(status_matrix, settings['min'], settings['max'], st.session_state.roster_index, settings['fmin'], settings['fmax'], member_targets=st.session_state.member_targets)
+        return
+    schedules, success, solve_log, report, stopped = payload
+    # 同じ条件を待っているセッションがあるので、出欠表が変わっていても結果は共有キャッシュに入れる
+    if not stopped and (success or report['status'] in ('infeasible', None)):
+        store_solve_cache(job['key'], (schedules, success, report))
+    release_solve_cache(job['key'])
+    if job['status_matrix'] is not status_matrix: return
+    st.session_state.solve_log = solve_log
+    st.session_state.solve_report = report
+    settings = job['settings']
+    if success:
+        apply_solve_result(schedules, settings)
+        if stopped: st.session_state.solve_notice = ('warning', "計算を中断しました。それまでに見つかった最良のお稽古を表示しています(最適とは限りません)。")
+    elif stopped:
+        st.session_state.solve_notice = ('warning', "計算を中断しました。条件を満たすお稽古はまだ見つかっていませんでした。")
+    elif report['status'] not in ('infeasible', None):
+        st.session_state.solve_notice = ('warning', "時間の上限までに条件を満たすお稽古が見つかりませんでした。計算モードを変えて試してください。")
+    else:
+        st.session_state.diagnosis = diagnose_infeasibility(job['status_matrix'], settings['min'], settings['max'], st.session_state.roster_index, settings['fmin'], settings['fmax'], member_targets=st.session_state.member_targets)
+
+@st.fragment(run_every=1)
+def show_solve_progress():
+    """計算中の経過時間・暫定解・ギャップを1秒ごとに表示する。終わったら画面全体を描き直す"""
+    job = st.session_state.get('solve_job')
+    if job is None: return
+    if job['kind'] == 'wait':
+        if job['cancelled'] or not is_solve_pending(job['key']):
+            st.rerun()
+    else:
+        worker = st.session_state.get('solve_worker')
+        if worker is None or not worker['process'].is_alive() or worker['conn'].poll():
+            st.rerun()
+    if job['kind'] == 'solve':
+        touch_solve_cache(job['key'])
+    progress = read_cbc_progress(job['progress_dir']) if job['kind'] == 'solve' else None
+    elapsed = time.time() - job['started']
+    c_info, c_cancel = st.columns([3, 1])
+    with c_info:
+        if job['cancelled']:
+            st.info(f"⏳ 中断しています...(経過 {elapsed:.0f}秒)")
+        elif job['kind'] == 'wait':
+            st.info(f"⏳ 同じ条件のお稽古をほかの画面で計算中です。その結果を待っています...(経過 {elapsed:.0f}秒)")
+        elif job['kind'] == 'sweep':
+            done, total = read_sweep_progress(job['progress_dir']) or (0, len(job['points']))
+            st.info(f"⏳ 人数設定を比べています...(経過 {elapsed:.0f}秒、{done}/{total}件)")
+        elif job['kind'] == 'repair':
+            st.info(f"⏳ 編集を残して修正しています...(経過 {elapsed:.0f}秒)")
+        elif progress['incumbent'] is None:
+            st.info(f"⏳ 計算中...(経過 {elapsed:.0f}秒)")
+        else:
+            # 目的関数は「ペナルティ − 希望度」の最小化なので、符号を反転して「良さ」として見せる
+            st.info(f"⏳ 計算中...(経過 {elapsed:.0f}秒) 暫定解のスコア {-progress['incumbent']:g}、最適までの差(ギャップ) {progress['gap']:.1%}")
+    with c_cancel:
+        if st.button("計算を中断", key="cancel_solve_btn", use_container_width=True, disabled=job['cancelled']):
+            cancel_solve_job()
+            st.rerun(scope="fragment")
 
-# セッション状態
-if 'shift_result' not in st.session_state: st.session_state.shift_result = None
-if 'editing_member' not in st.session_state: st.session_state.editing_member = None 
-if 'editing_date' not in st.session_state: st.session_state.editing_date = None
-if 'roster_df' not in st.session_state: st.session_state.roster_df = None
-if 'comments_data' not in st.session_state: st.session_state.comments_data = {}
-if 'has_comment_row' not in st.session_state: st.session_state.has_comment_row = False
-if 'clean_df' not in st.session_state: st.session_state.clean_df = None
-if 'raw_df' not in st.session_state: st.session_state.raw_df = None 
-if 'name_mappings' not in st.session_state: st.session_state.name_mappings = {} 
-if 'mapping_source_selected' not in st.session_state: st.session_state.mapping_source_selected = None 
-if 'loaded_resume_name' not in st.session_state: st.session_state.loaded_resume_name = None
-if 'confirm_overwrite' not in st.session_state: st.session_state.confirm_overwrite = False
-if 'confirm_reset' not in st.session_state: st.session_state.confirm_reset = False
-if 'memo_text' not in st.session_state: st.session_state.memo_text = ""
-if 'member_targets' not in st.session_state: st.session_state.member_targets = {}
-if 'status_map_cache' not in st.session_state: st.session_state.status_map_cache = {}
-if 'valid_dates_cache' not in st.session_state: st.session_state.valid_dates_cache = {}
-if 'editor_cache' not in st.session_state: st.session_state.editor_cache = {}
+# お稽古の編集グリッド (edit_grid/index.html)。選択中の状態はブラウザ側に持ち、移動・交換だけを on_grid_edit で受け取る
+edit_grid = components.declare_component("edit_grid", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "edit_grid"))
 
-# --- 手順1 (読み込み) ---
-st.markdown("### 1. アップロード")
+def on_grid_edit():
+    """
+    編集グリッドから返ってきた移動・交換を、スクリプトを実行し直す前にお稽古に反映する (edit_grid の on_change)。
+    表示中のお稽古 (edit_revision) に対する編集で、editor.edit_transition の規則に合うときだけ、その場で書き換える。
+    """
+    moves = apply_grid_edit(st.session_state.status_matrix, st.session_state.shift_result, st.session_state.edit_revision, st.session_state.edit_grid)
+    if moves is None: return
+    st.session_state.edit_revision += 1
+    update_editor_cache(st.session_state.shift_result, moves)
+
+def switch_alternative():
+    """別案の切り替え (手で編集した内容は案ごとに残す)"""
+    alternatives = st.session_state.shift_alternatives
+    alternatives[st.session_state.alternative_index] = st.session_state.shift_result
+    st.session_state.alternative_index = st.session_state.alternative_radio
+    st.session_state.shift_result = copy_schedule(alternatives[st.session_state.alternative_index])
+    st.session_state.edit_revision += 1
+    refresh_editor_cache(st.session_state.shift_result)
 
 help_text_densuke = """
 伝助のCSVファイルのダウンロード方法:
@@ -605,32 +782,6 @@ help_text_densuke = """
 2. コメントの「出力する」にチェックを入れ、「CSV形式で登録データを出力する」をクリックする
 3. 「CSVデータを取得する」をクリックするとダウンロードができる
 """
-uploaded_file = st.file_uploader("**伝助のCSVファイル**", type=['csv'], help=help_text_densuke)
-
-if uploaded_file is not None:
-    try:
-        if 'last_filename' not in st.session_state or st.session_state.last_filename != uploaded_file.name:
-            raw_df = load_and_clean_data(uploaded_file)
-            
-            cols_str = [str(c) for c in raw_df.columns]
-            if '氏名' in cols_str and '学年' in cols_str:
-                st.error("エラー：伝助ではなく、部員名簿のCSVファイルがアップロードされた可能性があります。")
-            else:
-                st.session_state.raw_df = raw_df
-                st.session_state.name_mappings = {} 
-                
-                clean_df, comments_data, has_comment_row = process_data_with_mapping(raw_df, {})
-                st.session_state.clean_df = clean_df
-                st.session_state.comments_data = comments_data
-                st.session_state.has_comment_row = has_comment_row
-                st.session_state.last_filename = uploaded_file.name
-                st.session_state.shift_result = None
-                st.session_state.member_targets = {}
-                update_static_caches()
-                st.rerun()
-            
-    except Exception as e:
-        st.error(f"ファイル読み込みエラー: {e}")
 
 help_text_roster = """以下のメリットより、部員名簿のアップロードを強く推奨します。  
 ・伝助未回答の部員が一目で分かる  
@@ -646,55 +797,527 @@ help_text_roster = """以下のメリットより、部員名簿のアップロ
 森下,6 (6年生の森下さん)  
 山田,4,7 (4年生のお稽古カウンターが7回の山田さん)"""
 
-uploaded_roster = st.file_uploader("**(任意) 部員名簿のCSVファイル**", type=['csv'], key="roster", help=help_text_roster)
+help_text_resume = """※iPadの場合、"Browse files"をタップしても.okeikoファイルを選択できません。
+画面にブラウザとファイルアプリを同時に開き、ファイルアプリで.okeikoファイルを長押しして、ブラウザにドラッグアンドドロップすることでアップロードできます。"""
 
-if uploaded_roster is not None:
-    try:
-        if 'last_roster_name' not in st.session_state or st.session_state.last_roster_name != uploaded_roster.name:
-            roster_df = load_roster_data(uploaded_roster)
-            
-            if '氏名' not in roster_df.columns:
-                st.error("エラー：部員名簿ではなく、伝助のCSVファイルがアップロードされた可能性があります。")
+@st.fragment
+def show_uploads():
+    """伝助・部員名簿・バックアップのアップロード (読み込んだときだけ画面全体を描き直す)"""
+    uploaded_file = st.file_uploader("**伝助のCSVファイル**", type=['csv'], help=help_text_densuke)
+
+    if uploaded_file is not None:
+        try:
+            if 'last_filename' not in st.session_state or st.session_state.last_filename != uploaded_file.name:
+                raw_df = load_and_clean_data(uploaded_file)
+
+                cols_str = [str(c) for c in raw_df.columns]
+                if '氏名' in cols_str and '学年' in cols_str:
+                    st.error("エラー：伝助ではなく、部員名簿のCSVファイルがアップロードされた可能性があります。")
+                else:
+                    st.session_state.raw_df = raw_df
+                    st.session_state.name_mappings = {} 
+
+                    clean_df, comments_data, has_comment_row = process_data_with_mapping(raw_df, {})
+                    st.session_state.clean_df = clean_df
+                    st.session_state.comments_data = comments_data
+                    st.session_state.has_comment_row = has_comment_row
+                    st.session_state.last_filename = uploaded_file.name
+                    st.session_state.shift_result = None
+                    st.session_state.shift_alternatives = []
+                    st.session_state.member_targets = {}
+                    update_static_caches()
+                    st.rerun()
+
+        except Exception as e:
+            st.error(f"ファイル読み込みエラー: {e}")
+
+
+    uploaded_roster = st.file_uploader("**(任意) 部員名簿のCSVファイル**", type=['csv'], key="roster", help=help_text_roster)
+
+    if uploaded_roster is not None:
+        try:
+            if 'last_roster_name' not in st.session_state or st.session_state.last_roster_name != uploaded_roster.name:
+                roster_df = load_roster_data(uploaded_roster)
+
+                if '氏名' not in roster_df.columns:
+                    st.error("エラー：部員名簿ではなく、伝助のCSVファイルがアップロードされた可能性があります。")
+                else:
+                    st.session_state.roster_df = roster_df
+                    st.session_state.roster_index = build_roster(roster_df)
+                    st.session_state.last_roster_name = uploaded_roster.name
+                    st.rerun()
+        except Exception as e:
+            st.error(f"名簿読み込みエラー: {e}")
+
+    st.write("")
+    with st.expander("保存した作業を再開"):
+        uploaded_resume = st.file_uploader("**バックアップファイル (.okeiko)**", type=['okeiko'], key="resume_uploader", help=help_text_resume)
+        if uploaded_resume is not None:
+            if st.session_state.loaded_resume_name != uploaded_resume.name:
+                try:
+                    uploaded_resume.seek(0)
+                    resume_data = pickle.load(uploaded_resume)
+                    st.session_state.clean_df = resume_data.get('clean_df')
+                    st.session_state.roster_df = resume_data.get('roster_df')
+                    st.session_state.roster_index = build_roster(st.session_state.roster_df)
+                    st.session_state.alternative_index = resume_data.get('alternative_index', 0)
+                    st.session_state.solved_settings = resume_data.get('solved_settings')
+                    st.session_state.repair_report = None
+                    st.session_state.settings_df = resume_data.get('settings_df')
+                    st.session_state.comments_data = resume_data.get('comments_data', {})
+                    st.session_state.has_comment_row = resume_data.get('has_comment_row', False)
+                    st.session_state.raw_df = resume_data.get('raw_df', None)
+                    st.session_state.name_mappings = resume_data.get('name_mappings', {})
+                    st.session_state.memo_text = resume_data.get('memo_text', "")
+                    st.session_state.member_targets = resume_data.get('member_targets', {})
+
+                    st.session_state.loaded_resume_name = uploaded_resume.name
+                    st.session_state.confirm_overwrite = False
+                    st.session_state.confirm_reset = False
+
+                    update_static_caches() 
+                    # お稽古は保存ファイルではDataFrameなので、編集用の形に戻す
+                    status_matrix = st.session_state.status_matrix
+                    ranks = member_ranks(status_matrix, st.session_state.roster_index)
+                    result_df = resume_data.get('shift_result')
+                    st.session_state.shift_result = schedule_from_df(status_matrix, result_df, ranks) if result_df is not None else None
+                    st.session_state.shift_alternatives = [schedule_from_df(status_matrix, df, ranks) for df in resume_data.get('shift_alternatives', [])]
+                    refresh_editor_cache(st.session_state.shift_result)
+                    st.success("作業データを復元しました。")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"ファイル読み込みエラー: {e}")
+        else:
+            st.session_state.loaded_resume_name = None
+
+@st.fragment
+def show_member_status(derived):
+    """部員の回答状況と名前の紐付け (紐付けの選択中はこの部分だけ描き直す)"""
+    roster = st.session_state.roster_index
+    with st.expander("部員の回答状況を表示", expanded=True):
+        unknown_in_densuke = derived['unknown_in_densuke']
+        unanswered_members = derived['unanswered_members']
+
+        if unknown_in_densuke:
+            st.warning(f"【{len(unknown_in_densuke)}名】 部員名簿に無い名前が伝助に見つかりました(表記ゆれや旧字体、重複の可能性あり):\n\n{', '.join(unknown_in_densuke)}")
+
+        if unknown_in_densuke and unanswered_members:
+            col_map_msg_L, col_map_msg_R = st.columns([1, 1.5])
+            with col_map_msg_L:
+                st.markdown("**「部員名簿に無い名前」を部員名簿と紐付けする**")
+            with col_map_msg_R:
+                if st.session_state.mapping_source_selected:
+                    st.error(f"選択中: **{st.session_state.mapping_source_selected}** → 右側から対応する名前をクリックしてください", icon="✏️")
+                else:
+                    st.info("まずは左側から紐付けしたい名前を選んでください")
+
+            col_map_L, col_map_R = st.columns(2)
+
+            with col_map_L:
+                st.markdown("部員名簿に無い名前")
+                for unk_name in unknown_in_densuke:
+                    label = unk_name
+                    if st.session_state.mapping_source_selected == unk_name:
+                        label += "\u200b"
+
+                    if st.button(label, key=f"src_{unk_name}", use_container_width=True):
+                        if st.session_state.mapping_source_selected == unk_name:
+                            st.session_state.mapping_source_selected = None
+                        else:
+                            st.session_state.mapping_source_selected = unk_name
+                        st.rerun(scope="fragment")
+
+            with col_map_R:
+                st.markdown("部員名簿")
+                for mis_name in unanswered_members:
+                    if st.button(mis_name, key=f"tgt_{mis_name}", use_container_width=True):
+                        if st.session_state.mapping_source_selected:
+                            src = st.session_state.mapping_source_selected
+                            st.session_state.name_mappings[src] = mis_name
+                            st.session_state.mapping_source_selected = None
+
+                            if st.session_state.raw_df is not None:
+                                clean_df, comments_data, has_comment_row = process_data_with_mapping(st.session_state.raw_df, st.session_state.name_mappings)
+                                st.session_state.clean_df = clean_df
+                                st.session_state.comments_data = comments_data
+                                st.session_state.has_comment_row = has_comment_row
+                                st.session_state.shift_result = None
+                                st.session_state.shift_alternatives = []
+                                update_static_caches()
+                            st.success(f"{src} を {mis_name} として統合しました")
+                            st.rerun()
+
+        if st.session_state.name_mappings:
+            st.markdown("**設定された紐付け**")
+
+            sorted_mappings = sorted(
+                st.session_state.name_mappings.items(),
+                key=lambda item: roster['rank'].get(item[1], 999999)
+            )
+
+            for old, new in sorted_mappings:
+                col_btn, col_txt, col_empty = st.columns([0.6, 2.5, 6])
+                with col_btn:
+                    if st.button("解除", key=f"del_map_{old}"):
+                        del st.session_state.name_mappings[old]
+                        if st.session_state.raw_df is not None:
+                            clean_df, comments_data, has_comment_row = process_data_with_mapping(st.session_state.raw_df, st.session_state.name_mappings)
+                            st.session_state.clean_df = clean_df
+                            st.session_state.comments_data = comments_data
+                            st.session_state.has_comment_row = has_comment_row
+                            st.session_state.shift_result = None
+                            st.session_state.shift_alternatives = []
+                            update_static_caches()
+                        st.rerun()
+                with col_txt:
+                    st.markdown(f"<div style='line-height: 34px;'>{old} ➡ {new}</div>", unsafe_allow_html=True)
+
+        has_mapping_context = (len(unknown_in_densuke) > 0) or (len(st.session_state.name_mappings) > 0)
+        if has_mapping_context and unanswered_members:
+             st.markdown("<hr style='margin: 10px 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
+
+        if unanswered_members:
+            st.error(f"【{len(unanswered_members)}名】 未回答者:\n\n{', '.join(unanswered_members)}")
+
+        status_table = derived['status_table']
+        if status_table is not None:
+            st.markdown(f"部員名簿(部員数:<span style='font-weight:bold; font-size:1.2em;'>{len(status_table)}</span>名)", unsafe_allow_html=True)
+            st.dataframe(status_table, hide_index=True, use_container_width=True)
+
+@st.fragment
+def show_date_settings(derived):
+    """
+    日程ごとの人数の設定 (入力を変えてもこの部分だけ描き直す)。
+    入力した値はその都度 settings_df に書き戻し、生成・比較のときは read_date_settings で読む。
+    """
+    safe_input_max = derived['safe_input_max']
+    mandatory_dates = derived['mandatory_dates']
+    has_roster = st.session_state.roster_index is not None
+    diagnosis_dates = {d for f in (st.session_state.diagnosis or []) for d in f['dates']}
+    with st.expander("人数の詳細設定", expanded=bool(diagnosis_dates)):
+        if has_roster:
+            st.write("各日程ごとに部員の最小・最大人数を設定できます。一年生の最小・最大人数も設定できます。チェックボックスを外すと、その日程をお稽古日から外せます。")
+            h_col1, h_col2, h_col3, h_col4, h_col5, h_col6 = st.columns([0.5, 2, 1, 1, 1, 1])
+            h_col1.write("")
+            h_col2.markdown("**日程**")
+            h_col3.markdown("**最小**")
+            h_col4.markdown("**最大**")
+            h_col5.markdown("**1年最小**")
+            h_col6.markdown("**1年最大**")
+        else:
+            st.write("各日程ごとに部員の最小・最大人数を設定できます。チェックボックスを外すと、その日程をお稽古日から外せます。")
+            h_col1, h_col2, h_col3, h_col4 = st.columns([0.5, 2, 1, 1])
+            h_col1.write("")
+            h_col2.markdown("**日程**")
+            h_col3.markdown("**最小**")
+            h_col4.markdown("**最大**")
+
+        st.markdown("<hr style='margin: 0px 0px 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
+
+        dates = st.session_state.settings_df["日程"].tolist()
+
+        updated_enabled = []
+        updated_min = []
+        updated_max = []
+        updated_fmin = []
+        updated_fmax = []
+
+        for i, date_val in enumerate(dates):
+            if has_roster:
+                c1, c2, c3, c4, c5, c6 = st.columns([0.5, 2, 1, 1, 1, 1])
             else:
-                st.session_state.roster_df = roster_df
-                st.session_state.last_roster_name = uploaded_roster.name
-                st.rerun()
-    except Exception as e:
-        st.error(f"名簿読み込みエラー: {e}")
+                c1, c2, c3, c4 = st.columns([0.5, 2, 1, 1])
+
+            # ロック判定
+            lock_members = mandatory_dates.get(date_val, [])
+            is_locked = (len(lock_members) > 0)
+
+            if is_locked:
+                curr_enabled = True
+                members_str = "、".join(lock_members)
+                tooltip_msg = f"{members_str} さんがこの日しか参加できないため、ロックされています。"
+                new_enabled = c1.checkbox(" ", value=True, key=f"en_{i}", disabled=True, label_visibility="visible", help=tooltip_msg)
+                date_display_html = f"{date_val}"
+            else:
+                curr_enabled = bool(st.session_state.settings_df.at[i, "有効"])
+                new_enabled = c1.checkbox("有効", value=curr_enabled, key=f"en_{i}", label_visibility="collapsed")
+                date_display_html = f"{date_val}"
 
-st.write("")
-with st.expander("保存した作業を再開"):
-    help_text_resume = """※iPadの場合、"Browse files"をタップしても.okeikoファイルを選択できません。
-画面にブラウザとファイルアプリを同時に開き、ファイルアプリで.okeikoファイルを長押しして、ブラウザにドラッグアンドドロップすることでアップロードできます。"""
-    uploaded_resume = st.file_uploader("**バックアップファイル (.okeiko)**", type=['okeiko'], key="resume_uploader", help=help_text_resume)
-    if uploaded_resume is not None:
-        if st.session_state.loaded_resume_name != uploaded_resume.name:
-            try:
-                uploaded_resume.seek(0)
-                resume_data = pickle.load(uploaded_resume)
-                st.session_state.clean_df = resume_data.get('clean_df')
-                st.session_state.roster_df = resume_data.get('roster_df')
-                st.session_state.shift_result = resume_data.get('shift_result')
-                st.session_state.settings_df = resume_data.get('settings_df')
-                st.session_state.comments_data = resume_data.get('comments_data', {})
-                st.session_state.has_comment_row = resume_data.get('has_comment_row', False)
-                st.session_state.raw_df = resume_data.get('raw_df', None)
-                st.session_state.name_mappings = resume_data.get('name_mappings', {})
-                st.session_state.memo_text = resume_data.get('memo_text', "")
-                st.session_state.member_targets = resume_data.get('member_targets', {})
-                
-                st.session_state.loaded_resume_name = uploaded_resume.name
-                st.session_state.confirm_overwrite = False
-                st.session_state.confirm_reset = False
-                
-                update_static_caches() 
-                refresh_editor_cache(st.session_state.shift_result)
-                st.success("作業データを復元しました。")
-                st.rerun()
-            except Exception as e:
-                st.error(f"ファイル読み込みエラー: {e}")
+            if date_val in diagnosis_dates:
+                c2.markdown(f"<div style='padding-top: 7px; font-weight: bold; color: #ff4b4b;'>⚠️{date_display_html}</div>", unsafe_allow_html=True)
+            else:
+                c2.markdown(f"<div style='padding-top: 7px; font-weight: bold;'>{date_display_html}</div>", unsafe_allow_html=True)
+
+            if f"min_{i}" not in st.session_state: st.session_state[f"min_{i}"] = int(st.session_state.settings_df.at[i, "最小人数"])
+            if f"max_{i}" not in st.session_state: st.session_state[f"max_{i}"] = int(st.session_state.settings_df.at[i, "最大人数"])
+
+            val_fmin = st.session_state.settings_df.at[i, "1年生最小"]
+            curr_fmin = int(val_fmin) if pd.notna(val_fmin) else None
+            val_fmax = st.session_state.settings_df.at[i, "1年生最大"]
+            curr_fmax = int(val_fmax) if pd.notna(val_fmax) else None
+
+            new_min = c3.number_input("最小", min_value=0, max_value=safe_input_max, key=f"min_{i}", label_visibility="collapsed", disabled=not new_enabled)
+            new_max = c4.number_input("最大", min_value=1, max_value=safe_input_max, key=f"max_{i}", label_visibility="collapsed", disabled=not new_enabled)
+
+            if has_roster:
+                new_fmin = c5.number_input("1年最小", min_value=0, max_value=safe_input_max, value=curr_fmin, key=f"fmin_{i}", label_visibility="collapsed", placeholder="", disabled=not new_enabled)
+                new_fmax = c6.number_input("1年最大", min_value=0, max_value=safe_input_max, value=curr_fmax, key=f"fmax_{i}", label_visibility="collapsed", placeholder="", disabled=not new_enabled)
+            else:
+                new_fmin = None
+                new_fmax = None
+
+            updated_enabled.append(new_enabled)
+            updated_min.append(new_min)
+            updated_max.append(new_max)
+            updated_fmin.append(new_fmin)
+            updated_fmax.append(new_fmax)
+
+        st.markdown("<hr style='margin: 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
+        total_min = sum([m for i, m in enumerate(updated_min) if updated_enabled[i]])
+        total_max = sum([m for i, m in enumerate(updated_max) if updated_enabled[i]])
+
+        if has_roster:
+            t1, t2, t3, t4, t5, t6 = st.columns([0.5, 2, 1, 1, 1, 1])
+            t2.markdown("<div style='font-size: 1.0rem; font-weight: bold; padding-top: 10px;'>合計</div>", unsafe_allow_html=True)
+            t3.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_min}</div>", unsafe_allow_html=True)
+            t4.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_max}</div>", unsafe_allow_html=True)
+        else:
+            t1, t2, t3, t4 = st.columns([0.5, 2, 1, 1])
+            t2.markdown("<div style='font-size: 1.0rem; font-weight: bold; padding-top: 10px;'>合計</div>", unsafe_allow_html=True)
+            t3.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_min}</div>", unsafe_allow_html=True)
+            t4.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_max}</div>", unsafe_allow_html=True)
+
+        st.write(""); st.write("")
+        # この部分だけ描き直したときも、生成ボタン等が最新の値を読めるように書き戻しておく
+        st.session_state.settings_df["有効"] = updated_enabled
+        st.session_state.settings_df["最小人数"] = updated_min
+        st.session_state.settings_df["最大人数"] = updated_max
+        st.session_state.settings_df["1年生最小"] = updated_fmin
+        st.session_state.settings_df["1年生最大"] = updated_fmax
+
+def read_date_settings():
+    """settings_df の日程ごとの設定を (有効, 最小, 最大, 1年生最小, 1年生最大) のリストで返す (未指定はNone)"""
+    settings_df = st.session_state.settings_df
+    read_optional = lambda v: int(v) if pd.notna(v) else None
+    return (settings_df["有効"].astype(bool).tolist(), [int(v) for v in settings_df["最小人数"]], [int(v) for v in settings_df["最大人数"]],
+            [read_optional(v) for v in settings_df["1年生最小"]], [read_optional(v) for v in settings_df["1年生最大"]])
+
+@st.fragment
+def show_member_targets(derived):
+    """部員ごとの参加回数 (入力を変えてもこの部分だけ描き直す)"""
+    status_matrix = derived['status_matrix']
+    candidate_counts = status_matrix['candidate_counts']
+    with st.expander("二回以上参加する部員が存在する場合", expanded=False):
+        st.write("デフォルトでは全員一回のみ参加する設定です。以下の設定から、個別に参加回数を変更できます。")
+        sorted_attendees = derived['sorted_attendees']
+
+        name_grade_map = get_member_grade_map(st.session_state.roster_index)
+
+        c_h0, c_h1, c_h2, c_h3, c_h4 = st.columns([0.8, 2, 1.5, 1.5, 2.2])
+        c_h0.markdown("**学年**")
+        c_h1.markdown("**氏名**")
+        c_h2.markdown("**参加可能候補日数**")
+        c_h3.markdown("**参加回数**")
+
+        st.markdown("<hr style='margin: 0px 0px 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
+
+        new_targets = {}
+        for member in sorted_attendees:
+            c0, c1, c2, c3, c4 = st.columns([0.8, 2, 1.5, 1.5, 2.2])
+
+            grade = name_grade_map.get(member, "-")
+            c0.markdown(f"<div style='margin-top: 5px;'>{grade}</div>", unsafe_allow_html=True)
+            c1.markdown(f"<div style='margin-top: 5px;'>{member}</div>", unsafe_allow_html=True)
+
+            candidate_count = int(candidate_counts[status_matrix['member_index'][member]])
+            c2.markdown(f"<div style='margin-top: 5px; text-align: center;'>{candidate_count}</div>", unsafe_allow_html=True)
+
+            current_target = st.session_state.member_targets.get(member, 1)
+            new_target = c3.number_input(
+                "参加回数", 
+                min_value=1, 
+                max_value=int(candidate_count) if candidate_count > 0 else 1,
+                value=current_target,
+                key=f"shift_count_{member}",
+                label_visibility="collapsed"
+            )
+            new_targets[member] = new_target
+        st.session_state.member_targets = new_targets
+
+@st.fragment
+def show_schedule_editor(derived):
+    """生成されたお稽古の編集・プレビュー (編集や別案の切り替えではこの部分だけ描き直す)"""
+    status_matrix = derived['status_matrix']
+    dates_list = status_matrix['dates'].tolist()
+    st.write(""); st.write("---")
+    st.subheader("3. 生成されたお稽古を編集")
+
+    # 別案の切り替え (生成時にまとめて計算済みなので、ソルバーは呼ばない。手で編集した内容は案ごとに残す)
+    alternatives = st.session_state.shift_alternatives
+    if len(alternatives) > 1:
+        # 再生成やバックアップの読み込みで案が変わったときは、ラジオボタンを今の案に合わせる
+        if st.session_state.get('alternative_radio') != st.session_state.alternative_index:
+            st.session_state.alternative_radio = st.session_state.alternative_index
+        st.radio("別案", list(range(len(alternatives))), format_func=lambda i: f"案{i + 1}" + (" (最適)" if i == 0 else ""), key="alternative_radio",
+                 on_change=switch_alternative, horizontal=True, help="同じ条件で、点数の良い順に作った別のお稽古です。")
+
+    roster = st.session_state.roster_index
+    grade_map = get_member_grade_map(roster)
+    extra_map = roster['extra'] if roster is not None else {}
+    col3_name = roster['extra_label'] if roster is not None else None
+
+    show_extra_info = False
+    if col3_name is not None: show_extra_info = st.toggle(f"「{col3_name}」を表示する", value=True)
+    st.write("")
+
+    schedule = st.session_state.shift_result
+    members = status_matrix['members']
+    matrix = status_matrix['matrix']
+
+    if not st.session_state.editor_cache:
+        refresh_editor_cache(schedule)
+
+    display_name_map = st.session_state.editor_cache['display_name_map']
+
+    # 編集グリッド (選択・色分けはブラウザ側。移動・交換が決まったときだけ1件の編集として返ってくる)
+    rows = []
+    available = {}
+    for d, assigned_idx in enumerate(schedule['by_date']):
+        row = []
+        for j in assigned_idx:
+            member_b = members[j]
+            display_name = display_name_map.get((j, d), member_b)
+            if member_b in grade_map: display_name = f"{grade_map[member_b]}.{display_name}"
+            if show_extra_info and member_b in extra_map: display_name += f"({extra_map[member_b]})"
+            row.append([member_b, display_name, int(matrix[d, j]), is_member_locked(status_matrix, member_b, d)])
+            if member_b not in available:
+                available[member_b] = [[day, int(matrix[day, j])] for day in np.flatnonzero(matrix[:, j]).tolist()]
+        rows.append(row)
+    edit_grid(revision=st.session_state.edit_revision, dates=dates_list, rows=rows, available=available, key="edit_grid", default=None, on_change=on_grid_edit)
+
+    st.write("")
+    col_dl_L, col_dl_R = st.columns([3, 1])
+    with col_dl_R:
+        save_data_temp = {
+            'clean_df': st.session_state.clean_df,
+            'roster_df': st.session_state.roster_df,
+            'shift_result': st.session_state.shift_result,
+            'settings_df': st.session_state.settings_df,
+            'comments_data': st.session_state.comments_data,
+            'has_comment_row': st.session_state.has_comment_row,
+            'memo_text': st.session_state.memo_text,
+            'name_mappings': st.session_state.name_mappings,
+            'raw_df': st.session_state.raw_df,
+            'member_targets': st.session_state.member_targets,
+            'shift_alternatives': st.session_state.shift_alternatives,
+            'alternative_index': st.session_state.alternative_index,
+            'solved_settings': st.session_state.solved_settings
+        }
+
+        def dump_backup():
+            # 保存ボタンが押されたときに別スレッドで呼ばれる。お稽古はここで初めて保存用のDataFrameにする
+            save_data = dict(save_data_temp, shift_result=schedule_to_df(status_matrix, save_data_temp['shift_result']),
+                             shift_alternatives=[schedule_to_df(status_matrix, alt) for alt in save_data_temp['shift_alternatives']])
+            buffer_temp = io.BytesIO()
+            pickle.dump(save_data, buffer_temp)
+            return buffer_temp.getvalue()
+
+        today_str = datetime.now().strftime('%Y%m%d')
+        file_name_temp = f"{today_str}_backup.okeiko"
+        st.download_button("作業を保存", data=dump_backup, file_name=file_name_temp, mime="application/octet-stream", use_container_width=True)
+
+    st.write(""); st.write("")
+    st.subheader("お稽古プレビュー")
+    st.write("""下のテキストボックスの右上部分をクリックすると、お稽古のテキストをコピーできます。
+
+※(△)について、伝助のコメントを確認し、「遅れ」もしくは「早退」に書き換えた上でご利用ください。""")
+    text_output = ""
+    for d, assigned_idx in enumerate(schedule['by_date']):
+        if assigned_idx:
+            formatted_members = []
+            for j in assigned_idx:
+                display_name_base = display_name_map.get((j, d), members[j])
+                if matrix[d, j] == 1: formatted_members.append(f"{display_name_base}(△)")
+                else: formatted_members.append(display_name_base)
+            members_str_jp = "、".join(formatted_members)
+            text_output += f"{dates_list[d]}{members_str_jp}\n"
+
+    st.code(text_output, language='text')
+
+    st.write(""); st.write("")
+    st.subheader("伝助コメント")
+
+    if not st.session_state.has_comment_row:
+        st.warning("※ 伝助のCSVファイルにコメントの行が存在しませんでした")
     else:
-        st.session_state.loaded_resume_name = None
+        comments_html_lines = []
+        cm_data = st.session_state.comments_data
+        assigned_members_set = set()
+
+        for date_str, assigned_idx in zip(dates_list, schedule['by_date']):
+            for j in assigned_idx:
+                m = members[j]
+                assigned_members_set.add(m)
+                if m in cm_data:
+                    fmt_comment = format_comment_text(cm_data[m])
+                    comments_html_lines.append(f"<div>{date_str} {m}：{fmt_comment}</div>")
+
+        sorted_densuke_members = derived['sorted_members']
+
+        for m in sorted_densuke_members:
+            if m not in assigned_members_set:
+                if m in cm_data:
+                    fmt_comment = format_comment_text(cm_data[m])
+                    comments_html_lines.append(f"<div style='color: #808080;'>(お休み) {m}：{fmt_comment}</div>")
+
+        if comments_html_lines:
+            full_html = "".join(comments_html_lines)
+            st.markdown(f'<div class="comment-container">{full_html}</div>', unsafe_allow_html=True)
+        else:
+            st.info("表示すべきコメントはありません")
+
+    st.write(""); st.write("")
+    st.subheader("メモ")
+    st.text_area("メモを残したり、お稽古のテキストの体裁を整えたりするのにどうぞ。", key="memo_text", height=500)
+
+# --- UI部分 ---
+st.title("🍵 お稽古メーカー")
+st.write("PCもしくはiPadでの操作をお勧めします。スマートフォンの場合は画面を横向きにすると操作しやすいです。")
+
+# セッション状態
+if 'shift_result' not in st.session_state: st.session_state.shift_result = None
+if 'shift_alternatives' not in st.session_state: st.session_state.shift_alternatives = []
+if 'alternative_index' not in st.session_state: st.session_state.alternative_index = 0
+if 'solved_settings' not in st.session_state: st.session_state.solved_settings = None
+if 'repair_report' not in st.session_state: st.session_state.repair_report = None
+if 'solve_log' not in st.session_state: st.session_state.solve_log = []
+if 'edit_revision' not in st.session_state: st.session_state.edit_revision = 0
+if 'roster_df' not in st.session_state: st.session_state.roster_df = None
+if 'roster_index' not in st.session_state: st.session_state.roster_index = build_roster(st.session_state.roster_df)
+if 'comments_data' not in st.session_state: st.session_state.comments_data = {}
+if 'has_comment_row' not in st.session_state: st.session_state.has_comment_row = False
+if 'clean_df' not in st.session_state: st.session_state.clean_df = None
+if 'raw_df' not in st.session_state: st.session_state.raw_df = None 
+if 'name_mappings' not in st.session_state: st.session_state.name_mappings = {} 
+if 'mapping_source_selected' not in st.session_state: st.session_state.mapping_source_selected = None 
+if 'loaded_resume_name' not in st.session_state: st.session_state.loaded_resume_name = None
+if 'confirm_overwrite' not in st.session_state: st.session_state.confirm_overwrite = False
+if 'confirm_reset' not in st.session_state: st.session_state.confirm_reset = False
+if 'memo_text' not in st.session_state: st.session_state.memo_text = ""
+if 'member_targets' not in st.session_state: st.session_state.member_targets = {}
+if 'status_matrix' not in st.session_state: st.session_state.status_matrix = None
+if 'derived' not in st.session_state: st.session_state.derived = None
+if 'editor_cache' not in st.session_state: st.session_state.editor_cache = {}
+if 'diagnosis' not in st.session_state: st.session_state.diagnosis = None
+if 'solve_job' not in st.session_state: st.session_state.solve_job = None
+if 'solve_notice' not in st.session_state: st.session_state.solve_notice = None
+if 'solve_report' not in st.session_state: st.session_state.solve_report = None
+if 'solver_profile' not in st.session_state: st.session_state.solver_profile = "balanced"
+if 'sweep_result' not in st.session_state: st.session_state.sweep_result = None
+
+# --- 手順1 (読み込み) ---
+st.markdown("### 1. アップロード")
+show_uploads()
 
 clean_df = st.session_state.clean_df
 
@@ -705,24 +1328,18 @@ if clean_df is not None:
     if len(clean_df.columns) < 2:
         st.error("データ形式エラー: 列数が不足しています")
     else:
-        members_list = clean_df.columns[1:].tolist()
-        dates_list = clean_df.iloc[:, 0].fillna("").astype(str).str.strip().tolist()
-        total_members = int(len(members_list))
+        # 読み込んだデータ・名簿・紐付けが変わったときだけ集計し直す
+        if st.session_state.derived is None or st.session_state.derived['key'] != derived_data_key(clean_df, st.session_state.roster_index, st.session_state.name_mappings):
+            update_static_caches()
+        derived = st.session_state.derived
+        status_matrix = derived['status_matrix']
+        finish_solve_job(status_matrix)
+        dates_list = status_matrix['dates'].tolist()
+        total_members = int(len(status_matrix['members']))
         total_days = int(len(dates_list))
-        attendees = []
-        for m in members_list:
-            s_series = clean_df[m].astype(str).str.strip()
-            if any(s in ['○', '△'] for s in s_series): attendees.append(m)
+        attendees = derived['attendees']
         num_attendees = len(attendees)
-
-        if total_days > 0 and num_attendees > 0:
-            default_bulk_max = (num_attendees // total_days) + 1
-            default_bulk_min = max(0, default_bulk_max - 2)
-        else:
-            default_bulk_max = 1; default_bulk_min = 0
-        safe_input_max = total_members if total_members > 0 else 1
-        default_bulk_max = min(default_bulk_max, safe_input_max)
-        default_bulk_min = min(default_bulk_min, safe_input_max)
+        default_bulk_min, default_bulk_max, safe_input_max = derived['default_bulk_min'], derived['default_bulk_max'], derived['safe_input_max']
 
         st.write(""); st.write("---")
         st.markdown('<div id="section_settings"></div>', unsafe_allow_html=True)
@@ -735,109 +1352,8 @@ if clean_df is not None:
                     f"欠席者<span style='font-weight:bold; font-size:1.2em;'>{num_absentees}</span>名", 
                     unsafe_allow_html=True)
         
-        if st.session_state.roster_df is not None:
-            r_df = st.session_state.roster_df
-            with st.expander("部員の回答状況を表示", expanded=True):
-                status_data = []
-                densuke_members = clean_df.columns[1:].tolist()
-                roster_members_list = [str(n).strip() for n in r_df['氏名'].tolist()]
-                
-                unknown_in_densuke = sorted([m for m in densuke_members if m not in roster_members_list])
-                unanswered_members = [m for m in roster_members_list if m not in densuke_members]
-                
-                if unknown_in_densuke:
-                    st.warning(f"【{len(unknown_in_densuke)}名】 部員名簿に無い名前が伝助に見つかりました(表記ゆれや旧字体、重複の可能性あり):\n\n{', '.join(unknown_in_densuke)}")
-                
-                if unknown_in_densuke and unanswered_members:
-                    col_map_msg_L, col_map_msg_R = st.columns([1, 1.5])
-                    with col_map_msg_L:
-                        st.markdown("**「部員名簿に無い名前」を部員名簿と紐付けする**")
-                    with col_map_msg_R:
-                        if st.session_state.mapping_source_selected:
-                            st.error(f"選択中: **{st.session_state.mapping_source_selected}** → 右側から対応する名前をクリックしてください", icon="✏️")
-                        else:
-                            st.info("まずは左側から紐付けしたい名前を選んでください")
-
-                    col_map_L, col_map_R = st.columns(2)
-                    
-                    with col_map_L:
-                        st.markdown("部員名簿に無い名前")
-                        for unk_name in unknown_in_densuke:
-                            label = unk_name
-                            if st.session_state.mapping_source_selected == unk_name:
-                                label += "\u200b"
-                            
-                            if st.button(label, key=f"src_{unk_name}", use_container_width=True):
-                                if st.session_state.mapping_source_selected == unk_name:
-                                    st.session_state.mapping_source_selected = None
-                                else:
-                                    st.session_state.mapping_source_selected = unk_name
-                                st.rerun()
-
-                    with col_map_R:
-                        st.markdown("部員名簿")
-                        for mis_name in unanswered_members:
-                            if st.button(mis_name, key=f"tgt_{mis_name}", use_container_width=True):
-                                if st.session_state.mapping_source_selected:
-                                    src = st.session_state.mapping_source_selected
-                                    st.session_state.name_mappings[src] = mis_name
-                                    st.session_state.mapping_source_selected = None
-                                    
-                                    if st.session_state.raw_df is not None:
-                                        clean_df, comments_data, has_comment_row = process_data_with_mapping(st.session_state.raw_df, st.session_state.name_mappings)
-                                        st.session_state.clean_df = clean_df
-                                        st.session_state.comments_data = comments_data
-                                        st.session_state.has_comment_row = has_comment_row
-                                        st.session_state.shift_result = None 
-                                        update_static_caches()
-                                    st.success(f"{src} を {mis_name} として統合しました")
-                                    st.rerun()
-                
-                if st.session_state.name_mappings:
-                    st.markdown("**設定された紐付け**")
-                    
-                    roster_names_for_sort = [str(n).strip() for n in r_df['氏名'].tolist()]
-                    rank_map = {name: i for i, name in enumerate(roster_names_for_sort)}
-                    sorted_mappings = sorted(
-                        st.session_state.name_mappings.items(),
-                        key=lambda item: rank_map.get(item[1], 999999)
-                    )
-                    
-                    for old, new in sorted_mappings:
-                        col_btn, col_txt, col_empty = st.columns([0.6, 2.5, 6])
-                        with col_btn:
-                            if st.button("解除", key=f"del_map_{old}"):
-                                del st.session_state.name_mappings[old]
-                                if st.session_state.raw_df is not None:
-                                    clean_df, comments_data, has_comment_row = process_data_with_mapping(st.session_state.raw_df, st.session_state.name_mappings)
-                                    st.session_state.clean_df = clean_df
-                                    st.session_state.comments_data = comments_data
-                                    st.session_state.has_comment_row = has_comment_row
-                                    st.session_state.shift_result = None
-                                    update_static_caches()
-                                st.rerun()
-                        with col_txt:
-                            st.markdown(f"<div style='line-height: 34px;'>{old} ➡ {new}</div>", unsafe_allow_html=True)
-                
-                has_mapping_context = (len(unknown_in_densuke) > 0) or (len(st.session_state.name_mappings) > 0)
-                if has_mapping_context and unanswered_members:
-                     st.markdown("<hr style='margin: 10px 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
-
-                if unanswered_members:
-                    st.error(f"【{len(unanswered_members)}名】 未回答者:\n\n{', '.join(unanswered_members)}")
-
-                for _, row in r_df.iterrows():
-                    name = str(row.get('氏名', '')).strip()
-                    if not name: continue
-                    if name not in densuke_members: status = "未回答"
-                    else:
-                        person_vals = clean_df[name].astype(str).tolist()
-                        if any(v.strip() in ['○', '△'] for v in person_vals): status = "〇"
-                        else: status = "欠席"
-                    status_data.append({"氏名": name, "状況": status})
-                if status_data:
-                    st.markdown(f"部員名簿(部員数:<span style='font-weight:bold; font-size:1.2em;'>{len(status_data)}</span>名)", unsafe_allow_html=True)
-                    st.dataframe(pd.DataFrame(status_data), hide_index=True, use_container_width=True)
+        if st.session_state.roster_index is not None:
+            show_member_status(derived)
 
         if st.session_state.get('settings_df') is None or len(st.session_state.settings_df) != total_days:
             init_data = {
@@ -872,162 +1388,74 @@ if clean_df is not None:
             if 'global_max' not in st.session_state: st.session_state.global_max = default_bulk_max
             st.number_input("最大人数", min_value=1, max_value=safe_input_max, key="global_max", on_change=apply_global_settings)
 
-        with st.expander("人数の詳細設定", expanded=False):
-            # 高速化: 1日しか参加できない人の特定を一括処理
-            mandatory_dates = {}
-            if st.session_state.clean_df is not None:
-                dates = st.session_state.clean_df.iloc[:, 0].astype(str).str.strip().tolist()
-                for col in st.session_state.clean_df.columns[1:]:
-                    s_series = st.session_state.clean_df[col].astype(str).str.strip()
-                    valid_indices = [i for i, x in enumerate(s_series) if x in ['○', '△']]
-                    if len(valid_indices) == 1:
-                        target_date = dates[valid_indices[0]]
-                        if target_date not in mandatory_dates:
-                            mandatory_dates[target_date] = []
-                        mandatory_dates[target_date].append(col)
-
-            has_roster = st.session_state.roster_df is not None
+        show_date_settings(derived)
+        has_roster = st.session_state.roster_index is not None
+        updated_enabled, updated_min, updated_max, updated_fmin, updated_fmax = read_date_settings()
+
+        show_member_targets(derived)
+
+        solving = st.session_state.solve_job is not None
+        with st.expander("人数の設定を比べる", expanded=False):
+            st.write("全日程の最小・最大人数(と1年生の人数)の組み合わせをまとめて計算し、お稽古を作れるか・スコアを表で比べます。"
+                     "表のスコアを押すと、その人数設定に変えて計算済みのお稽古を表示します(今のお稽古は置き換わります)。")
+            sweep_cols = st.columns(4 if has_roster else 2)
+            sweep_min = sweep_cols[0].multiselect("最小人数", list(range(0, safe_input_max + 1)), default=[v for v in range(default_bulk_min - 1, default_bulk_min + 2) if 0 <= v <= safe_input_max], key="sweep_min")
+            sweep_max = sweep_cols[1].multiselect("最大人数", list(range(1, safe_input_max + 1)), default=[v for v in range(default_bulk_max - 1, default_bulk_max + 2) if 1 <= v <= safe_input_max], key="sweep_max")
+            fresh_options = [None] + list(range(0, safe_input_max + 1))
+            format_fresh = lambda v: "指定なし" if v is None else str(v)
             if has_roster:
-                st.write("各日程ごとに部員の最小・最大人数を設定できます。一年生の最小・最大人数も設定できます。チェックボックスを外すと、その日程をお稽古日から外せます。")
-                h_col1, h_col2, h_col3, h_col4, h_col5, h_col6 = st.columns([0.5, 2, 1, 1, 1, 1])
-                h_col1.write("")
-                h_col2.markdown("**日程**")
-                h_col3.markdown("**最小**")
-                h_col4.markdown("**最大**")
-                h_col5.markdown("**1年最小**")
-                h_col6.markdown("**1年最大**")
+                sweep_fmin = sweep_cols[2].multiselect("1年生最小", fresh_options, default=[None], format_func=format_fresh, key="sweep_fmin") or [None]
+                sweep_fmax = sweep_cols[3].multiselect("1年生最大", fresh_options, default=[None], format_func=format_fresh, key="sweep_fmax") or [None]
             else:
-                st.write("各日程ごとに部員の最小・最大人数を設定できます。チェックボックスを外すと、その日程をお稽古日から外せます。")
-                h_col1, h_col2, h_col3, h_col4 = st.columns([0.5, 2, 1, 1])
-                h_col1.write("")
-                h_col2.markdown("**日程**")
-                h_col3.markdown("**最小**")
-                h_col4.markdown("**最大**")
-
-            st.markdown("<hr style='margin: 0px 0px 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
-
-            dates = st.session_state.settings_df["日程"].tolist()
-            
-            updated_enabled = []
-            updated_min = []
-            updated_max = []
-            updated_fmin = []
-            updated_fmax = []
-
-            for i, date_val in enumerate(dates):
-                if has_roster:
-                    c1, c2, c3, c4, c5, c6 = st.columns([0.5, 2, 1, 1, 1, 1])
-                else:
-                    c1, c2, c3, c4 = st.columns([0.5, 2, 1, 1])
-                
-                # ロック判定
-                lock_members = mandatory_dates.get(date_val, [])
-                is_locked = (len(lock_members) > 0)
-                
-                if is_locked:
-                    curr_enabled = True
-                    members_str = "、".join(lock_members)
-                    tooltip_msg = f"{members_str} さんがこの日しか参加できないため、ロックされています。"
-                    new_enabled = c1.checkbox(" ", value=True, key=f"en_{i}", disabled=True, label_visibility="visible", help=tooltip_msg)
-                    date_display_html = f"{date_val}"
-                else:
-                    curr_enabled = bool(st.session_state.settings_df.at[i, "有効"])
-                    new_enabled = c1.checkbox("有効", value=curr_enabled, key=f"en_{i}", label_visibility="collapsed")
-                    date_display_html = f"{date_val}"
-
-                c2.markdown(f"<div style='padding-top: 7px; font-weight: bold;'>{date_display_html}</div>", unsafe_allow_html=True)
-                
-                if f"min_{i}" not in st.session_state: st.session_state[f"min_{i}"] = int(st.session_state.settings_df.at[i, "最小人数"])
-                if f"max_{i}" not in st.session_state: st.session_state[f"max_{i}"] = int(st.session_state.settings_df.at[i, "最大人数"])
-                
-                val_fmin = st.session_state.settings_df.at[i, "1年生最小"]
-                curr_fmin = int(val_fmin) if pd.notna(val_fmin) else None
-                val_fmax = st.session_state.settings_df.at[i, "1年生最大"]
-                curr_fmax = int(val_fmax) if pd.notna(val_fmax) else None
-
-                new_min = c3.number_input("最小", min_value=0, max_value=safe_input_max, key=f"min_{i}", label_visibility="collapsed", disabled=not new_enabled)
-                new_max = c4.number_input("最大", min_value=1, max_value=safe_input_max, key=f"max_{i}", label_visibility="collapsed", disabled=not new_enabled)
-                
-                if has_roster:
-                    new_fmin = c5.number_input("1年最小", min_value=0, max_value=safe_input_max, value=curr_fmin, key=f"fmin_{i}", label_visibility="collapsed", placeholder="", disabled=not new_enabled)
-                    new_fmax = c6.number_input("1年最大", min_value=0, max_value=safe_input_max, value=curr_fmax, key=f"fmax_{i}", label_visibility="collapsed", placeholder="", disabled=not new_enabled)
-                else:
-                    new_fmin = None
-                    new_fmax = None
-
-                updated_enabled.append(new_enabled)
-                updated_min.append(new_min)
-                updated_max.append(new_max)
-                updated_fmin.append(new_fmin)
-                updated_fmax.append(new_fmax)
-            
-            st.markdown("<hr style='margin: 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
-            total_min = sum([m for i, m in enumerate(updated_min) if updated_enabled[i]])
-            total_max = sum([m for i, m in enumerate(updated_max) if updated_enabled[i]])
-
-            if has_roster:
-                t1, t2, t3, t4, t5, t6 = st.columns([0.5, 2, 1, 1, 1, 1])
-                t2.markdown("<div style='font-size: 1.0rem; font-weight: bold; padding-top: 10px;'>合計</div>", unsafe_allow_html=True)
-                t3.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_min}</div>", unsafe_allow_html=True)
-                t4.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_max}</div>", unsafe_allow_html=True)
-            else:
-                t1, t2, t3, t4 = st.columns([0.5, 2, 1, 1])
-                t2.markdown("<div style='font-size: 1.0rem; font-weight: bold; padding-top: 10px;'>合計</div>", unsafe_allow_html=True)
-                t3.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_min}</div>", unsafe_allow_html=True)
-                t4.markdown(f"<div style='font-size: 1.25rem; text-align: left; padding-left: 10px; padding-top: 3px;'>{total_max}</div>", unsafe_allow_html=True)
-            
-            st.write(""); st.write("")
-
-        with st.expander("二回以上参加する部員が存在する場合", expanded=False):
-            st.write("デフォルトでは全員一回のみ参加する設定です。以下の設定から、個別に参加回数を変更できます。")
-            sorted_attendees = sort_members_by_roster(attendees, st.session_state.roster_df)
-            
-            # 学年マップ作成 (高速化)
-            name_grade_map = {}
-            if st.session_state.roster_df is not None:
-                for _, r in st.session_state.roster_df.iterrows():
-                    name_grade_map[str(r['氏名']).strip()] = str(r['学年']).strip()
-
-            c_h0, c_h1, c_h2, c_h3, c_h4 = st.columns([0.8, 2, 1.5, 1.5, 2.2])
-            c_h0.markdown("**学年**")
-            c_h1.markdown("**氏名**")
-            c_h2.markdown("**参加可能候補日数**")
-            c_h3.markdown("**参加回数**")
-
-            st.markdown("<hr style='margin: 0px 0px 10px 0px; padding: 0px; border-top: 1px solid rgba(49, 51, 63, 0.2);'>", unsafe_allow_html=True)
-            
-            new_targets = {}
-            for member in sorted_attendees:
-                c0, c1, c2, c3, c4 = st.columns([0.8, 2, 1.5, 1.5, 2.2])
-                
-                grade = name_grade_map.get(member, "-")
-                c0.markdown(f"<div style='margin-top: 5px;'>{grade}</div>", unsafe_allow_html=True)
-                c1.markdown(f"<div style='margin-top: 5px;'>{member}</div>", unsafe_allow_html=True)
-                
-                s_series = clean_df[member].astype(str).str.strip()
-                candidate_count = s_series.isin(['○', '△']).sum()
-                c2.markdown(f"<div style='margin-top: 5px; text-align: center;'>{candidate_count}</div>", unsafe_allow_html=True)
-                
-                current_target = st.session_state.member_targets.get(member, 1)
-                new_target = c3.number_input(
-                    "参加回数", 
-                    min_value=1, 
-                    max_value=int(candidate_count) if candidate_count > 0 else 1,
-                    value=current_target,
-                    key=f"shift_count_{member}",
-                    label_visibility="collapsed"
-                )
-                new_targets[member] = new_target
-            st.session_state.member_targets = new_targets
-
-        generate_clicked = st.button("🔮 お稽古生成 🔮", type="primary", use_container_width=True)
+                sweep_fmin, sweep_fmax = [None], [None]
+            if st.button("比べる", key="sweep_btn", disabled=solving or not sweep_min or not sweep_max):
+                points = []
+                for f_min in sorted(sweep_fmin, key=lambda v: -1 if v is None else v):
+                    for f_max in sorted(sweep_fmax, key=lambda v: -1 if v is None else v):
+                        if f_min is not None and f_max is not None and f_min > f_max: continue
+                        for val_min in sorted(sweep_min):
+                            for val_max in sorted(sweep_max):
+                                if val_min > val_max or (f_min is not None and f_min > val_max): continue
+                                points.append({'min': val_min, 'max': val_max, 'fmin': f_min, 'fmax': f_max, 'settings': {
+                                    'min': [val_min if e else 0 for e in updated_enabled], 'max': [val_max if e else 0 for e in updated_enabled],
+                                    'fmin': [f_min if e else None for e in updated_enabled], 'fmax': [f_max if e else None for e in updated_enabled],
+                                }})
+                if points:
+                    start_sweep_job(status_matrix, points)
+                    st.rerun()
+            sweep = st.session_state.sweep_result
+            if sweep is not None and sweep['status_matrix'] is status_matrix:
+                solved_points = [p for p in sweep['points'] if p['success']]
+                best = min((p['objective'] for p in solved_points), default=None)
+                groups = list(dict.fromkeys((p['fmin'], p['fmax']) for p in sweep['points']))
+                for f_min, f_max in groups:
+                    if has_roster:
+                        st.caption(f"1年生最小 {format_fresh(f_min)}・1年生最大 {format_fresh(f_max)}")
+                    group = [(i, p) for i, p in enumerate(sweep['points']) if (p['fmin'], p['fmax']) == (f_min, f_max)]
+                    max_values = sorted({p['max'] for _, p in group})
+                    header = st.columns([1] + [1] * len(max_values))
+                    header[0].markdown("**最小＼最大**")
+                    for c, val_max in zip(header[1:], max_values):
+                        c.markdown(f"**{val_max}**")
+                    for val_min in sorted({p['min'] for _, p in group}):
+                        row = st.columns([1] + [1] * len(max_values))
+                        row[0].markdown(f"<div style='padding-top: 7px; font-weight: bold;'>{val_min}</div>", unsafe_allow_html=True)
+                        cells = {p['max']: (i, p) for i, p in group if p['min'] == val_min}
+                        for c, val_max in zip(row[1:], max_values):
+                            if val_max not in cells: continue
+                            i, p = cells[val_max]
+                            if p['success']:
+                                # 目的関数は「ペナルティ − 希望度」の最小化なので、符号を反転してスコアとして見せる
+                                c.button(f"{-p['objective']:g}", key=f"sweep_{i}", type="primary" if p['objective'] == best else "secondary",
+                                         use_container_width=True, disabled=solving, on_click=apply_sweep_point, args=(i,))
+                            else:
+                                c.button("✕" if p['status'] == 'infeasible' else "-", key=f"sweep_{i}", use_container_width=True, disabled=True,
+                                         help="この設定ではお稽古を作れません" if p['status'] == 'infeasible' else "計算されていません")
+        st.radio("計算モード", list(SOLVER_PROFILES), format_func=format_solver_profile, key="solver_profile", horizontal=True, disabled=solving)
+        generate_clicked = st.button("🔮 お稽古生成 🔮", type="primary", use_container_width=True, disabled=solving)
         
         if generate_clicked:
-            st.session_state.settings_df["有効"] = updated_enabled
-            st.session_state.settings_df["最小人数"] = updated_min
-            st.session_state.settings_df["最大人数"] = updated_max
-            st.session_state.settings_df["1年生最小"] = updated_fmin
-            st.session_state.settings_df["1年生最大"] = updated_fmax
+            st.session_state.diagnosis = None
             dates = st.session_state.settings_df["日程"].tolist()
             
             calc_min_l = []
@@ -1071,387 +1499,104 @@ if clean_df is not None:
                     st.session_state.confirm_overwrite = True
                 else:
                     st.session_state.confirm_overwrite = False
-                    with st.spinner('計算中...'):
-                        res, success = solve_shift_schedule(clean_df, calc_min_l, calc_max_l, st.session_state.roster_df, calc_fresh_min_l, calc_fresh_max_l, member_targets=st.session_state.member_targets)
-                    if success:
-                        st.session_state.shift_result = res
-                        st.session_state.editing_member = None
-                        st.session_state.editing_date = None
-                        refresh_editor_cache(res)
-                        st.rerun()
-                    else: st.error("お稽古を作成できませんでした。条件を見直してください。")
+                    start_solve_job(status_matrix, {'min': calc_min_l, 'max': calc_max_l, 'fmin': calc_fresh_min_l, 'fmax': calc_fresh_max_l})
+                    st.rerun()
+
+        # バックグラウンドで計算中の経過 (終わると画面全体を描き直して結果を反映する)
+        if solving:
+            show_solve_progress()
+        if st.session_state.solve_notice is not None:
+            level, message = st.session_state.solve_notice
+            getattr(st, level)(message)
 
-        if st.session_state.confirm_overwrite:
-            st.warning("⚠️ **すでにお稽古が生成されています。**\n\n新しく生成すると、現在の編集内容はすべて失われます。よろしいですか？")
-            col_ov_y, col_ov_n = st.columns([1, 1])
+        if st.session_state.confirm_overwrite and not solving:
+            st.warning("⚠️ **すでにお稽古が生成されています。**\n\n新しく生成すると、現在の編集内容はすべて失われます。"
+                       "「編集を残して修正」では、条件が変わった日程や参加回数が合わない部員の割り当てだけを計算し直します。")
+            dates = st.session_state.settings_df["日程"].tolist()
+            enabled_l, min_l_raw, max_l_raw, fmin_raw, fmax_raw = read_date_settings()
+            calc_min_l = []
+            calc_max_l = []
+            calc_fresh_min_l = []
+            calc_fresh_max_l = []
+            for i in range(len(dates)):
+                if enabled_l[i]:
+                    calc_min_l.append(min_l_raw[i])
+                    calc_max_l.append(max_l_raw[i])
+                    calc_fresh_min_l.append(fmin_raw[i])
+                    calc_fresh_max_l.append(fmax_raw[i])
+                else:
+                    calc_min_l.append(0)
+                    calc_max_l.append(0)
+                    calc_fresh_min_l.append(None)
+                    calc_fresh_max_l.append(None)
+            calc_settings = {'min': calc_min_l, 'max': calc_max_l, 'fmin': calc_fresh_min_l, 'fmax': calc_fresh_max_l}
+            col_ov_y, col_ov_r, col_ov_n = st.columns([1, 1, 1])
             if col_ov_y.button("はい、上書き生成します", use_container_width=True):
                 st.session_state.confirm_overwrite = False
-                dates = st.session_state.settings_df["日程"].tolist()
-                min_l_raw = st.session_state.settings_df["最小人数"].tolist()
-                max_l_raw = st.session_state.settings_df["最大人数"].tolist()
-                fmin_raw = st.session_state.settings_df["1年生最小"].tolist()
-                fmax_raw = st.session_state.settings_df["1年生最大"].tolist()
-                enabled_l = st.session_state.settings_df["有効"].tolist()
-                calc_min_l = []
-                calc_max_l = []
-                calc_fresh_min_l = []
-                calc_fresh_max_l = []
-                for i in range(len(dates)):
-                    if enabled_l[i]:
-                        calc_min_l.append(min_l_raw[i])
-                        calc_max_l.append(max_l_raw[i])
-                        calc_fresh_min_l.append(fmin_raw[i])
-                        calc_fresh_max_l.append(fmax_raw[i])
-                    else:
-                        calc_min_l.append(0)
-                        calc_max_l.append(0)
-                        calc_fresh_min_l.append(None)
-                        calc_fresh_max_l.append(None)
-                with st.spinner('計算中...'):
-                    res, success = solve_shift_schedule(clean_df, calc_min_l, calc_max_l, st.session_state.roster_df, calc_fresh_min_l, calc_fresh_max_l, member_targets=st.session_state.member_targets)
-                if success:
-                    st.session_state.shift_result = res
-                    st.session_state.editing_member = None
-                    st.session_state.editing_date = None
-                    refresh_editor_cache(res)
-                    st.rerun()
-                else: st.error("お稽古を作成できませんでした。条件を見直してください。")
+                start_solve_job(status_matrix, calc_settings, initial_solution=schedule_assignments(status_matrix, st.session_state.shift_result))
+                st.rerun()
+            if col_ov_r.button("編集を残して修正", use_container_width=True):
+                st.session_state.confirm_overwrite = False
+                # 前回の生成から人数の設定が変わった日程
+                changed_dates = []
+                solved = st.session_state.solved_settings
+                if solved is not None and len(solved['min']) == len(dates):
+                    for i in range(len(dates)):
+                        if read_bounds(i, calc_min_l, calc_max_l, calc_fresh_min_l, calc_fresh_max_l) != read_bounds(i, solved['min'], solved['max'], solved['fmin'], solved['fmax']):
+                            changed_dates.append(i)
+                start_repair_job(status_matrix, calc_settings, changed_dates)
+                st.rerun()
             if col_ov_n.button("いいえ", use_container_width=True):
                 st.session_state.confirm_overwrite = False
                 st.rerun()
 
+        # 編集を残して修正したときの結果
+        if st.session_state.shift_result is not None and st.session_state.repair_report is not None:
+            if st.session_state.repair_report:
+                st.caption(f"編集内容を残したまま、{len(st.session_state.repair_report)}名({'、'.join(st.session_state.repair_report)})の割り当てを計算し直しました。")
+            else:
+                st.caption("条件を満たしているため、お稽古は変更していません。")
+
+        # 作成できなかったときの原因 (該当する日程は「人数の詳細設定」でも⚠️で示す)
+        if st.session_state.diagnosis is not None:
+            st.error("お稽古を作成できませんでした。条件を見直してください。")
+            for finding in st.session_state.diagnosis:
+                st.error(finding['message'], icon="⚠️")
+
+        # 事前処理(割り当てが確定している部員の固定)の結果 (MIPで解いたときだけ solve_report に入っている)
+        if st.session_state.shift_result is not None and st.session_state.solve_report is not None:
+            presolve_report = st.session_state.solve_report.get('presolve')
+            if presolve_report is not None and presolve_report['fixed_assignments'] > 0:
+                st.caption(f"計算前に、参加日が確定している部員{presolve_report['fixed_members']}名の割り当て"
+                           f"{presolve_report['fixed_assignments']}件(候補{presolve_report['total_cells']}件中)を固定しました。")
+
+        # 直前の計算のログ (CBCに渡した初期解が採用されたか)
+        if st.session_state.shift_result is not None and (st.session_state.solve_log or st.session_state.solve_report):
+            with st.expander("計算ログ", expanded=False):
+                report = st.session_state.solve_report
+                if report is not None:
+                    # 目的関数は「ペナルティ − 希望度」の最小化なので、符号を反転して「スコア」として見せる
+                    score_text = f"スコア {-report['objective']:g}" if report['objective'] is not None else "スコア -"
+                    gap_text = f"ギャップ {report['gap']:.1%}" if report['gap'] is not None else "ギャップ -"
+                    backend_text = SOLVER_BACKENDS[report['backend']]['label']
+                    if report.get('strategy'):
+                        backend_text += f"・{report['strategy']}"
+                    st.caption(f"{PROFILE_LABELS[report['profile']]} ({backend_text}): {STATUS_LABELS.get(report['status'], '-')}、{score_text}、{gap_text}、{report['seconds']:.2f}秒")
+                start_labels = {'previous': "前回のお稽古", 'flow': "最小費用流の解"}
+                for entry in st.session_state.solve_log:
+                    if entry.get('cached'):
+                        st.caption("同じ条件の計算結果を再利用しました(計算は行っていません)。")
+                        continue
+                    if entry['start'] is None or entry['accepted'] is None:
+                        start_text = "初期解なし"
+                    elif entry['accepted']:
+                        start_text = f"初期解({start_labels[entry['start']]})を採用 (初期解の値 {entry['start_objective']:g} → 最終 {entry['objective']:g})"
+                    else:
+                        start_text = f"初期解({start_labels[entry['start']]})は使われませんでした"
+                    st.caption(f"日程{entry['dates']}件: {start_text}、{entry['seconds']:.2f}秒")
+
         # ------------------------------------------------
         # 3. 生成結果・編集
         # ------------------------------------------------
         if st.session_state.shift_result is not None:
-            st.write(""); st.write("---")
-            c_head, c_status = st.columns([1, 1.5])
-            with c_head: st.subheader("3. 生成されたお稽古を編集")
-            with c_status:
-                if st.session_state.editing_member:
-                    target = st.session_state.editing_member
-                    alert_cols = st.columns([3, 1], gap="small")
-                    with alert_cols[0]: st.error(f"編集中: **{target['name']}**", icon="✏️")
-                    with alert_cols[1]:
-                        if st.button("解除", key="cancel_btn", use_container_width=True):
-                            st.session_state.editing_member = None
-                            st.rerun()
-                elif st.session_state.editing_date:
-                    target_date = st.session_state.editing_date
-                    alert_cols = st.columns([3, 1], gap="small")
-                    with alert_cols[0]: st.error(f"日程選択中: **{target_date}**", icon="📅")
-                    with alert_cols[1]:
-                        if st.button("解除", key="cancel_btn", use_container_width=True):
-                            st.session_state.editing_date = None
-                            st.rerun()
-                else:
-                    st.info("部員または日程をクリックして編集できます")
-            
-            grade_map = {}
-            extra_map = {}
-            has_extra_col = False
-            col3_name = ""
-            if st.session_state.roster_df is not None:
-                try:
-                    for _, r in st.session_state.roster_df.iterrows():
-                        grade_map[str(r['氏名']).strip()] = str(r['学年']).strip()
-                    if len(st.session_state.roster_df.columns) >= 3:
-                        has_extra_col = True
-                        col3_name = st.session_state.roster_df.columns[2]
-                        for _, r in st.session_state.roster_df.iterrows():
-                            val = r[col3_name]
-                            if pd.notna(val) and str(val).strip() != "":
-                                extra_map[str(r['氏名']).strip()] = str(val).strip()
-                except: pass
-            
-            show_extra_info = False
-            if has_extra_col: show_extra_info = st.toggle(f"「{col3_name}」を表示する", value=True)
-            st.write("")
-
-            current_df = st.session_state.shift_result.copy()
-            max_people_in_day = 0
-            for _, row in current_df.iterrows():
-                val = row["担当者"]
-                if pd.notna(val) and str(val) != "":
-                    count = len(str(val).split(", "))
-                    if count > max_people_in_day: max_people_in_day = count
-            col_ratios = [3] * max_people_in_day + [1] 
-
-            # キャッシュ利用
-            if not st.session_state.status_map_cache or not st.session_state.valid_dates_cache:
-                update_static_caches()
-            status_map = st.session_state.status_map_cache
-            valid_dates_for_member = st.session_state.valid_dates_cache
-
-            if not st.session_state.editor_cache:
-                refresh_editor_cache(current_df)
-            
-            display_name_map = st.session_state.editor_cache['display_name_map']
-            current_assignments_map = st.session_state.editor_cache['current_assignments_map']
-            date_to_row = st.session_state.editor_cache['date_to_row']
-
-            for date_idx, date_val in enumerate(dates_list):
-                c_date, c_members = st.columns([1.2, 8], gap="small")
-                with c_date:
-                    btn_label = f"\u200E{date_val}"
-                    disabled_state = False
-                    on_click = "select_date"
-                    
-                    if st.session_state.editing_member:
-                        member_a = st.session_state.editing_member['name']
-                        date_a = st.session_state.editing_member['source_date']
-                        if date_val != date_a:
-                            status = status_map.get((date_val, member_a), '-')
-                            already_assigned = member_a in current_assignments_map.get(date_val, set())
-                            if already_assigned: disabled_state = True
-                            elif status in ["○", "△"]:
-                                btn_label += "\u200b\u200b"
-                                if status == "△": btn_label += "(△)"
-                                on_click = "move_member_here"
-                            else: disabled_state = True
-                        else: disabled_state = True
-                    elif st.session_state.editing_date == date_val:
-                        btn_label += "\u200b"
-                        on_click = "cancel_date"
-                        
-                    if st.button(btn_label, key=f"d_{date_val}", disabled=disabled_state, use_container_width=True):
-                        if on_click == "select_date":
-                            st.session_state.editing_date = date_val
-                            st.session_state.editing_member = None
-                            st.rerun()
-                        elif on_click == "cancel_date":
-                            st.session_state.editing_date = None
-                            st.rerun()
-                        elif on_click == "move_member_here":
-                            member_a = st.session_state.editing_member['name']
-                            date_a = st.session_state.editing_member['source_date']
-                            row_idx_a = date_to_row[date_a]; row_idx_curr = date_to_row[date_val]
-                            list_a = current_df.at[row_idx_a, "担当者"].split(", ")
-                            if member_a in list_a: list_a.remove(member_a)
-                            current_df.at[row_idx_a, "担当者"] = ", ".join(list_a)
-                            current_df.at[row_idx_a, "人数"] = len(list_a)
-                            val_curr = current_df.at[row_idx_curr, "担当者"]
-                            list_curr = val_curr.split(", ") if pd.notna(val_curr) and val_curr != "" else []
-                            list_curr.append(member_a)
-                            list_curr = sort_members_by_roster(list_curr, st.session_state.roster_df)
-                            current_df.at[row_idx_curr, "担当者"] = ", ".join(list_curr)
-                            current_df.at[row_idx_curr, "人数"] = len(list_curr)
-                            st.session_state.shift_result = current_df
-                            st.session_state.editing_member = None
-                            refresh_editor_cache(current_df)
-                            st.rerun()
-                with c_members:
-                    row_idx = date_to_row.get(date_val)
-                    if row_idx is not None:
-                        assigned_val = current_df.at[row_idx, "担当者"]
-                        assigned_list = str(assigned_val).split(", ") if pd.notna(assigned_val) and str(assigned_val) != "" else []
-                        cols = st.columns(col_ratios, gap="small")
-                        
-                        for i, member_b in enumerate(assigned_list):
-                            is_mem_edit = st.session_state.editing_member is not None
-                            is_date_edit = st.session_state.editing_date is not None
-                            
-                            movable_days_set = valid_dates_for_member.get(member_b, set())
-                            has_other_options = len(movable_days_set - {date_val}) > 0
-                            is_locked = not has_other_options
-                            
-                            display_name_base = display_name_map.get((member_b, date_val), member_b)
-                            if member_b in grade_map: display_name = f"{grade_map[member_b]}.{display_name_base}"
-                            else: display_name = display_name_base
-                            if show_extra_info and member_b in extra_map: display_name += f"({extra_map[member_b]})"
-                            
-                            if not is_mem_edit and not is_date_edit and is_locked:
-                                lock_label = display_name
-                                cols[i].markdown(f"<div class='locked-member'>🔒{lock_label}</div>", unsafe_allow_html=True)
-                                continue 
-                            
-                            status_this_day = status_map.get((date_val, member_b), '-')
-                            label = display_name
-                            if status_this_day == "△": label += "(△)"
-                            btn_key = f"b_{date_val}_{member_b}_{i}" 
-                            
-                            on_click = "select_member"
-                            disabled_state = False
-                            
-                            if is_mem_edit:
-                                member_a = st.session_state.editing_member['name']
-                                date_a = st.session_state.editing_member['source_date']
-                                is_self_mem = (member_a == member_b and date_a == date_val)
-                                if is_self_mem:
-                                    label += "\u200b"
-                                    on_click = "cancel_member"
-                                else:
-                                    members_in_target = current_assignments_map.get(date_val, set())
-                                    is_a_duplicate_in_target = (member_a in members_in_target) and (member_a != member_b)
-                                    members_in_source = current_assignments_map.get(date_a, set())
-                                    is_b_duplicate_in_source = (member_b in members_in_source) and (member_b != member_a)
-                                    
-                                    if member_a != member_b and date_val != date_a:
-                                        stat_a = status_map.get((date_val, member_a), '-')
-                                        stat_b = status_map.get((date_a, member_b), '-')
-                                        if is_a_duplicate_in_target or is_b_duplicate_in_source:
-                                            if is_locked:
-                                                lock_label = display_name
-                                                cols[i].markdown(f"<div class='locked-member'>🔒{lock_label}</div>", unsafe_allow_html=True)
-                                                continue
-                                            else: disabled_state = True
-                                        elif stat_a in ["○", "△"] and stat_b in ["○", "△"]:
-                                            label += "\u200b\u200b"
-                                            on_click = "swap"
-                                        elif is_locked:
-                                            lock_label = display_name
-                                            cols[i].markdown(f"<div class='locked-member'>🔒{lock_label}</div>", unsafe_allow_html=True)
-                                            continue
-                                    elif is_locked:
-                                        cols[i].markdown(f"<div class='locked-member'>🔒{display_name}</div>", unsafe_allow_html=True)
-                                        continue
-                            elif is_date_edit:
-                                tgt_date = st.session_state.editing_date
-                                if date_val != tgt_date:
-                                    stat = status_map.get((tgt_date, member_b), '-')
-                                    members_in_tgt = current_assignments_map.get(tgt_date, set())
-                                    is_duplicate = member_b in members_in_tgt
-                                    if is_duplicate:
-                                         if is_locked:
-                                            lock_label = display_name
-                                            cols[i].markdown(f"<div class='locked-member'>🔒{lock_label}</div>", unsafe_allow_html=True)
-                                            continue
-                                         else: disabled_state = True
-                                    elif stat in ["○", "△"]:
-                                        label += "\u200b\u200b"
-                                        on_click = "move_to_date"
-                                    elif is_locked:
-                                        lock_label = display_name
-                                        cols[i].markdown(f"<div class='locked-member'>🔒{lock_label}</div>", unsafe_allow_html=True)
-                                        continue
-                                elif is_locked:
-                                    cols[i].markdown(f"<div class='locked-member'>🔒{display_name}</div>", unsafe_allow_html=True)
-                                    continue
-                            
-                            if cols[i].button(label, key=btn_key, disabled=disabled_state, use_container_width=True):
-                                if on_click == "select_member":
-                                    st.session_state.editing_member = {'name': member_b, 'source_date': date_val}
-                                    st.session_state.editing_date = None
-                                    st.rerun()
-                                elif on_click == "cancel_member":
-                                    st.session_state.editing_member = None
-                                    st.rerun()
-                                elif on_click == "swap":
-                                    mem_a = st.session_state.editing_member['name']
-                                    date_a = st.session_state.editing_member['source_date']
-                                    idx_a = date_to_row[date_a]; idx_b = row_idx
-                                    l_a = current_df.at[idx_a, "担当者"].split(", ")
-                                    if mem_a in l_a: l_a.remove(mem_a)
-                                    l_a.append(member_b)
-                                    l_a = sort_members_by_roster(l_a, st.session_state.roster_df)
-                                    current_df.at[idx_a, "担当者"] = ", ".join(l_a)
-                                    l_b = assigned_list[:]
-                                    if member_b in l_b: l_b.remove(member_b)
-                                    l_b.append(mem_a)
-                                    l_b = sort_members_by_roster(l_b, st.session_state.roster_df)
-                                    current_df.at[idx_b, "担当者"] = ", ".join(l_b)
-                                    st.session_state.shift_result = current_df
-                                    st.session_state.editing_member = None
-                                    refresh_editor_cache(current_df)
-                                    st.rerun()
-                                elif on_click == "move_to_date":
-                                    tgt_date = st.session_state.editing_date
-                                    idx_tgt = date_to_row[tgt_date]
-                                    l_src = assigned_list[:]
-                                    if member_b in l_src: l_src.remove(member_b)
-                                    current_df.at[row_idx, "担当者"] = ", ".join(l_src)
-                                    current_df.at[row_idx, "人数"] = len(l_src)
-                                    val_tgt = current_df.at[idx_tgt, "担当者"]
-                                    l_tgt = val_tgt.split(", ") if pd.notna(val_tgt) and val_tgt != "" else []
-                                    l_tgt.append(member_b)
-                                    l_tgt = sort_members_by_roster(l_tgt, st.session_state.roster_df)
-                                    current_df.at[idx_tgt, "担当者"] = ", ".join(l_tgt)
-                                    current_df.at[idx_tgt, "人数"] = len(l_tgt)
-                                    st.session_state.shift_result = current_df
-                                    st.session_state.editing_date = None
-                                    refresh_editor_cache(current_df)
-                                    st.rerun()
-            
-            st.write("")
-            col_dl_L, col_dl_R = st.columns([3, 1])
-            with col_dl_R:
-                save_data_temp = {
-                    'clean_df': st.session_state.clean_df,
-                    'roster_df': st.session_state.roster_df,
-                    'shift_result': st.session_state.shift_result,
-                    'settings_df': st.session_state.settings_df,
-                    'comments_data': st.session_state.comments_data,
-                    'has_comment_row': st.session_state.has_comment_row,
-                    'memo_text': st.session_state.memo_text,
-                    'name_mappings': st.session_state.name_mappings,
-                    'raw_df': st.session_state.raw_df,
-                    'member_targets': st.session_state.member_targets
-                }
-                buffer_temp = io.BytesIO()
-                pickle.dump(save_data_temp, buffer_temp)
-                today_str = datetime.now().strftime('%Y%m%d')
-                file_name_temp = f"{today_str}_backup.okeiko"
-                st.download_button("作業を保存", data=buffer_temp, file_name=file_name_temp, mime="application/octet-stream", use_container_width=True)
-
-            st.write(""); st.write("")
-            st.subheader("お稽古プレビュー")
-            st.write("""下のテキストボックスの右上部分をクリックすると、お稽古のテキストをコピーできます。
-
-※(△)について、伝助のコメントを確認し、「遅れ」もしくは「早退」に書き換えた上でご利用ください。""")
-            text_output = ""
-            for d in dates_list: # current_dfの順序ではなくリスト順
-                row_idx = date_to_row.get(d)
-                if row_idx is not None:
-                    raw_val = current_df.at[row_idx, "担当者"]
-                    if pd.notna(raw_val) and str(raw_val) != "":
-                        member_list = str(raw_val).split(", ")
-                        formatted_members = []
-                        for member in member_list:
-                            display_name_base = display_name_map.get((member, d), member)
-                            status = status_map.get((d, member), '-')
-                            if status == "△": formatted_members.append(f"{display_name_base}(△)")
-                            else: formatted_members.append(display_name_base)
-                        members_str_jp = "、".join(formatted_members)
-                        text_output += f"{d}{members_str_jp}\n"
-            
-            st.code(text_output, language='text')
-            
-            st.write(""); st.write("")
-            st.subheader("伝助コメント")
-            
-            if not st.session_state.has_comment_row:
-                st.warning("※ 伝助のCSVファイルにコメントの行が存在しませんでした")
-            else:
-                comments_html_lines = []
-                cm_data = st.session_state.comments_data
-                assigned_members_set = set()
-                
-                for _, row in current_df.iterrows():
-                    date_str = row['日程']
-                    raw_members = row['担当者']
-                    if raw_members:
-                        member_list = raw_members.split(", ")
-                        for m in member_list:
-                            assigned_members_set.add(m)
-                            if m in cm_data:
-                                fmt_comment = format_comment_text(cm_data[m])
-                                comments_html_lines.append(f"<div>{date_str} {m}：{fmt_comment}</div>")
-                
-                densuke_members = clean_df.columns[1:].tolist()
-                sorted_densuke_members = sort_members_by_roster(densuke_members, st.session_state.roster_df)
-                
-                for m in sorted_densuke_members:
-                    if m not in assigned_members_set:
-                        if m in cm_data:
-                            fmt_comment = format_comment_text(cm_data[m])
-                            comments_html_lines.append(f"<div style='color: #808080;'>(お休み) {m}：{fmt_comment}</div>")
-                
-                if comments_html_lines:
-                    full_html = "".join(comments_html_lines)
-                    st.markdown(f'<div class="comment-container">{full_html}</div>', unsafe_allow_html=True)
-                else:
-                    st.info("表示すべきコメントはありません")
-            
-            st.write(""); st.write("")
-            st.subheader("メモ")
-            st.text_area("メモを残したり、お稽古のテキストの体裁を整えたりするのにどうぞ。", key="memo_text", height=500)
+            show_schedule_editor(derived)
@@ -0,0 +1,91 @@
+"""
+解き方 (solver.SOLVER_BACKENDS) ごとの速さと解の良さを、同じ乱数で作った出欠表で比べる。
+このサーバーで使えるものだけを測り、結果を見て solver.MIP_BACKEND_ORDER・HEURISTIC_CELLS を決める (ポートフォリオを "auto" で選ぶかもここで測って決める)。
+
+    python benchmark_backends.py
+    python benchmark_backends.py --sizes 20x80 60x400 --seeds 3 --profile quick
+"""
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from solver import (
+    SOLVER_BACKENDS, SOLVER_PROFILES, make_status_matrix, build_roster, is_backend_available, select_backend,
+    solve_shift_schedule, assignments_from_df, schedule_objective,
+)
+
+def make_instance(n_dates, n_members, seed):
+    """
+    出欠表(○=2, △=1)・名簿(学年1〜4)・参加回数・人数の設定を乱数で作る。
+    部員の3割は2回参加とし、人数の上下限は1日あたりの平均の前後に取る。
+    """
+    rnd = random.Random(seed)
+    matrix = np.zeros((n_dates, n_members), dtype=np.int8)
+    for j in range(n_members):
+        p = rnd.uniform(0.1, 0.5)
+        for d in range(n_dates):
+            r = rnd.random()
+            if r < p: matrix[d, j] = 2
+            elif r < p * 1.3: matrix[d, j] = 1
+    dates = np.array([f"{d + 1}日目" for d in range(n_dates)], dtype=object)
+    members = np.array([f"部員{j:04d}" for j in range(n_members)], dtype=object)
+    status_matrix = make_status_matrix(matrix, dates, members)
+    roster = build_roster(pd.DataFrame({'氏名': members.tolist(), '学年': [str(rnd.randint(1, 4)) for _ in range(n_members)]}))
+    available = np.count_nonzero(matrix, axis=0)
+    member_targets = {m: 2 for j, m in enumerate(members.tolist()) if available[j] >= 3 and rnd.random() < 0.3}
+    total = sum(member_targets.get(m, 1) for j, m in enumerate(members.tolist()) if available[j] > 0)
+    average = total / n_dates
+    min_list = [max(0, math.floor(average * 0.5))] * n_dates
+    max_list = [max(1, math.ceil(average * 1.6))] * n_dates
+    fresh_max_list = [max(1, math.ceil(average / 2))] * n_dates
+    return status_matrix, roster, member_targets, min_list, max_list, [None] * n_dates, fresh_max_list
+
+def run_benchmark(sizes, seeds, profile, backends):
+    rows = []
+    for n_dates, n_members in sizes:
+        for seed in range(seeds):
+            status_matrix, roster, member_targets, min_list, max_list, fresh_min_list, fresh_max_list = make_instance(n_dates, n_members, seed)
+            cells = int(np.count_nonzero(status_matrix['matrix']))
+            auto = select_backend(status_matrix, roster, member_targets)
+            for backend in backends:
+                report = {}
+                started = time.perf_counter()
+                schedules, success = solve_shift_schedule(status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list,
+                                                          member_targets=member_targets, profile=profile, report=report, backend=backend)
+                seconds = time.perf_counter() - started
+                # 解き方によって目的関数に含まれる範囲が違うので、出来上がったお稽古から計算し直して比べる
+                objective = schedule_objective(status_matrix, assignments_from_df(status_matrix, schedules[0]), roster, member_targets) if success else None
+                rows.append({
+                    '大きさ': f"{n_dates}x{n_members}", 'seed': seed, 'セル数': cells, '解き方': backend,
+                    'auto': "*" if backend == auto else "", '状態': report.get('status'),
+                    '目的関数値': objective, 'ギャップ': report.get('gap'), '秒': round(seconds, 2),
+                })
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="解き方ごとの速さと解の良さを比べる")
+    parser.add_argument("--sizes", nargs="+", default=["10x40", "20x80", "40x200", "60x400"], help="日程数x部員数")
+    parser.add_argument("--seeds", type=int, default=2, help="大きさごとに作る出欠表の数")
+    parser.add_argument("--profile", choices=list(SOLVER_PROFILES), default="balanced")
+    parser.add_argument("--backends", nargs="+", choices=list(SOLVER_BACKENDS), default=list(SOLVER_BACKENDS))
+    args = parser.parse_args()
+
+    backends = [b for b in args.backends if is_backend_available(b)]
+    skipped = [b for b in args.backends if b not in backends]
+    if skipped:
+        print(f"このサーバーでは使えないため飛ばします: {', '.join(skipped)}")
+    sizes = [tuple(int(v) for v in size.lower().split("x")) for size in args.sizes]
+    result = run_benchmark(sizes, args.seeds, args.profile, backends)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(result.to_string(index=False))
+        # 目的関数値は小さいほど良い (ペナルティ − 希望度)
+        summary = result.groupby(['大きさ', '解き方']).agg(平均秒=('秒', 'mean'), 平均目的関数値=('目的関数値', 'mean'), 解けた数=('目的関数値', 'count'))
+        print()
+        print(summary.to_string())
+
+if __name__ == "__main__":
+    main()
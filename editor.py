@@ -0,0 +1,127 @@
+from bisect import insort
+
+import numpy as np
+import pandas as pd
+
+from solver import assignments_from_df, sort_members_by_roster
+
+# ==========================================
+# お稽古の持ち方と手動編集の規則 (Streamlitに依存しない部分)
+# ==========================================
+# 選択の状態: None (何も選んでいない) / {'type': 'member', 'member': 部員名, 'date': 日程インデックス} / {'type': 'date', 'date': 日程インデックス}
+# 操作 (編集グリッド edit_grid/index.html が送る形と同じ):
+#   {'action': 'select_member', 'member', 'date'} / {'action': 'select_date', 'date'} / {'action': 'cancel'}
+#   {'action': 'move', 'member', 'from', 'to'} / {'action': 'swap', 'member_a', 'from', 'member_b', 'to'}
+# お稽古は make_schedule の形で持ち、移動・交換はその場で書き換える。
+# DataFrame ({日程, 担当者, 人数}) や {日程インデックス: [部員名]} にするのは、保存・ソルバーに渡すときだけ。
+
+def member_ranks(status_matrix, roster=None):
+    """部員インデックスごとの並び順 (solver.sort_members_by_roster と同じ順)"""
+    member_index = status_matrix['member_index']
+    order = sort_members_by_roster(status_matrix['members'].tolist(), roster)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[[member_index[m] for m in order]] = np.arange(len(order))
+    return ranks
+
+def make_schedule(status_matrix, assigned_by_date, ranks):
+    """
+    お稽古 {日程インデックス: [部員名]} を、日程×部員の真偽値の行列 'assigned' と
+    日程ごとの部員インデックスのリスト 'by_date' (ranks の順) で持つ形にする (出欠表に無い名前は除く)。
+    """
+    member_index = status_matrix['member_index']
+    assigned = np.zeros(status_matrix['matrix'].shape, dtype=bool)
+    by_date = [[] for _ in range(len(status_matrix['dates']))]
+    for d, members in assigned_by_date.items():
+        by_date[d] = sorted({member_index[m] for m in members if m in member_index}, key=lambda j: ranks[j])
+        assigned[d, by_date[d]] = True
+    return {'assigned': assigned, 'by_date': by_date, 'ranks': ranks}
+
+def schedule_from_df(status_matrix, result_df, ranks):
+    """お稽古のDataFrame ({日程, 担当者, 人数}) から make_schedule の形にする"""
+    return make_schedule(status_matrix, assignments_from_df(status_matrix, result_df), ranks)
+
+def copy_schedule(schedule):
+    return {'assigned': schedule['assigned'].copy(), 'by_date': [list(v) for v in schedule['by_date']], 'ranks': schedule['ranks']}
+
+def schedule_assignments(status_matrix, schedule):
+    """お稽古を {日程インデックス: [部員名]} にする (ソルバーに渡すとき)"""
+    members = status_matrix['members']
+    return {d: [members[j] for j in idx] for d, idx in enumerate(schedule['by_date'])}
+
+def schedule_to_df(status_matrix, schedule):
+    """お稽古を {日程, 担当者, 人数} のDataFrameにする (保存するとき)"""
+    members = status_matrix['members']
+    return pd.DataFrame([{"日程": date, "担当者": ", ".join(members[j] for j in idx), "人数": len(idx)}
+                         for date, idx in zip(status_matrix['dates'].tolist(), schedule['by_date'])])
+
+def is_member_locked(status_matrix, member, d):
+    """日程 d のほかに参加できる日程が無い (動かせない) 部員か"""
+    j = status_matrix['member_index'].get(member)
+    return j is None or not any(day != d for day in np.flatnonzero(status_matrix['matrix'][:, j]).tolist())
+
+def can_move(status_matrix, schedule, member, src, dst):
+    """部員を日程 src から dst へ動かせるか (dst に参加でき、まだ入っていない)"""
+    j = status_matrix['member_index'].get(member)
+    n_dates = len(status_matrix['dates'])
+    if j is None or src == dst or not (0 <= src < n_dates and 0 <= dst < n_dates): return False
+    return bool(schedule['assigned'][src, j] and not schedule['assigned'][dst, j] and status_matrix['matrix'][dst, j] > 0)
+
+def can_swap(status_matrix, schedule, member_a, src, member_b, dst):
+    """日程 src の member_a と日程 dst の member_b を入れ替えられるか (互いの日程に参加でき、同じ日程に重ならない)"""
+    member_index = status_matrix['member_index']
+    a, b = member_index.get(member_a), member_index.get(member_b)
+    n_dates = len(status_matrix['dates'])
+    if a is None or b is None or a == b or src == dst or not (0 <= src < n_dates and 0 <= dst < n_dates): return False
+    assigned, matrix = schedule['assigned'], status_matrix['matrix']
+    if not assigned[src, a] or not assigned[dst, b] or assigned[dst, a] or assigned[src, b]: return False
+    return bool(matrix[dst, a] > 0 and matrix[src, b] > 0)
+
+def move_member(schedule, j, src, dst):
+    """部員インデックス j を日程 src から dst へ動かす (並び順は ranks のまま)"""
+    ranks = schedule['ranks']
+    schedule['assigned'][src, j] = False
+    schedule['assigned'][dst, j] = True
+    schedule['by_date'][src].remove(j)
+    insort(schedule['by_date'][dst], j, key=lambda k: ranks[k])
+
+def edit_transition(status_matrix, schedule, selection, event):
+    """
+    選択の状態 selection で操作 event を受けたときの、次の選択の状態を返す。
+    戻り値: (次の選択の状態, 動かした [(部員インデックス, 元の日程インデックス, 移動先の日程インデックス)] (編集しなかったときは None))
+    移動・交換は規則に合わなければ何もしない (選択はそのまま)。規則に合えば schedule をその場で書き換え、選択を外す。
+    """
+    action = event.get('action')
+    member_index = status_matrix['member_index']
+    if action == 'select_member':
+        if selection is not None and selection['type'] == 'member' and (selection['member'], selection['date']) == (event['member'], event['date']):
+            return None, None
+        j = member_index.get(event['member'])
+        if j is None or not 0 <= event['date'] < len(schedule['by_date']) or not schedule['assigned'][event['date'], j]: return selection, None
+        return {'type': 'member', 'member': event['member'], 'date': event['date']}, None
+    if action == 'select_date':
+        if selection is not None and selection['type'] == 'date' and selection['date'] == event['date']:
+            return None, None
+        return {'type': 'date', 'date': event['date']}, None
+    if action == 'cancel':
+        return None, None
+    if action == 'move':
+        member, src, dst = event['member'], event['from'], event['to']
+        if not can_move(status_matrix, schedule, member, src, dst): return selection, None
+        move_member(schedule, member_index[member], src, dst)
+        return None, [(member_index[member], src, dst)]
+    if action == 'swap':
+        member_a, src, member_b, dst = event['member_a'], event['from'], event['member_b'], event['to']
+        if not can_swap(status_matrix, schedule, member_a, src, member_b, dst): return selection, None
+        move_member(schedule, member_index[member_a], src, dst)
+        move_member(schedule, member_index[member_b], dst, src)
+        return None, [(member_index[member_a], src, dst), (member_index[member_b], dst, src)]
+    return selection, None
+
+def apply_grid_edit(status_matrix, schedule, revision, event):
+    """
+    編集グリッドから返ってきた移動・交換 event を schedule に反映する。
+    表示中のお稽古の番号 revision に対する操作でなければ (古い画面からの操作)、何もしない。
+    戻り値: edit_transition と同じ動かした部員のリスト (反映しなかったときは None)
+    """
+    if not event or event.get('revision') != revision: return None
+    return edit_transition(status_matrix, schedule, None, event)[1]
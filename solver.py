@@ -0,0 +1,1710 @@
+import pandas as pd
+import pulp
+import numpy as np
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
+import heapq
+import math
+import os
+import pickle
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# ==========================================
+# お稽古の計算 (Streamlitに依存しない部分。バックグラウンドのプロセスからも読み込む)
+# ==========================================
+STATUS_CODES = {"○": 2, "△": 1}
+STOPPED_TIME_LIMIT = 1  # 打ち切りを頼まれた後に始まったCBCに与える秒数
+WORKER_IDLE_TIMEOUT = 30 * 60  # この秒数仕事が来なければバックグラウンドのプロセスを終える
+STATUS_SYMBOLS = {2: "○", 1: "△"}
+GRADE_PENALTY = 10  # 同じ日程に同じ学年が2人以上入るときの、1人あたりのペナルティ
+SPACING_PENALTY = 50  # 2回以上参加する部員が連続した日程に入るときのペナルティ (1日空きはその半分)
+# CBCの設定 (time_limit: 全体の秒数の上限, gap: 最適値との差がこの割合以下になれば止める, threads: CBC1回あたりのスレッド数)
+SOLVER_PROFILES = {
+    'quick': {'time_limit': 10, 'gap': 0.05, 'threads': 1},
+    'balanced': {'time_limit': 60, 'gap': 0.01, 'threads': 2},
+    'exact': {'time_limit': None, 'gap': 0.0, 'threads': os.cpu_count() or 1},
+}
+# 求解の状態 (悪い順。成分ごとの状態のうち一番悪いものを全体の状態にする)
+SOLVE_STATUSES = ['infeasible', 'not_solved', 'stopped', 'heuristic', 'time_limit', 'gap', 'optimal']
+# 解き方 (kind: 'mip' はPuLPのモデルをそのソルバーで解く、'heuristic' はモデルを作らずに近似解を求める)
+SOLVER_BACKENDS = {
+    'highs': {'kind': 'mip', 'label': "HiGHS"},
+    'cbc': {'kind': 'mip', 'label': "CBC"},
+    'glpk': {'kind': 'mip', 'label': "GLPK"},
+    'flow': {'kind': 'heuristic', 'label': "最小費用流"},
+    'lns': {'kind': 'heuristic', 'label': "大近傍探索"},
+    'portfolio': {'kind': 'portfolio', 'label': "ポートフォリオ"},
+}
+# "auto" で選ぶMIPソルバーの順 (使えるもののうち先頭。benchmark_backends.py の結果を見て並べ替える)
+MIP_BACKEND_ORDER = ['cbc', 'highs', 'glpk']
+# ○/△のセルがこれより多い出欠表は、"auto" ではMIPを使わず近似解法(大近傍探索)で解く。大近傍探索は同じ解にCBCの2〜5倍の時間がかかるので、
+# CBCが時間内に解を見つけられない大きさだけに使う (benchmark_backends.py, balanced: 約46000セルはCBC 31秒・大近傍探索 60秒、約69000セルはCBCが解なし)
+HEURISTIC_CELLS = 60000
+# 大近傍探索: 連続した LNS_WINDOW_DATES 日程ずつ、そこに入っている部員と参加可能な部員 (最大 LNS_FREE_MEMBERS 名) を解き直す
+LNS_WINDOW_DATES = 4
+LNS_FREE_MEMBERS = 60
+LNS_STEP_SECONDS = 5  # 1回の解き直しの時間の上限
+LNS_DEFAULT_SECONDS = 120  # 時間の上限が無い設定 ("exact") で大近傍探索を使うときの時間
+# ポートフォリオで同時に走らせる解き方 (options はCBCのコマンドラインに足す設定。使えない解き方は飛ばす)
+PORTFOLIO_STRATEGIES = [
+    {'name': 'cbc', 'backend': 'cbc', 'options': []},
+    {'name': 'cbc_seed', 'backend': 'cbc', 'options': ["randomCbcSeed 20240401", "randomSeed 20240401"]},
+    {'name': 'cbc_nocuts', 'backend': 'cbc', 'options': ["cuts off"]},
+    {'name': 'highs', 'backend': 'highs', 'options': []},
+    {'name': 'lns', 'backend': 'lns', 'options': []},
+]
+PORTFOLIO_POLL_SECONDS = 0.05
+PORTFOLIO_GRACE_SECONDS = 5  # 時間切れで中断を頼んでから、途中の解を返してくるのを待つ秒数
+# ポートフォリオは backend="portfolio" と指定したときだけ使い、"auto" では選ばない。
+# 戦略ごとにプロセスを起動する分 (数秒) がかかり、1コアで測った範囲ではどの大きさでもCBCを直接使う方が速かった
+# (benchmark_backends.py: 20x80 (約650セル) でCBC 0.15秒に対し5秒、60x400 (約9300セル) でCBC 6秒に対し31秒)。
+# 複数コアでは測っていないので、測って速くなる大きさが分かるまで自動では選ばない
+
+def build_status_matrix(df):
+    """
+    clean_dfを一度だけ解析し、出欠をint8の行列 (日程×部員, ○=2, △=1, それ以外=0) にまとめる。
+    """
+    dates = np.array(df.iloc[:, 0].fillna("").astype(str).str.strip().tolist(), dtype=object)
+    members = np.array(df.columns[1:].tolist(), dtype=object)
+    cells = np.char.strip(df.iloc[:, 1:].astype(str).to_numpy(dtype=str))
+    matrix = np.zeros(cells.shape, dtype=np.int8)
+    for symbol, code in STATUS_CODES.items():
+        matrix[cells == symbol] = code
+    return make_status_matrix(matrix, dates, members)
+
+def make_status_matrix(matrix, dates, members, date_positions=None):
+    # date_positions: 元の日程表での位置 (部分行列でも連続勤務の判定に使う)
+    if date_positions is None:
+        date_positions = np.arange(len(dates))
+    return {
+        'matrix': matrix,
+        'dates': dates,
+        'members': members,
+        'date_positions': date_positions,
+        'date_index': {d: i for i, d in enumerate(dates)},
+        'member_index': {m: j for j, m in enumerate(members)},
+        'candidate_counts': (matrix > 0).sum(axis=0),
+    }
+
+def subset_status_matrix(status_matrix, date_indices, member_indices):
+    return make_status_matrix(
+        status_matrix['matrix'][np.ix_(date_indices, member_indices)],
+        status_matrix['dates'][date_indices],
+        status_matrix['members'][member_indices],
+        status_matrix['date_positions'][date_indices],
+    )
+
+def build_roster(roster_df):
+    """
+    部員名簿のDataFrameから、名前(前後の空白を除く)で引ける索引を作る。名簿を読み込んだときに一度だけ作り、画面とソルバーで共有する。
+    names: 名簿の行順の名前, rank: {名前: 名簿の行番号}, grade: {名前: 学年} (学年の列が無ければ空。1年生かは is_freshman_grade で判定),
+    extra_label: 3列目の列名 (無ければ None), extra: {名前: 3列目の値} (空欄は除く)
+    """
+    if roster_df is None: return None
+    names = [str(n).strip() for n in roster_df['氏名'].tolist()]
+    grade = {name: str(g).strip() for name, g in zip(names, roster_df['学年'].tolist())} if '学年' in roster_df.columns else {}
+    extra_label = roster_df.columns[2] if len(roster_df.columns) >= 3 else None
+    extra = {}
+    if extra_label is not None:
+        extra = {name: str(v).strip() for name, v in zip(names, roster_df[extra_label].tolist()) if pd.notna(v) and str(v).strip() != ""}
+    return {
+        'names': names,
+        'rank': {name: i for i, name in enumerate(names)},
+        'grade': grade,
+        'extra_label': extra_label,
+        'extra': extra,
+    }
+
+def sort_members_by_roster(member_list, roster):
+    if not member_list: return []
+    if roster is None:
+        member_list.sort()
+        return member_list
+    rank_map = roster['rank']
+    member_list.sort(key=lambda name: rank_map.get(name, 999999))
+    return member_list
+
+def is_freshman_grade(g_str):
+    return g_str == "1" or "1年" in g_str
+
+def get_member_grade_map(roster):
+    if roster is None: return {}
+    return roster['grade']
+
+def aggregate_members(status_matrix, member_grade_map, member_targets=None):
+    """
+    ○/△の行・学年が同一で参加回数が1回の部員を同値類にまとめる。
+    2回以上参加する部員は連続勤務ペナルティが個人ごとに異なるため、常に一人だけの類にする。
+    戻り値: 類ごとの部員インデックスのリスト (参加可能日が一つも無い部員は除外)
+    """
+    if member_targets is None:
+        member_targets = {}
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    classes = []
+    class_by_key = {}
+    for m_idx, member in enumerate(members):
+        column = matrix[:, m_idx]
+        if not column.any(): continue
+        if member_targets.get(member, 1) != 1:
+            classes.append([m_idx])
+            continue
+        key = (column.tobytes(), member_grade_map.get(member, ""))
+        if key not in class_by_key:
+            class_by_key[key] = len(classes)
+            classes.append([])
+        classes[class_by_key[key]].append(m_idx)
+    return classes
+
+def find_forced_members(status_matrix, member_targets=None):
+    """参加可能日数と参加回数が等しい部員(1日しか参加できない部員を含む)のインデックス"""
+    if member_targets is None:
+        member_targets = {}
+    counts = status_matrix['candidate_counts']
+    return [m_idx for m_idx, member in enumerate(status_matrix['members'].tolist()) if counts[m_idx] > 0 and member_targets.get(member, 1) == counts[m_idx]]
+
+def presolve_forced_assignments(status_matrix, member_targets=None):
+    """
+    割り当てが確定している部員をモデルに入れる前に固定する。
+    戻り値: 固定した部員の列を0にした出欠行列, {日程インデックス: [固定した部員名]}, 削減の集計
+    """
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    forced = find_forced_members(status_matrix, member_targets)
+    forced_by_date = defaultdict(list)
+    for m_idx in forced:
+        for d in np.flatnonzero(matrix[:, m_idx]).tolist():
+            forced_by_date[d].append(members[m_idx])
+
+    free_matrix = matrix.copy()
+    free_matrix[:, forced] = 0
+    reduced = make_status_matrix(free_matrix, status_matrix['dates'], status_matrix['members'], status_matrix['date_positions'])
+    report = {
+        'fixed_members': len(forced),
+        'fixed_assignments': sum(len(v) for v in forced_by_date.values()),
+        'total_cells': int(np.count_nonzero(matrix)),
+    }
+    return reduced, dict(forced_by_date), report
+
+def build_shift_model(status_matrix, roster=None, member_targets=None, forced_by_date=None, has_freshmen=None):
+    """
+    出欠と学年(=構造)だけからPuLPモデルを組み立てる。
+    入れ替えても結果が変わらない部員は同値類にまとめ、変数は「その日に類から何人入るか」の整数とする。
+    forced_by_date には事前処理で固定した部員 {日程インデックス: [部員名]} を渡し、人数や学年の枠から差し引く。
+    人数・1年生人数・参加回数などの右辺は update_shift_model で後から書き換える。
+    """
+    matrix = status_matrix['matrix']
+    dates = status_matrix['dates'].tolist()
+    members = status_matrix['members'].tolist()
+    member_grade_map = get_member_grade_map(roster)
+    if forced_by_date is None:
+        forced_by_date = {}
+    if has_freshmen is None:
+        has_freshmen = any(is_freshman_grade(member_grade_map.get(m, "")) for m in members)
+    classes = aggregate_members(status_matrix, member_grade_map, member_targets)
+
+    # 疎な構造: ○/△のセルだけを変数にする (×・空欄のセルは変数も制約も作らない)
+    preference_scores = {}
+    dates_of_class = defaultdict(list)
+    classes_of_date = defaultdict(list)
+    for c_idx, class_members in enumerate(classes):
+        column = matrix[:, class_members[0]]
+        for d_idx in np.flatnonzero(column).tolist():
+            preference_scores[(d_idx, c_idx)] = int(column[d_idx])
+            dates_of_class[c_idx].append(d_idx)
+            classes_of_date[d_idx].append(c_idx)
+
+    # CBCは最大化問題に初期解(mipstart)を渡すと最適性の判定を誤ることがあるため、
+    # 「ペナルティ - 希望スコア」の最小化として定式化する
+    prob = pulp.LpProblem("Shift_Scheduler", pulp.LpMinimize)
+    x = {}
+    for (d_idx, c_idx) in preference_scores:
+        if len(classes[c_idx]) == 1:
+            x[d_idx, c_idx] = pulp.LpVariable(f"assign_{d_idx}_{c_idx}", cat='Binary')
+        else:
+            x[d_idx, c_idx] = pulp.LpVariable(f"assign_{d_idx}_{c_idx}", lowBound=0, upBound=len(classes[c_idx]), cat='Integer')
+            
+    # ペナルティ設定（学年）
+    penalty_term = 0
+    
+    # 1. 学年重複ペナルティ
+    freshmen_classes = set()
+    excess_terms = []
+    if member_grade_map:
+        unique_grades = {g for g in set(member_grade_map.values()) if g and g.lower() != 'nan'}
+        
+        for c_idx, class_members in enumerate(classes):
+            if is_freshman_grade(member_grade_map.get(members[class_members[0]], "")):
+                freshmen_classes.add(c_idx)
+        
+        # 同じ日に同学年が2人以上入り得る (日程, 学年) の組だけ超過変数を作る
+        grade_ids = {g: i for i, g in enumerate(sorted(unique_grades))}
+        excess_vars = []
+        for d in range(len(dates)):
+            grade_classes = defaultdict(list)
+            for c_idx in classes_of_date[d]:
+                g = member_grade_map.get(members[classes[c_idx][0]])
+                if g in unique_grades:
+                    grade_classes[g].append(c_idx)
+            forced_grades = defaultdict(int)
+            for member in forced_by_date.get(d, []):
+                forced_grades[member_grade_map.get(member)] += 1
+            for g, grade_class_indices in grade_classes.items():
+                # 固定済みの同学年の人数だけ、超過なしで入れる枠を減らす
+                if sum(len(classes[c]) for c in grade_class_indices) + forced_grades[g] > 1:
+                    excess = pulp.LpVariable(f"excess_{d}_{grade_ids[g]}", lowBound=0, cat='Integer')
+                    prob += pulp.lpSum([x[d, c] for c in grade_class_indices]) <= 1 - forced_grades[g] + excess
+                    excess_vars.append(excess)
+                    excess_terms.append((excess, d, grade_class_indices, forced_grades[g]))
+        if excess_vars:
+            penalty_term += pulp.lpSum(excess_vars) * GRADE_PENALTY
+
+    # 2. 連続勤務ペナルティは参加回数に応じて update_shift_model で追加する
+    base_score = pulp.lpSum([x[key] * score for key, score in preference_scores.items()])
+    prob += penalty_term - base_score
+    
+    # 制約: 各類の合計参加回数 (右辺は後から書き換える)
+    target_constraints = {}
+    for c_idx in range(len(classes)):
+        prob += pulp.lpSum([x[d, c_idx] for d in dates_of_class[c_idx]]) == len(classes[c_idx]), f"target_{c_idx}"
+        target_constraints[c_idx] = prob.constraints[f"target_{c_idx}"]
+    
+    # 制約: 各日程の人数 (人数を整数変数にし、その上下限を後から書き換える)
+    date_counts = {}
+    fresh_counts = {}
+    fresh_classes_of_date = {}
+    for d in range(len(dates)):
+        if not classes_of_date[d]: continue
+        date_counts[d] = pulp.LpVariable(f"count_{d}", lowBound=0, cat='Integer')
+        prob += pulp.lpSum([x[d, c] for c in classes_of_date[d]]) == date_counts[d]
+        
+        fresh_of_date = [c for c in classes_of_date[d] if c in freshmen_classes]
+        if fresh_of_date:
+            fresh_counts[d] = pulp.LpVariable(f"fresh_{d}", lowBound=0, cat='Integer')
+            prob += pulp.lpSum([x[d, c] for c in fresh_of_date]) == fresh_counts[d]
+            fresh_classes_of_date[d] = fresh_of_date
+
+    return {
+        'prob': prob,
+        'x': x,
+        'dates': dates,
+        'members': members,
+        'date_positions': status_matrix['date_positions'].tolist(),
+        'classes': classes,
+        'aggregated_members': {members[m] for c in classes if len(c) > 1 for m in c},
+        'dates_of_class': dates_of_class,
+        'classes_of_date': classes_of_date,
+        'has_freshmen': has_freshmen,
+        'forced_counts': {d: len(v) for d, v in forced_by_date.items()},
+        'forced_fresh_counts': {d: sum(is_freshman_grade(member_grade_map.get(m, "")) for m in v) for d, v in forced_by_date.items()},
+        'target_constraints': target_constraints,
+        'date_counts': date_counts,
+        'fresh_counts': fresh_counts,
+        'fresh_classes_of_date': fresh_classes_of_date,
+        'excess_terms': excess_terms,
+        'spacing_classes': set(),
+        'spacing_terms': [],
+    }
+
+def is_model_compatible(model, member_targets):
+    """同値類にまとめた部員が全員1回参加のままであれば、組み立て済みモデルを使い回せる"""
+    if member_targets is None: return True
+    return all(member_targets.get(m, 1) == 1 for m in model['aggregated_members'])
+
+def update_shift_model(model, min_list, max_list, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    """
+    組み立て済みモデルの右辺(各日程の人数、1年生人数、参加回数)をその場で書き換える。
+    明らかに実行不可能な設定の場合は False を返す。
+    """
+    prob = model['prob']
+    x = model['x']
+    members = model['members']
+    classes = model['classes']
+    dates_of_class = model['dates_of_class']
+    date_positions = model['date_positions']
+    if member_targets is None:
+        member_targets = {}
+
+    for d in range(len(model['dates'])):
+        val_min = int(min_list[d]) if pd.notna(min_list[d]) else 0
+        val_max = int(max_list[d]) if pd.notna(max_list[d]) else 1
+        f_min = int(fresh_min_list[d]) if fresh_min_list is not None and pd.notna(fresh_min_list[d]) else 0
+        f_max = int(fresh_max_list[d]) if fresh_max_list is not None and pd.notna(fresh_max_list[d]) else None
+
+        # 事前処理で固定した人数を枠から差し引く
+        forced_n = model['forced_counts'].get(d, 0)
+        forced_f = model['forced_fresh_counts'].get(d, 0)
+        if val_max < forced_n or val_min > val_max: return False
+        if f_max is not None and f_min > f_max and model['has_freshmen']: return False
+        if d in model['date_counts']:
+            model['date_counts'][d].lowBound = max(0, val_min - forced_n)
+            model['date_counts'][d].upBound = val_max - forced_n
+        elif val_min > forced_n: return False
+
+        if f_max is not None and f_max < forced_f and model['has_freshmen']: return False
+        if d in model['fresh_counts']:
+            model['fresh_counts'][d].lowBound = max(0, f_min - forced_f)
+            model['fresh_counts'][d].upBound = f_max - forced_f if f_max is not None else None
+        elif f_min > forced_f and model['has_freshmen']: return False
+
+    spacing_penalty_vars = []
+    for c_idx, constraint in model['target_constraints'].items():
+        target = sum(member_targets.get(members[m], 1) for m in classes[c_idx])
+        constraint.changeRHS(target)
+
+        # 連続勤務ペナルティ (2回以上入る人のみ、初めて2回以上になったときに追加)
+        if len(classes[c_idx]) == 1 and target > 1 and c_idx not in model['spacing_classes']:
+            model['spacing_classes'].add(c_idx)
+            date_of_position = {date_positions[d]: d for d in dates_of_class[c_idx]}
+            for d in dates_of_class[c_idx]:
+                pos = date_positions[d]
+                # 隣接する日程 (d, d+1)
+                if pos + 1 in date_of_position:
+                    y_con = pulp.LpVariable(f"con_{d}_{c_idx}", cat='Binary')
+                    prob += y_con >= x[d, c_idx] + x[date_of_position[pos + 1], c_idx] - 1
+                    spacing_penalty_vars.append(y_con)
+                    model['spacing_terms'].append((y_con, c_idx, d, date_of_position[pos + 1]))
+                # 1日空き (d, d+2) も少しペナルティを与える
+                if pos + 2 in date_of_position:
+                    y_gap1 = pulp.LpVariable(f"gap1_{d}_{c_idx}", cat='Binary')
+                    prob += y_gap1 >= x[d, c_idx] + x[date_of_position[pos + 2], c_idx] - 1
+                    spacing_penalty_vars.append(y_gap1 * 0.5)
+                    model['spacing_terms'].append((y_gap1, c_idx, d, date_of_position[pos + 2]))
+
+    if spacing_penalty_vars:
+        prob.setObjective(prob.objective + pulp.lpSum(spacing_penalty_vars) * SPACING_PENALTY)
+    return True
+
+def expand_class_counts(model, class_counts, roster=None):
+    """
+    類ごと・日程ごとの人数 {(d, c): n} を名簿順に部員へ割り振り、日程ごとの担当者リストに戻す。
+    類の部員を名簿順に並べ、日程順に巡回して割り当てるので、同じ部員が同じ日に二度入ることはない。
+    """
+    members = model['members']
+    assigned_by_date = defaultdict(list)
+    for c_idx, class_members in enumerate(model['classes']):
+        ordered = sort_members_by_roster([members[m] for m in class_members], roster)
+        pos = 0
+        for d in model['dates_of_class'][c_idx]:
+            for _ in range(class_counts.get((d, c_idx), 0)):
+                assigned_by_date[d].append(ordered[pos % len(ordered)])
+                pos += 1
+    return assigned_by_date
+
+def set_warm_start(model, class_counts):
+    """
+    類ごと・日程ごとの人数 {(d, c): n} を初期解としてモデルの変数に設定する。
+    人数・1年生人数・学年超過・連続勤務の補助変数も、その割り当てから計算して埋める。
+    """
+    x = model['x']
+    for key, var in x.items():
+        var.setInitialValue(class_counts.get(key, 0), check=False)
+    forced_counts = model['forced_counts']
+    for d, var in model['date_counts'].items():
+        var.setInitialValue(sum(class_counts.get((d, c), 0) for c in model['classes_of_date'][d]), check=False)
+    for d, var in model['fresh_counts'].items():
+        var.setInitialValue(sum(class_counts.get((d, c), 0) for c in model['fresh_classes_of_date'][d]), check=False)
+    for var, d, grade_class_indices, n_forced in model['excess_terms']:
+        var.setInitialValue(max(0, sum(class_counts.get((d, c), 0) for c in grade_class_indices) + n_forced - 1), check=False)
+    for var, c_idx, d1, d2 in model['spacing_terms']:
+        var.setInitialValue(1 if class_counts.get((d1, c_idx), 0) and class_counts.get((d2, c_idx), 0) else 0, check=False)
+
+def min_cost_flow(n_nodes, edges, source, sink):
+    """
+    逐次最短路法(ポテンシャル付きDijkstra)による最小費用流。
+    edges: [(from, to, capacity, cost), ...]  戻り値: (流量, 各辺の流量のリスト)
+    """
+    graph = [[] for _ in range(n_nodes)]
+    to, cap, cost = [], [], []
+    for u, v, c, w in edges:
+        graph[u].append(len(to)); to.append(v); cap.append(c); cost.append(w)
+        graph[v].append(len(to)); to.append(u); cap.append(0); cost.append(-w)
+
+    # 負の費用の辺があるので、初期ポテンシャルはBellman-Ford(SPFA)で求める
+    potential = [math.inf] * n_nodes
+    potential[source] = 0
+    queue = [source]
+    in_queue = [False] * n_nodes
+    while queue:
+        u = queue.pop()
+        in_queue[u] = False
+        for e in graph[u]:
+            if cap[e] > 0 and potential[u] + cost[e] < potential[to[e]]:
+                potential[to[e]] = potential[u] + cost[e]
+                if not in_queue[to[e]]:
+                    in_queue[to[e]] = True
+                    queue.append(to[e])
+    potential = [p if p < math.inf else 0 for p in potential]
+
+    flow = 0
+    while True:
+        dist = [math.inf] * n_nodes
+        prev_edge = [-1] * n_nodes
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d_u, u = heapq.heappop(heap)
+            if d_u > dist[u]: continue
+            for e in graph[u]:
+                if cap[e] <= 0: continue
+                v = to[e]
+                nd = d_u + cost[e] + potential[u] - potential[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    prev_edge[v] = e
+                    heapq.heappush(heap, (nd, v))
+        if dist[sink] == math.inf:
+            break
+        for v in range(n_nodes):
+            if dist[v] < math.inf: potential[v] += dist[v]
+
+        push = math.inf
+        v = sink
+        while v != source:
+            e = prev_edge[v]
+            push = min(push, cap[e])
+            v = to[e ^ 1]
+        v = sink
+        while v != source:
+            e = prev_edge[v]
+            cap[e] -= push
+            cap[e ^ 1] += push
+            v = to[e ^ 1]
+        flow += push
+    return flow, [cap[2 * i + 1] for i in range(len(edges))]
+
+def solve_assignment_flow(status_matrix, min_list, max_list, member_targets=None):
+    """
+    学年・連続勤務のペナルティを無視した割り当てを最小費用流で求める (○=2, △=1 の合計を最大化)。
+    始点 → 部員の類 → 日程 → 終点 と流し、各日程の最小人数は大きな報酬を付けた辺で満たす。
+    名簿が無く全員1回参加ならこれが最適解になり、そうでなければMIPの初期解として使う。
+    戻り値: {日程インデックス: [部員名]} (条件を満たせなければ None)
+    """
+    if member_targets is None:
+        member_targets = {}
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    n_dates = len(status_matrix['dates'])
+    classes = aggregate_members(status_matrix, {}, member_targets)
+    total = sum(member_targets.get(members[m], 1) for c in classes for m in c)
+    reward = 2 * total + 1
+
+    source, sink = 0, 1
+    class_node = lambda c_idx: 2 + c_idx
+    date_node = lambda d: 2 + len(classes) + d
+    edges = []
+    class_edges = {}
+    for c_idx, class_members in enumerate(classes):
+        edges.append((source, class_node(c_idx), sum(member_targets.get(members[m], 1) for m in class_members), 0))
+        column = matrix[:, class_members[0]]
+        for d in np.flatnonzero(column).tolist():
+            class_edges[(d, c_idx)] = len(edges)
+            edges.append((class_node(c_idx), date_node(d), len(class_members), -int(column[d])))
+    required = 0
+    for d in range(n_dates):
+        val_min = int(min_list[d]) if pd.notna(min_list[d]) else 0
+        val_max = int(max_list[d]) if pd.notna(max_list[d]) else 1
+        if val_min > val_max: return None
+        required += val_min
+        if val_min > 0: edges.append((date_node(d), sink, val_min, -reward))
+        if val_max > val_min: edges.append((date_node(d), sink, val_max - val_min, 0))
+
+    flow, edge_flows = min_cost_flow(2 + len(classes) + n_dates, edges, source, sink)
+    if flow < total:
+        return None
+    # 最小人数の辺がすべて埋まっていなければ条件を満たす割り当ては存在しない
+    for (u, v, c, w), f in zip(edges, edge_flows):
+        if w == -reward and f < c:
+            return None
+
+    class_counts = {key: edge_flows[e] for key, e in class_edges.items() if edge_flows[e] > 0}
+    flow_model = {'members': members, 'classes': classes, 'dates_of_class': defaultdict(list)}
+    for d, c_idx in sorted(class_edges):
+        flow_model['dates_of_class'][c_idx].append(d)
+    return expand_class_counts(flow_model, class_counts)
+
+def find_components(matrix):
+    """
+    出欠の二部グラフ(日程-部員)を連結成分に分ける。
+    戻り値: [(日程インデックス配列, 部員インデックス配列), ...] (参加可能な部員がいない日程は含めない)
+    """
+    n_dates, n_members = matrix.shape
+    parent = list(range(n_dates))
+    def find(d):
+        while parent[d] != d:
+            parent[d] = parent[parent[d]]
+            d = parent[d]
+        return d
+
+    first_date_of_member = {}
+    for m_idx in range(n_members):
+        valid_days = np.flatnonzero(matrix[:, m_idx]).tolist()
+        if not valid_days: continue
+        first_date_of_member[m_idx] = valid_days[0]
+        for d in valid_days[1:]:
+            root_a, root_b = find(valid_days[0]), find(d)
+            if root_a != root_b: parent[root_b] = root_a
+
+    members_of_root = defaultdict(list)
+    for m_idx, d in first_date_of_member.items():
+        members_of_root[find(d)].append(m_idx)
+    dates_of_root = defaultdict(list)
+    for d in range(n_dates):
+        dates_of_root[find(d)].append(d)
+    return [(np.array(dates_of_root[root]), np.array(member_indices)) for root, member_indices in members_of_root.items()]
+
+def build_decomposed_model(status_matrix, roster=None, member_targets=None):
+    """
+    割り当てが確定している部員を固定したうえで、独立した連結成分ごとに build_shift_model でモデルを組み立てる。
+    平日組と週末組のように回答者が重ならない日程どうしは、別々に(並列に)解ける。
+    """
+    member_grade_map = get_member_grade_map(roster)
+    has_freshmen = any(is_freshman_grade(member_grade_map.get(m, "")) for m in status_matrix['members'].tolist())
+    reduced, forced_by_date, report = presolve_forced_assignments(status_matrix, member_targets)
+
+    components = []
+    for date_indices, member_indices in find_components(reduced['matrix']):
+        sub_matrix = subset_status_matrix(reduced, date_indices, member_indices)
+        local_forced = {i: forced_by_date[d] for i, d in enumerate(date_indices.tolist()) if d in forced_by_date}
+        components.append({
+            'date_indices': date_indices.tolist(),
+            'model': build_shift_model(sub_matrix, roster, member_targets, local_forced, has_freshmen),
+        })
+    return {
+        'components': components,
+        'status_matrix': status_matrix,
+        'forced_members': frozenset(find_forced_members(status_matrix, member_targets)),
+        'forced_by_date': forced_by_date,
+        'forced_fresh_counts': {d: sum(is_freshman_grade(member_grade_map.get(m, "")) for m in v) for d, v in forced_by_date.items()},
+        'has_freshmen': has_freshmen,
+        # 固定した部員の希望度・連続勤務のペナルティは成分のモデルに入らないので、目的関数値に足す定数として持っておく
+        # (学年の重複は成分のモデルの超過変数で数えるので、名簿を渡さずに計算する)
+        'forced_objective': schedule_objective(status_matrix, forced_by_date, None, member_targets),
+        'presolve_report': report,
+    }
+
+def is_decomposed_model_compatible(decomposed, member_targets):
+    if frozenset(find_forced_members(decomposed['status_matrix'], member_targets)) != decomposed['forced_members']:
+        return False
+    return all(is_model_compatible(c['model'], member_targets) for c in decomposed['components'])
+
+def make_mip_solver(backend, options):
+    """
+    SOLVER_BACKENDS の 'mip' のソルバーを作る。options は msg・warmStart・timeLimit・gapRel・threads・logPath・options (コマンドラインに足す設定)。
+    ソルバーが受け付けない設定は渡さない (GLPKの初期解・スレッド数、CBC以外のログや追加の設定など)。
+    """
+    if backend == 'cbc':
+        return pulp.PULP_CBC_CMD(**options)
+    options = {key: value for key, value in options.items() if key not in ('logPath', 'options')}
+    if backend == 'highs':
+        solver = pulp.HiGHS(**options)
+        return solver if solver.available() else pulp.HiGHS_CMD(**options)
+    if backend == 'glpk':
+        return pulp.GLPK_CMD(msg=options['msg'], timeLimit=options['timeLimit'],
+                             options=["--mipgap", str(options['gapRel'])] if options['gapRel'] else None)
+    raise ValueError(f"MIPのソルバーではありません: {backend}")
+
+def is_backend_available(backend):
+    """このサーバーで使える解き方か (近似解法とポートフォリオはいつでも使える)"""
+    if SOLVER_BACKENDS[backend]['kind'] != 'mip':
+        return True
+    return bool(make_mip_solver(backend, {'msg': 0, 'warmStart': False, 'timeLimit': None, 'gapRel': None, 'threads': None}).available())
+
+def first_mip_backend():
+    """MIP_BACKEND_ORDER のうち、このサーバーで最初に使えるMIPソルバー (どれも無ければ PuLP 同梱のCBC)"""
+    for backend in MIP_BACKEND_ORDER:
+        if is_backend_available(backend):
+            return backend
+    return 'cbc'
+
+def select_backend(status_matrix, roster=None, member_targets=None, k=1):
+    """
+    出欠表の大きさから解き方を選ぶ。ペナルティが無く1案だけなら最小費用流で最適解が求まり、
+    ○/△のセルが HEURISTIC_CELLS を超えれば大近傍探索、それ以外は first_mip_backend のMIPソルバー。
+    ポートフォリオは選ばない (PORTFOLIO_STRATEGIES の上のコメントを参照)。
+    """
+    if k == 1 and not needs_mip(roster, member_targets):
+        return 'flow'
+    cells = int(np.count_nonzero(status_matrix['matrix']))
+    if cells > HEURISTIC_CELLS:
+        return 'lns'
+    return first_mip_backend()
+
+def run_heuristic(backend, status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, initial_solution=None, deadline=None, stop_event=None):
+    """
+    SOLVER_BACKENDS の 'heuristic' の解き方で、条件をすべて満たすお稽古 {日程インデックス: [部員名]} を一つ求める (見つからなければ None)。
+    'flow': 学年・連続勤務のペナルティを無視した最小費用流の解 (1年生の人数の条件を満たさなければ None)。
+    'lns': initial_solution (条件を満たしていなければ最小費用流の解) を、条件を満たすよう部分的に解き直してから
+           improve_schedule_lns で deadline まで改善する。
+    """
+    if backend == 'flow':
+        assigned_by_date = solve_assignment_flow(status_matrix, min_list, max_list, member_targets)
+        if assigned_by_date is None or find_violations(status_matrix, assigned_by_date, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets) != (set(), set()):
+            return None
+        return assigned_by_date
+    if backend == 'lns':
+        if deadline is None:
+            deadline = time.perf_counter() + LNS_DEFAULT_SECONDS
+        step_profile = {'time_limit': None, 'gap': 0.0, 'threads': 1}
+        mip_backend = first_mip_backend()
+        start = initial_solution
+        if start is None or find_violations(status_matrix, start, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets) != (set(), set()):
+            start = solve_assignment_flow(status_matrix, min_list, max_list, member_targets)
+            if start is None:
+                return None
+            start, _ = repair_assignments(status_matrix, start, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets,
+                                          profile=step_profile, deadline=deadline, backend=mip_backend, stop_event=stop_event)
+            if start is None:
+                return None
+        return improve_schedule_lns(status_matrix, start, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets,
+                                    deadline, stop_event, backend=mip_backend)
+    raise ValueError(f"近似解法ではありません: {backend}")
+
+def improve_schedule_lns(status_matrix, assigned_by_date, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, deadline=None, stop_event=None, backend="cbc", seed=0):
+    """
+    条件を満たすお稽古 assigned_by_date を大近傍探索で改善して返す。
+    日程の並び順に連続した窓を選び、窓の日程に入っている部員と、窓の日程に参加可能な部員の一部だけを
+    (窓の日程といまの参加日の範囲で) reoptimize_members で解き直し、目的関数が良くなったときだけ採用する。
+    窓を一巡して良くならなければ窓を広げ、全日程でも良くならないか、deadline・stop_event で止める。
+    """
+    rnd = random.Random(seed)
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    member_grade_map = get_member_grade_map(roster)
+    has_freshmen = any(is_freshman_grade(member_grade_map.get(m, "")) for m in members)
+    n_dates = len(status_matrix['dates'])
+    dates_in_order = np.argsort(status_matrix['date_positions'], kind="stable").tolist()
+    step_profile = {'time_limit': None, 'gap': 0.0, 'threads': 1}
+
+    current = {d: list(assigned_by_date.get(d, [])) for d in range(n_dates)}
+    current_value = schedule_objective(status_matrix, current, roster, member_targets)
+    window = LNS_WINDOW_DATES
+    while True:
+        improved = False
+        starts = list(range(0, n_dates, max(1, window // 2)))
+        rnd.shuffle(starts)
+        for start in starts:
+            if (deadline is not None and time.perf_counter() >= deadline) or (stop_event is not None and stop_event.is_set()):
+                return current
+            window_dates = dates_in_order[start:start + window]
+            assigned_in_window = {m for d in window_dates for m in current[d]}
+            available = sorted({members[j] for d in window_dates for j in np.flatnonzero(matrix[d]).tolist()} - assigned_in_window)
+            free = assigned_in_window | set(rnd.sample(available, min(len(available), max(0, LNS_FREE_MEMBERS - len(assigned_in_window)))))
+            dates_of_member = defaultdict(set)
+            for d, assigned in current.items():
+                for m in assigned:
+                    dates_of_member[m].add(d)
+            allowed_dates = {m: set(window_dates) | dates_of_member[m] for m in free}
+            step_deadline = time.perf_counter() + LNS_STEP_SECONDS
+            if deadline is not None:
+                step_deadline = min(step_deadline, deadline)
+            candidate = reoptimize_members(status_matrix, current, free, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets,
+                                           has_freshmen, allowed_dates, step_profile, step_deadline, backend, stop_event)
+            if candidate is None: continue
+            value = schedule_objective(status_matrix, candidate, roster, member_targets)
+            if value < current_value - 1e-9:
+                current, current_value, improved = candidate, value, True
+        if not improved:
+            if window >= n_dates:
+                return current
+            window = min(window * 2, n_dates)
+
+def schedule_objective(status_matrix, assigned_by_date, roster=None, member_targets=None):
+    """
+    お稽古 {日程インデックス: [部員名]} の目的関数値 (ペナルティ − 希望度。モデルと同じ重み) を計算する。
+    解き方によらず同じ物差しでお稽古を比べるために使う。
+    """
+    if member_targets is None:
+        member_targets = {}
+    matrix = status_matrix['matrix']
+    member_index = status_matrix['member_index']
+    date_positions = status_matrix['date_positions']
+    member_grade_map = get_member_grade_map(roster)
+    unique_grades = {g for g in set(member_grade_map.values()) if g and g.lower() != 'nan'}
+    value = 0.0
+    positions_of_member = defaultdict(set)
+    for d, assigned in assigned_by_date.items():
+        grade_counts = defaultdict(int)
+        for m in assigned:
+            value -= int(matrix[d, member_index[m]])
+            if member_grade_map.get(m) in unique_grades:
+                grade_counts[member_grade_map[m]] += 1
+            positions_of_member[m].add(int(date_positions[d]))
+        value += GRADE_PENALTY * sum(n - 1 for n in grade_counts.values() if n > 1)
+    for m, positions in positions_of_member.items():
+        if member_targets.get(m, 1) <= 1: continue
+        value += SPACING_PENALTY * sum(1 for pos in positions if pos + 1 in positions)
+        value += SPACING_PENALTY * 0.5 * sum(1 for pos in positions if pos + 2 in positions)
+    return value
+
+def run_mip(prob, backend="cbc", warm_start=False, with_log=False, log_dir=None, stop_event=None, profile=None, deadline=None):
+    """
+    MIPソルバー (SOLVER_BACKENDS の 'mip') で解く。with_log=True なら、状態・最適値・下界・ギャップ・かかった時間を返す。
+    CBCのときはログから初期解が採用されたか・その値・下界も読み、log_dir を渡すとログをそこに残す
+    (実行中の暫定解・下界を read_cbc_progress で読むため)。ほかのソルバーでは下界・ギャップは None。
+    profile (SOLVER_PROFILES の値) のギャップとスレッド数を使い、deadline (time.perf_counter() の値) までに打ち切る。
+    stop_event がすでに立っていれば、途中の解を拾うだけの短い時間で打ち切る。
+    """
+    if profile is None:
+        profile = SOLVER_PROFILES['exact']
+    time_limit = None
+    if deadline is not None:
+        time_limit = max(deadline - time.perf_counter(), STOPPED_TIME_LIMIT)
+    if stop_event is not None and stop_event.is_set():
+        time_limit = STOPPED_TIME_LIMIT
+    options = {'msg': 0, 'warmStart': warm_start, 'timeLimit': time_limit,
+               'gapRel': profile['gap'] or None, 'threads': profile['threads'] if profile['threads'] > 1 else None}
+    if profile.get('options'):
+        options['options'] = list(profile['options'])
+    keep_log = backend == 'cbc' and (with_log or log_dir is not None)
+    if not with_log and not keep_log:
+        prob.solve(make_mip_solver(backend, options))
+        return None
+    lines = []
+    started = time.perf_counter()
+    if keep_log:
+        fd, log_path = tempfile.mkstemp(suffix=".log", dir=log_dir)
+        os.close(fd)
+        try:
+            prob.solve(make_mip_solver(backend, {**options, 'logPath': log_path}))
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()
+        finally:
+            if log_dir is None: os.remove(log_path)
+    else:
+        prob.solve(make_mip_solver(backend, options))
+    seconds = time.perf_counter() - started
+    entry = {'accepted': None, 'start_objective': None, 'status': None, 'objective': pulp.value(prob.objective), 'bound': None, 'gap': None, 'seconds': seconds}
+    for line in lines:
+        # Cbc0045I MIPStart provided solution with cost 60 / Cbc0045I Warning: mipstart values could not be used to build a solution.
+        if "MIPStart provided solution with cost" in line:
+            entry['accepted'] = True
+            entry['start_objective'] = float(line.rsplit(" ", 1)[-1])
+        elif "mipstart values could not be used" in line:
+            entry['accepted'] = False
+        # Result - Optimal solution found (within gap tolerance) / Result - Stopped on time limit / Lower bound: -6642.959
+        elif line.startswith("Result - "):
+            result = line[len("Result - "):]
+            if "time limit" in result: entry['status'] = 'time_limit'
+            elif "within gap" in result: entry['status'] = 'gap'
+            elif result.startswith("Optimal"): entry['status'] = 'optimal'
+            elif "nfeasible" in result: entry['status'] = 'infeasible'
+            else: entry['status'] = 'stopped'
+        elif line.startswith("Lower bound:"):
+            entry['bound'] = float(line.split(":", 1)[1])
+    if pulp.LpStatus[prob.status] != "Optimal":
+        entry['status'] = 'infeasible' if pulp.LpStatus[prob.status] == "Infeasible" else 'not_solved'
+        entry['objective'] = None
+    elif entry['status'] is None:
+        # CBC以外: 解はあるが最適と証明できていなければ時間切れ (sol_status 2 = 実行可能解)
+        entry['status'] = 'time_limit' if prob.sol_status == 2 else ('gap' if options['gapRel'] else 'optimal')
+    if entry['objective'] is not None:
+        if entry['bound'] is None and entry['status'] == 'optimal':
+            entry['bound'] = entry['objective']
+        if entry['bound'] is not None:
+            entry['gap'] = abs(entry['objective'] - entry['bound']) / max(abs(entry['objective']), 1.0)
+    return entry
+
+def summarize_solve_log(solve_log, offset=0.0):
+    """
+    成分ごとの求解の記録 (solve_log) を、全体の状態・目的関数値・下界・ギャップにまとめる。
+    状態は一番悪い成分のもの、値は成分の合計に offset (どの成分にも入らない、固定した部員の分) を足したもの。
+    """
+    entries = [entry for entry in solve_log if entry.get('status') is not None]
+    if not entries:
+        return {'status': None, 'objective': None, 'bound': None, 'gap': None}
+    status = min((entry['status'] for entry in entries), key=SOLVE_STATUSES.index)
+    if any(entry['objective'] is None for entry in entries):
+        return {'status': status, 'objective': None, 'bound': None, 'gap': None}
+    objective = sum(entry['objective'] for entry in entries) + offset
+    if any(entry['bound'] is None for entry in entries):
+        return {'status': status, 'objective': objective, 'bound': None, 'gap': None}
+    bound = sum(entry['bound'] for entry in entries) + offset
+    return {'status': status, 'objective': objective, 'bound': bound, 'gap': abs(objective - bound) / max(abs(objective), 1.0)}
+
+def read_cbc_progress(log_dir):
+    """
+    実行中のCBCのログ(成分ごとに1ファイル)から、暫定解の値・下界・ギャップの合計を読む。
+    まだ暫定解の無い成分があれば incumbent と gap は None。
+    """
+    incumbent, bound, complete = 0.0, 0.0, True
+    names = [name for name in os.listdir(log_dir) if name.endswith(".log")] if os.path.isdir(log_dir) else []
+    for name in names:
+        with open(os.path.join(log_dir, name), encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+        best, possible = None, None
+        for line in lines:
+            # Cbc0012I Integer solution of -150 found by ... / Cbc0045I MIPStart provided solution with cost 60
+            # Cbc0010I After 100 nodes, 5 on tree, -150 best solution, best possible -160 (1.20 seconds)
+            if "Integer solution of" in line:
+                best = float(line.split("Integer solution of", 1)[1].split()[0])
+            elif "MIPStart provided solution with cost" in line:
+                best = float(line.rsplit(" ", 1)[-1])
+            elif "best possible" in line:
+                possible = float(line.split("best possible", 1)[1].split()[0])
+            elif line.startswith("Result - Optimal solution found") and best is not None:
+                possible = best
+        if best is None:
+            complete = False
+        else:
+            incumbent += best
+        bound += possible if possible is not None else (best if best is not None else 0.0)
+    if not names or not complete:
+        return {'incumbent': None, 'bound': None, 'gap': None}
+    gap = abs(incumbent - bound) / max(abs(incumbent), 1.0)
+    return {'incumbent': incumbent, 'bound': bound, 'gap': gap}
+
+def solve_component(component, min_list, max_list, fresh_min_list, fresh_max_list, member_targets, roster, start=None, k=1, log=None, progress_dir=None, stop_event=None, profile=None, deadline=None, backend="cbc"):
+    """
+    連結成分一つ分の右辺を書き換えて解き、良い順に最大k個の [(目的関数値, {元の日程インデックス: [担当者]}), ...] を返す (解けなければ None)。
+    start ({元の日程インデックス: [部員名]}) を渡すと、それをCBCの初期解として使う。
+    2個目以降は、それまでの解をすべて除く制約(no-good cut)を足して同じモデルを解き直す。
+    log (リスト) を渡すと、最初の求解の記録 (run_mip を参照) に日程数を付けて追加する。
+    progress_dir・stop_event・profile・deadline・backend (MIPソルバー) は run_mip にそのまま渡す。打ち切られたか時間切れなら2個目以降の解は作らない。
+    """
+    date_indices = component['date_indices']
+    def pick(values):
+        return [values[d] for d in date_indices] if values is not None else None
+
+    model = component['model']
+    if not update_shift_model(model, pick(min_list), pick(max_list), pick(fresh_min_list), pick(fresh_max_list), member_targets):
+        return None
+    if start is not None:
+        members = model['members']
+        class_counts = {}
+        for (d, c_idx) in model['x']:
+            started = start.get(date_indices[d], [])
+            class_counts[d, c_idx] = sum(1 for m in model['classes'][c_idx] if members[m] in started)
+        set_warm_start(model, class_counts)
+    prob = model['prob']
+    entry = run_mip(prob, backend, warm_start=start is not None, with_log=log is not None, log_dir=progress_dir, stop_event=stop_event, profile=profile, deadline=deadline)
+    if log is not None:
+        log.append({**entry, 'dates': len(date_indices)})
+    solutions = []
+    while pulp.LpStatus[prob.status] == "Optimal":
+        class_counts = {key: int(round(pulp.value(var))) for key, var in model['x'].items()}
+        assigned_by_date = expand_class_counts(model, class_counts, roster)
+        solutions.append((pulp.value(prob.objective), {date_indices[d]: assigned for d, assigned in assigned_by_date.items()}))
+        if len(solutions) >= k or (stop_event is not None and stop_event.is_set()): break
+        if deadline is not None and time.perf_counter() >= deadline: break
+        if len(solutions) == 1:
+            # 使い回すモデルに制約を残さないよう、制約を共有したコピーの方に足していく
+            prob = prob.copy()
+        # 類ごとの参加回数の合計は固定なので、別の解はどこかの (d, c) で人数が減る: x[d, c] <= n - z, Σz >= 1
+        n_cut = len(solutions)
+        drops = []
+        for key, n in class_counts.items():
+            if n == 0: continue
+            z = pulp.LpVariable(f"nogood_{n_cut}_{key[0]}_{key[1]}", cat='Binary')
+            prob += model['x'][key] <= n - z, f"nogood_{n_cut}_{key[0]}_{key[1]}"
+            drops.append(z)
+        if not drops: break
+        prob += pulp.lpSum(drops) >= 1, f"nogood_{n_cut}"
+        run_mip(prob, backend, stop_event=stop_event, profile=profile, deadline=deadline)
+    return solutions or None
+
+def merge_k_best(partials, k):
+    """
+    成分ごとの良い順の解のリストから、目的関数値の合計が小さい順にk個の組み合わせを選ぶ。
+    戻り値: [(目的関数値の合計, [各成分の解]), ...]
+    """
+    first = tuple(0 for _ in partials)
+    heap = [(sum(p[0][0] for p in partials), first)]
+    seen = {first}
+    merged = []
+    while heap and len(merged) < k:
+        total, picks = heapq.heappop(heap)
+        merged.append((total, [partials[i][j][1] for i, j in enumerate(picks)]))
+        for i, j in enumerate(picks):
+            if j + 1 < len(partials[i]):
+                next_picks = picks[:i] + (j + 1,) + picks[i + 1:]
+                if next_picks not in seen:
+                    seen.add(next_picks)
+                    heapq.heappush(heap, (total - partials[i][j][0] + partials[i][j + 1][0], next_picks))
+    return merged
+
+def max_flow(n_nodes, edges, source, sink):
+    """
+    Dinic法による最大流。edges: [(from, to, capacity), ...]
+    戻り値: (流量, 各辺の流量のリスト, 残余グラフで始点から到達できる頂点の集合(=最小カットの始点側))
+    """
+    graph = [[] for _ in range(n_nodes)]
+    to, cap = [], []
+    for u, v, c in edges:
+        graph[u].append(len(to)); to.append(v); cap.append(c)
+        graph[v].append(len(to)); to.append(u); cap.append(0)
+
+    def push(u, limit, level, it):
+        if u == sink: return limit
+        while it[u] < len(graph[u]):
+            e = graph[u][it[u]]
+            v = to[e]
+            if cap[e] > 0 and level[v] == level[u] + 1:
+                pushed = push(v, min(limit, cap[e]), level, it)
+                if pushed:
+                    cap[e] -= pushed
+                    cap[e ^ 1] += pushed
+                    return pushed
+            it[u] += 1
+        return 0
+
+    flow = 0
+    while True:
+        level = [-1] * n_nodes
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            for e in graph[u]:
+                if cap[e] > 0 and level[to[e]] < 0:
+                    level[to[e]] = level[u] + 1
+                    queue.append(to[e])
+        if level[sink] < 0:
+            break
+        it = [0] * n_nodes
+        while True:
+            pushed = push(source, math.inf, level, it)
+            if not pushed: break
+            flow += pushed
+    reachable = {v for v in range(n_nodes) if level[v] >= 0}
+    return flow, [cap[2 * i + 1] for i in range(len(edges))], reachable
+
+def read_bounds(d, min_list, max_list, fresh_min_list, fresh_max_list):
+    val_min = int(min_list[d]) if pd.notna(min_list[d]) else 0
+    val_max = int(max_list[d]) if pd.notna(max_list[d]) else 1
+    f_min = int(fresh_min_list[d]) if fresh_min_list is not None and pd.notna(fresh_min_list[d]) else 0
+    f_max = int(fresh_max_list[d]) if fresh_max_list is not None and pd.notna(fresh_max_list[d]) else None
+    return val_min, val_max, f_min, f_max
+
+def is_schedule_feasible(status_matrix, bounds, member_targets, freshmen, relaxed=frozenset()):
+    """
+    学年・連続勤務のペナルティを除いた条件(参加回数・人数・1年生人数)をすべて満たす割り当てがあるかを、
+    下限付きの流れ(始点 → 部員 → (1年生の枠) → 日程 → 終点)の実行可能性として判定する。
+    relaxed に含まれる条件 ('min', d) / ('max', d) / ('fmin', d) / ('fmax', d) / ('target', m) は外して判定する。
+    """
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    n_dates = len(bounds)
+    source, sink, super_source, super_sink = 0, 1, 2, 3
+    member_node = lambda m: 4 + m
+    date_node = lambda d: 4 + len(members) + d
+    fresh_node = lambda d: 4 + len(members) + n_dates + d
+    unbounded = int(matrix.astype(bool).sum()) + 1
+
+    # 下限 l・上限 c の辺 u→v は、容量 c-l の辺と「超始点→v」「u→超終点」の容量 l の辺に置き換える
+    # 下限が上限を上回る辺 (最小人数 > 最大人数など) は置き換えられないので、その時点で実行不可能とする
+    edges = []
+    required = 0
+    def add_edge(u, v, low, high):
+        nonlocal required
+        if low > high: return False
+        if high > low: edges.append((u, v, high - low))
+        if low > 0:
+            edges.append((super_source, v, low))
+            edges.append((u, super_sink, low))
+            required += low
+        return True
+
+    for m_idx, member in enumerate(members):
+        valid_days = np.flatnonzero(matrix[:, m_idx]).tolist()
+        if not valid_days: continue
+        target = member_targets.get(member, 1)
+        add_edge(source, member_node(m_idx), 0 if ('target', m_idx) in relaxed else target, target)
+        for d in valid_days:
+            add_edge(member_node(m_idx), fresh_node(d) if m_idx in freshmen else date_node(d), 0, 1)
+    for d, (val_min, val_max, f_min, f_max) in enumerate(bounds):
+        if not add_edge(date_node(d), sink, 0 if ('min', d) in relaxed else val_min, unbounded if ('max', d) in relaxed else val_max): return False
+        if freshmen:
+            if not add_edge(fresh_node(d), date_node(d), 0 if ('fmin', d) in relaxed else f_min, unbounded if f_max is None or ('fmax', d) in relaxed else f_max): return False
+    edges.append((sink, source, unbounded))
+
+    flow, _, _ = max_flow(4 + len(members) + 2 * n_dates, edges, super_source, super_sink)
+    return flow == required
+
+def quick_xplain(constraints, is_consistent, background=()):
+    """
+    QuickXplain (Junker, 2004): 矛盾する制約の集合から、極小な矛盾部分集合を O(k log n) 回の判定で取り出す。
+    """
+    def explain(background, has_delta, candidates):
+        if has_delta and not is_consistent(background): return []
+        if len(candidates) == 1: return list(candidates)
+        half = len(candidates) // 2
+        first, second = candidates[:half], candidates[half:]
+        delta2 = explain(background + first, bool(first), second)
+        delta1 = explain(background + delta2, bool(delta2), first)
+        return delta1 + delta2
+    if is_consistent(list(background) + list(constraints)): return []
+    return explain(list(background), False, list(constraints))
+
+def diagnose_infeasibility(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    """
+    お稽古を作成できなかったときに、矛盾している日程・部員・1年生人数を特定する。
+    1. 日程ごと・部員ごとの単純な数の比較
+    2. Hallの条件(最大流の最小カット)による「部員の参加回数に対して枠が足りない」「最小人数に対して参加可能な部員が足りない」の検出
+    3. それでも見つからなければ、条件の極小な矛盾部分集合 (quick_xplain)
+    戻り値: [{'message': str, 'dates': [日程]}, ...]
+    """
+    if member_targets is None:
+        member_targets = {}
+    matrix = status_matrix['matrix']
+    dates = status_matrix['dates'].tolist()
+    members = status_matrix['members'].tolist()
+    counts = status_matrix['candidate_counts']
+    member_grade_map = get_member_grade_map(roster)
+    freshmen = {m_idx for m_idx, member in enumerate(members) if is_freshman_grade(member_grade_map.get(member, ""))}
+    bounds = [read_bounds(d, min_list, max_list, fresh_min_list, fresh_max_list) for d in range(len(dates))]
+    active = [m_idx for m_idx in range(len(members)) if counts[m_idx] > 0]
+    forced = set(find_forced_members(status_matrix, member_targets))
+    findings = []
+
+    # 1. 単純な数の比較
+    for m_idx in active:
+        target = member_targets.get(members[m_idx], 1)
+        if target > counts[m_idx]:
+            findings.append({'message': f"{members[m_idx]} さんの参加回数({target})が参加可能候補日数({counts[m_idx]})を上回っています。", 'dates': []})
+    for d, (val_min, val_max, f_min, f_max) in enumerate(bounds):
+        available = [m for m in active if matrix[d, m] > 0]
+        fixed = [members[m] for m in available if m in forced]
+        if val_min > val_max:
+            findings.append({'message': f"【{dates[d]}】最小人数({val_min})が最大人数({val_max})を上回っています。", 'dates': [dates[d]]})
+        if len(available) < val_min:
+            findings.append({'message': f"【{dates[d]}】参加可能な部員は{len(available)}名ですが、最小人数が{val_min}名です。", 'dates': [dates[d]]})
+        if len(fixed) > val_max:
+            findings.append({'message': f"【{dates[d]}】この日に参加が確定している部員が{len(fixed)}名({'、'.join(fixed)})いますが、最大人数が{val_max}名です。", 'dates': [dates[d]]})
+        if freshmen:
+            available_fresh = [m for m in available if m in freshmen]
+            fixed_fresh = [members[m] for m in available_fresh if m in forced]
+            if f_max is not None and f_min > f_max:
+                findings.append({'message': f"【{dates[d]}】1年生最小({f_min})が1年生最大({f_max})を上回っています。", 'dates': [dates[d]]})
+            if len(available_fresh) < f_min:
+                findings.append({'message': f"【{dates[d]}】参加可能な1年生は{len(available_fresh)}名ですが、1年生最小が{f_min}名です。", 'dates': [dates[d]]})
+            if f_max is not None and len(fixed_fresh) > f_max:
+                findings.append({'message': f"【{dates[d]}】この日に参加が確定している1年生が{len(fixed_fresh)}名({'、'.join(fixed_fresh)})いますが、1年生最大が{f_max}名です。", 'dates': [dates[d]]})
+    if findings:
+        return findings
+
+    # 2. Hallの条件: 部員の参加回数 → 日程の最大人数(1年生は1年生最大も通る)
+    n_nodes = 2 + len(members) + 2 * len(dates)
+    member_node = lambda m: 2 + m
+    date_node = lambda d: 2 + len(members) + d
+    fresh_node = lambda d: 2 + len(members) + len(dates) + d
+    def member_flow(pool):
+        edges = []
+        for m_idx in pool:
+            edges.append((0, member_node(m_idx), member_targets.get(members[m_idx], 1)))
+            for d in np.flatnonzero(matrix[:, m_idx]).tolist():
+                edges.append((member_node(m_idx), fresh_node(d) if m_idx in freshmen else date_node(d), 1))
+        for d, (val_min, val_max, f_min, f_max) in enumerate(bounds):
+            edges.append((date_node(d), 1, val_max))
+            edges.append((fresh_node(d), date_node(d), f_max if f_max is not None else len(freshmen)))
+        return max_flow(n_nodes, edges, 0, 1)
+    demand = sum(member_targets.get(members[m], 1) for m in active)
+    flow, _, reachable = member_flow(active)
+    if flow < demand:
+        # 最小カットの始点側の部員だけでも枠が足りなければ、その部員と参加可能な日程を示す
+        stuck = [m for m in active if member_node(m) in reachable]
+        stuck_demand = sum(member_targets.get(members[m], 1) for m in stuck)
+        stuck_flow, _, _ = member_flow(stuck)
+        if stuck and stuck_flow < stuck_demand:
+            stuck_dates = np.flatnonzero(matrix[:, stuck].any(axis=1)).tolist()
+            uses_fresh_cap = any(m in freshmen for m in stuck) and any(bounds[d][3] is not None for d in stuck_dates)
+            cap_label = "最大人数・1年生最大" if uses_fresh_cap else "最大人数"
+            findings.append({
+                'message': f"{'、'.join(members[m] for m in stuck)} さんが参加できる日程は {'、'.join(dates[d] for d in stuck_dates)} だけですが、"
+                           f"参加回数の合計{stuck_demand}回に対し、これらの日程の{cap_label}では合計{stuck_flow}回分しか入れません。",
+                'dates': [dates[d] for d in stuck_dates],
+            })
+
+    # Hallの条件: 日程の最小人数(1年生最小) → 参加可能な部員の参加回数
+    for label, min_index, pool in (("最小人数", 0, active), ("1年生最小", 2, [m for m in active if m in freshmen])):
+        need = sum(b[min_index] for b in bounds)
+        if need == 0 or (min_index and not freshmen): continue
+        edges = []
+        for d, b in enumerate(bounds):
+            if b[min_index] > 0:
+                edges.append((0, date_node(d), b[min_index]))
+        for m_idx in pool:
+            for d in np.flatnonzero(matrix[:, m_idx]).tolist():
+                edges.append((date_node(d), member_node(m_idx), 1))
+            edges.append((member_node(m_idx), 1, member_targets.get(members[m_idx], 1)))
+        flow, edge_flows, reachable = max_flow(n_nodes, edges, 0, 1)
+        if flow < need:
+            short_dates = [d for d in range(len(dates)) if date_node(d) in reachable]
+            short_need = sum(bounds[d][min_index] for d in short_dates)
+            # 各部員は min(参加回数, これらの日程のうち参加可能な日数) 回までしか入れない (合計は最小カット以下)
+            supply = {m: min(member_targets.get(members[m], 1), int(np.count_nonzero(matrix[short_dates, m]))) for m in pool}
+            short_members = [m for m in pool if supply[m] > 0]
+            findings.append({
+                'message': f"日程 {'、'.join(dates[d] for d in short_dates)} の{label}の合計は{short_need}名ですが、"
+                           f"これらの日程に参加可能な{'1年生' if min_index else '部員'}{len(short_members)}名が入れるのは"
+                           f"合計{sum(supply.values())}回分しかありません。",
+                'dates': [dates[d] for d in short_dates],
+            })
+    if findings:
+        return findings
+
+    # 3. 極小な矛盾部分集合
+    constraints = [('target', m) for m in active]
+    for d, (val_min, val_max, f_min, f_max) in enumerate(bounds):
+        if val_min > 0: constraints.append(('min', d))
+        constraints.append(('max', d))
+        if freshmen and f_min > 0: constraints.append(('fmin', d))
+        if freshmen and f_max is not None: constraints.append(('fmax', d))
+    all_constraints = frozenset(constraints)
+    def is_consistent(subset):
+        return is_schedule_feasible(status_matrix, bounds, member_targets, freshmen, relaxed=all_constraints - set(subset))
+    conflict = quick_xplain(constraints, is_consistent)
+    if not conflict:
+        return []
+
+    labels = []
+    conflict_dates = []
+    for kind, idx in conflict:
+        if kind == 'target':
+            labels.append(f"{members[idx]} さんの参加回数({member_targets.get(members[idx], 1)})")
+            continue
+        val_min, val_max, f_min, f_max = bounds[idx]
+        value = {'min': val_min, 'max': val_max, 'fmin': f_min, 'fmax': f_max}[kind]
+        name = {'min': "最小人数", 'max': "最大人数", 'fmin': "1年生最小", 'fmax': "1年生最大"}[kind]
+        labels.append(f"【{dates[idx]}】{name}({value})")
+        if dates[idx] not in conflict_dates: conflict_dates.append(dates[idx])
+    findings.append({'message': "次の条件を同時に満たすことはできません: " + "、".join(labels), 'dates': conflict_dates})
+    return findings
+
+def needs_mip(roster, member_targets=None):
+    """学年(名簿)か2回以上参加する部員があればペナルティ付きのMIPが必要"""
+    if member_targets is None:
+        member_targets = {}
+    return bool(get_member_grade_map(roster)) or any(t > 1 for t in member_targets.values())
+
+def assignments_from_df(status_matrix, result_df):
+    """お稽古のDataFrameを {日程インデックス: [部員名]} に戻す (出欠表に無い名前は除く)"""
+    member_index = status_matrix['member_index']
+    assigned_by_date = {}
+    for d, val in enumerate(result_df["担当者"].tolist()):
+        assigned_by_date[d] = [m for m in str(val).split(", ") if m in member_index] if pd.notna(val) and str(val) != "" else []
+    return assigned_by_date
+
+def find_violations(status_matrix, assigned_by_date, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    """
+    割り当てが今の条件を満たしているかを調べる。
+    戻り値: (人数・1年生人数・出欠の条件を満たさない日程インデックスの集合, 参加回数が合わない部員名の集合)
+    """
+    if member_targets is None:
+        member_targets = {}
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    member_index = status_matrix['member_index']
+    member_grade_map = get_member_grade_map(roster)
+    has_freshmen = any(is_freshman_grade(member_grade_map.get(m, "")) for m in members)
+    bad_dates = set()
+    assigned_count = defaultdict(int)
+    # 誰も入っていない日程 (辞書に無い日程) も人数の下限を調べる
+    for d in range(len(status_matrix['dates'])):
+        assigned = assigned_by_date.get(d, [])
+        val_min, val_max, f_min, f_max = read_bounds(d, min_list, max_list, fresh_min_list, fresh_max_list)
+        n_fresh = sum(is_freshman_grade(member_grade_map.get(m, "")) for m in assigned)
+        if not val_min <= len(assigned) <= val_max: bad_dates.add(d)
+        if has_freshmen and (n_fresh < f_min or (f_max is not None and n_fresh > f_max)): bad_dates.add(d)
+        if any(matrix[d, member_index[m]] == 0 for m in assigned): bad_dates.add(d)
+        for m in assigned: assigned_count[m] += 1
+    bad_members = {m for m in members if matrix[:, member_index[m]].any() and assigned_count[m] != member_targets.get(m, 1)}
+    return bad_dates, bad_members
+
+def solve_shift_schedule(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, model=None, k=1, initial_solution=None, solve_log=None, progress_dir=None, stop_event=None, profile="exact", report=None, backend="auto"):
+    """
+    良い順に最大k個の互いに異なるお稽古(DataFrame)のリストを返す。戻り値: (お稽古のリスト, 成功したか)
+    backend は SOLVER_BACKENDS の名前か "auto" (select_backend で出欠表の大きさから選ぶ)。
+    近似解法はお稽古を一つだけ返し、"auto" で選んだ近似解法が解を見つけられなければMIPで解き直す。
+    initial_solution ({日程インデックス: [部員名]}、前回のお稽古など) が今の条件を満たしていれば、それをCBCの初期解にする。
+    満たしていなければ、ペナルティを無視した最小費用流の解を初期解にする。
+    solve_log (リスト) を渡すと、成分ごとの求解の記録 (初期解の出どころ・採用されたか・時間) を追加する。
+    progress_dir にはCBCのログを残し、stop_event (threading.Event) が立つとそれ以降のCBCはすぐに打ち切る。
+    profile は SOLVER_PROFILES の名前 ("quick" / "balanced" / "exact") かその値と同じ形の辞書で、時間の上限・許容ギャップ・スレッド数を決める。
+    report (辞書) を渡すと、全体の状態・目的関数値・ギャップ・かかった時間 (秒)、
+    MIPで解いたときは事前処理の集計 ('presolve'、presolve_forced_assignments を参照。ほかの解き方では None) を書き込む。
+    backend="portfolio" は PORTFOLIO_STRATEGIES を別プロセスで同時に走らせる (solve_portfolio を参照)。
+    """
+    started = time.perf_counter()
+    settings = SOLVER_PROFILES[profile] if isinstance(profile, str) else profile
+    deadline = started + settings['time_limit'] if settings['time_limit'] is not None else None
+    if report is None:
+        report = {}
+    report.update({'profile': profile, 'backend': backend, 'status': 'infeasible', 'objective': None, 'bound': None, 'gap': None, 'seconds': 0.0, 'presolve': None})
+    def finish(result):
+        report['seconds'] = time.perf_counter() - started
+        return result
+
+    dates = status_matrix['dates'].tolist()
+    if len(dates) != len(min_list) or len(dates) != len(max_list): return finish((None, False))
+
+    if member_targets is None:
+        member_targets = {}
+    auto = backend == "auto"
+    if auto:
+        backend = select_backend(status_matrix, roster, member_targets, k)
+    # 学年・連続勤務のペナルティも1年生の人数設定も無ければ、最小費用流の解が最適解になる
+    # (最小費用流を選んだときだけ。ほかの解き方を指定されたときは、比べられるようにその解き方で解く)
+    exact_flow = backend == 'flow' and k == 1 and not needs_mip(roster, member_targets)
+    if backend == 'portfolio':
+        request = {
+            'status_matrix': status_matrix, 'min_list': min_list, 'max_list': max_list, 'roster': roster,
+            'fresh_min_list': fresh_min_list, 'fresh_max_list': fresh_max_list, 'member_targets': member_targets,
+            'k': k, 'initial_solution': initial_solution, 'model': model,
+        }
+        return finish(solve_portfolio(request, settings, deadline, solve_log, progress_dir, stop_event, report))
+    if SOLVER_BACKENDS[backend]['kind'] == 'heuristic':
+        report['backend'] = backend
+        assigned_by_date = run_heuristic(backend, status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets, initial_solution, deadline, stop_event)
+        if assigned_by_date is not None:
+            objective = schedule_objective(status_matrix, assigned_by_date, roster, member_targets)
+            if exact_flow:
+                report.update({'status': 'optimal', 'objective': objective, 'bound': objective, 'gap': 0.0})
+            else:
+                report.update({'status': 'heuristic', 'objective': objective})
+            return finish(([build_result_df(dates, assigned_by_date, roster)], True))
+        if exact_flow:
+            return finish((None, False))
+        if not auto:
+            report['status'] = 'not_solved'
+            return finish((None, False))
+        backend = first_mip_backend()
+    report['backend'] = backend
+
+    if model is None or not is_decomposed_model_compatible(model, member_targets):
+        model = build_decomposed_model(status_matrix, roster, member_targets)
+    components = model['components']
+    report['presolve'] = model['presolve_report']
+
+    # どの成分にも属さない日程は、固定した部員だけで人数の条件を満たしている必要がある
+    covered_dates = {d for c in components for d in c['date_indices']}
+    for d in range(len(dates)):
+        if d in covered_dates: continue
+        forced_n = len(model['forced_by_date'].get(d, []))
+        forced_f = model['forced_fresh_counts'].get(d, 0)
+        val_min = int(min_list[d]) if pd.notna(min_list[d]) else 0
+        val_max = int(max_list[d]) if pd.notna(max_list[d]) else 1
+        if not val_min <= forced_n <= val_max: return finish((None, False))
+        if model['has_freshmen']:
+            if fresh_min_list is not None and pd.notna(fresh_min_list[d]) and forced_f < int(fresh_min_list[d]): return finish((None, False))
+            if fresh_max_list is not None and pd.notna(fresh_max_list[d]) and forced_f > int(fresh_max_list[d]): return finish((None, False))
+
+    # 前回のお稽古が今の条件でも成り立つならそれを、そうでなければペナルティを無視した最小費用流の解をCBCの初期解にする
+    start, start_source = None, None
+    if initial_solution is not None and find_violations(status_matrix, initial_solution, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets) == (set(), set()):
+        start, start_source = initial_solution, 'previous'
+    else:
+        start = solve_assignment_flow(status_matrix, min_list, max_list, member_targets)
+        start_source = 'flow' if start is not None else None
+
+    # CBCは別プロセスで動くため、成分ごとの求解をスレッドで並べるだけで複数コアを使える
+    # 同時に動くCBCでコアを分け合うよう、1回あたりのスレッド数は成分の数で割る
+    parallel = min(len(components), os.cpu_count() or 1)
+    cbc_settings = {**settings, 'threads': max(1, settings['threads'] // max(parallel, 1))}
+    component_log = []
+    args = (min_list, max_list, fresh_min_list, fresh_max_list, member_targets, roster, start, k, component_log, progress_dir, stop_event, cbc_settings, deadline, backend)
+    if len(components) > 1:
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            partials = list(pool.map(lambda c: solve_component(c, *args), components))
+    else:
+        partials = [solve_component(c, *args) for c in components]
+    if solve_log is not None:
+        solve_log.extend({**entry, 'start': start_source} for entry in component_log)
+    forced_objective = model['forced_objective']
+    report.update(summarize_solve_log(component_log, forced_objective) if components else {'status': 'optimal', 'objective': forced_objective, 'bound': forced_objective, 'gap': 0.0})
+    if len(component_log) < len(components):
+        # 人数の設定だけで解けないと分かった成分がある (CBCを起動していないので記録が無い)
+        report.update({'status': 'infeasible', 'objective': None, 'bound': None, 'gap': None})
+    if any(p is None for p in partials):
+        return finish((None, False))
+
+    # 成分は互いに独立なので、全体のk番目までの解は成分ごとのk番目までの解の組み合わせから選べる
+    schedules = []
+    for _, picks in merge_k_best(partials, k):
+        assigned_by_date = {d: list(v) for d, v in model['forced_by_date'].items()}
+        for partial in picks:
+            for d, assigned in partial.items():
+                assigned_by_date.setdefault(d, []).extend(assigned)
+        schedules.append(build_result_df(dates, assigned_by_date, roster))
+    return finish((schedules, True))
+
+def solve_portfolio(request, settings, deadline=None, solve_log=None, progress_dir=None, stop_event=None, report=None):
+    """
+    PORTFOLIO_STRATEGIES のうち使えるものを、それぞれ別のプロセス (python solver.py --portfolio-strategy) で同時に解かせる。
+    request は solve_shift_schedule のキーワード引数で、組み立て済みのモデル ('model') があればMIPの戦略にそのまま渡す (組み立て直さない)。最初に最適 (または許容ギャップ内) と証明された結果が届けばそれを使い、
+    deadline か stop_event で中断を頼んでからは、PORTFOLIO_GRACE_SECONDS までに届いた中で目的関数値が一番良い結果を使う。
+    決まった時点で残りのプロセスは (CBCごと) 止める。戻り値・solve_log・report は solve_shift_schedule と同じ。
+    """
+    if report is None:
+        report = {}
+    strategies = [s for s in PORTFOLIO_STRATEGIES if is_backend_available(s['backend'])]
+    # 同時に動くCBCでコアを分け合う
+    threads = max(1, settings['threads'] // len(strategies))
+    job_dir = tempfile.mkdtemp(prefix="portfolio_")
+    running = {}
+    results = {}
+    try:
+        for i, strategy in enumerate(strategies):
+            remaining = deadline - time.perf_counter() if deadline is not None else None
+            strategy_request = {
+                **request, 'backend': strategy['backend'],
+                'model': request.get('model') if SOLVER_BACKENDS[strategy['backend']]['kind'] == 'mip' else None,
+                'profile': {**settings, 'time_limit': remaining, 'threads': threads, 'options': strategy['options']},
+                # 実行中の暫定解は最初の戦略のCBCのログだけから読む (同じ成分のログが重なって合計されないように)
+                'progress_dir': progress_dir if i == 0 else None,
+            }
+            input_path = os.path.join(job_dir, f"{strategy['name']}.in")
+            output_path = os.path.join(job_dir, f"{strategy['name']}.out")
+            with open(input_path, "wb") as f:
+                pickle.dump(strategy_request, f)
+            # 新しいセッションで起動し、CBCごとまとめて止められるようにする
+            running[strategy['name']] = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--portfolio-strategy", input_path, output_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+        winner = None
+        interrupted_at = None
+        while running:
+            for name in [name for name, process in running.items() if process.poll() is not None]:
+                running.pop(name)
+                output_path = os.path.join(job_dir, f"{name}.out")
+                if not os.path.exists(output_path): continue
+                with open(output_path, "rb") as f:
+                    kind, payload = pickle.load(f)
+                if kind != 'done': continue
+                results[name] = payload
+                # 最適と証明された結果か、解が無いと証明された結果が出れば、ほかを待つ必要はない
+                if payload[3]['status'] in ('optimal', 'gap', 'infeasible'):
+                    winner = name
+            if winner is not None:
+                break
+            now = time.perf_counter()
+            if interrupted_at is None and ((deadline is not None and now >= deadline) or (stop_event is not None and stop_event.is_set())):
+                interrupted_at = now
+                for process in running.values():
+                    try:
+                        os.killpg(process.pid, signal.SIGINT)
+                    except ProcessLookupError:
+                        pass
+            if interrupted_at is not None and now - interrupted_at >= PORTFOLIO_GRACE_SECONDS:
+                break
+            time.sleep(PORTFOLIO_POLL_SECONDS)
+    finally:
+        for process in running.values():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    if winner is None:
+        # 解けた結果のうち、出来上がったお稽古の目的関数値が一番良いもの (同じなら別案の多いもの)
+        status_matrix = request['status_matrix']
+        def score(name):
+            schedules = results[name][0]
+            return (schedule_objective(status_matrix, assignments_from_df(status_matrix, schedules[0]), request['roster'], request['member_targets']), -len(schedules))
+        solved = [name for name, payload in results.items() if payload[1]]
+        winner = min(solved, key=score) if solved else None
+    if winner is None:
+        report.update({'backend': 'portfolio', 'strategy': None, 'status': 'not_solved', 'objective': None, 'bound': None, 'gap': None})
+        return None, False
+    schedules, success, strategy_log, strategy_report = results[winner]
+    if solve_log is not None:
+        solve_log.extend(strategy_log)
+    report.update({key: strategy_report[key] for key in ('status', 'objective', 'bound', 'gap', 'presolve')})
+    report.update({'backend': 'portfolio', 'strategy': winner})
+    return schedules, success
+
+def run_portfolio_strategy(input_path, output_path):
+    """
+    solve_portfolio が起動したプロセスで、input_path のキーワード引数で solve_shift_schedule を実行し、
+    ('done', (お稽古のリスト, 成功したか, 求解の記録, 全体の結果)) か ('error', メッセージ) を output_path に書く。
+    SIGINTを受けると途中の最良解を返す。親のプロセスが終わったら自分も止まる。
+    """
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    parent = os.getppid()
+    def watch_parent():
+        while not stop_event.is_set():
+            if os.getppid() != parent:
+                os.killpg(os.getpgid(0), signal.SIGINT)
+                return
+            time.sleep(1)
+    threading.Thread(target=watch_parent, daemon=True).start()
+    with open(input_path, "rb") as f:
+        request = pickle.load(f)
+    try:
+        solve_log, report = [], {}
+        schedules, success = solve_shift_schedule(**request, solve_log=solve_log, stop_event=stop_event, report=report)
+        result = ('done', (schedules, success, solve_log, report))
+    except Exception as e:
+        result = ('error', str(e))
+    with open(output_path + ".tmp", "wb") as f:
+        pickle.dump(result, f)
+    os.replace(output_path + ".tmp", output_path)
+
+def reoptimize_members(status_matrix, assigned_by_date, free, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, has_freshmen=None, allowed_dates=None, profile=None, deadline=None, backend="cbc", stop_event=None):
+    """
+    お稽古 assigned_by_date のうち free の部員の割り当てだけを、ほかの部員を固定したまま同じ目的関数・制約で解き直す。
+    allowed_dates ({部員名: 日程インデックスの集合}) に入っている部員は、その日程にしか入れない。
+    いまの割り当てを初期解にする。stop_event は run_mip にそのまま渡す。戻り値: 解き直したお稽古 {日程インデックス: [部員名]} (解けなければ None)
+    """
+    matrix = status_matrix['matrix']
+    dates = status_matrix['dates'].tolist()
+    member_index = status_matrix['member_index']
+    pinned_by_date = {d: [m for m in assigned_by_date.get(d, []) if m not in free] for d in range(len(dates))}
+    free_matrix = np.zeros_like(matrix)
+    for m in free:
+        j = member_index[m]
+        rows = sorted(allowed_dates[m]) if allowed_dates is not None and m in allowed_dates else slice(None)
+        free_matrix[rows, j] = matrix[rows, j]
+    reduced = make_status_matrix(free_matrix, status_matrix['dates'], status_matrix['members'], status_matrix['date_positions'])
+    component = {
+        'date_indices': list(range(len(dates))),
+        'model': build_shift_model(reduced, roster, member_targets, pinned_by_date, has_freshmen),
+    }
+    start = {d: [m for m in assigned_by_date.get(d, []) if m in free] for d in range(len(dates))}
+    solutions = solve_component(component, min_list, max_list, fresh_min_list, fresh_max_list, member_targets, roster, start, stop_event=stop_event, profile=profile, deadline=deadline, backend=backend)
+    if solutions is None:
+        return None
+    return {d: pinned_by_date[d] + solutions[0][1].get(d, []) for d in range(len(dates))}
+
+def repair_assignments(status_matrix, assigned_by_date, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, changed_dates=(), profile=None, deadline=None, backend="cbc", stop_event=None):
+    """
+    お稽古 assigned_by_date を、条件を満たすように影響のある部分だけ解き直す (repair_shift_schedule を参照)。
+    stop_event が立てば、解き直す範囲をそれ以上広げない。
+    戻り値: (直したお稽古 {日程インデックス: [部員名]}, 割り当てを動かし得た部員の集合)。直せなければ (None, None)
+    """
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    member_index = status_matrix['member_index']
+    member_grade_map = get_member_grade_map(roster)
+    has_freshmen = any(is_freshman_grade(member_grade_map.get(m, "")) for m in members)
+
+    # 条件を満たさなくなった日程・部員
+    bad_dates, free_members = find_violations(status_matrix, assigned_by_date, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets)
+    free_dates = set(changed_dates) | bad_dates
+    free_members |= {m for d in free_dates for m in assigned_by_date.get(d, [])}
+    if not free_members and not free_dates:
+        return assigned_by_date, set()
+
+    rings = [
+        free_members,
+        free_members | {m for d in free_dates for m in members if matrix[d, member_index[m]] > 0},
+        set(members),
+    ]
+    tried = set()
+    for free in rings:
+        if frozenset(free) in tried: continue
+        tried.add(frozenset(free))
+        repaired = reoptimize_members(status_matrix, assigned_by_date, free, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets, has_freshmen, profile=profile, deadline=deadline, backend=backend, stop_event=stop_event)
+        if repaired is not None:
+            return repaired, free
+        if stop_event is not None and stop_event.is_set(): break
+    return None, None
+
+def repair_shift_schedule(status_matrix, current_df, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, changed_dates=(), profile="exact", backend=None, stop_event=None):
+    """
+    手で編集したお稽古 current_df をできるだけ固定したまま、影響のある部分だけを同じ目的関数・制約で解き直す。
+    解き直すのは、changed_dates と条件を満たさなくなった日程に入っている部員、参加回数が合わなくなった部員。
+    それで解けなければ、その日程に参加可能な部員まで、最後は全員まで広げる。profile の時間の上限は全体にかける。
+    backend はMIPソルバーの名前 (None なら first_mip_backend)。stop_event が立つと、実行中のCBCは途中の最良解を返して打ち切る。
+    戻り値: (お稽古のDataFrame, 成功したか, 割り当てを動かし得た部員のリスト)
+    """
+    if member_targets is None:
+        member_targets = {}
+    settings = SOLVER_PROFILES[profile]
+    deadline = time.perf_counter() + settings['time_limit'] if settings['time_limit'] is not None else None
+    if backend is None:
+        backend = first_mip_backend()
+    assigned_by_date = assignments_from_df(status_matrix, current_df)
+    repaired, free = repair_assignments(status_matrix, assigned_by_date, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets, changed_dates, settings, deadline, backend, stop_event)
+    if repaired is None:
+        return None, False, []
+    if not free:
+        return current_df, True, []
+    return build_result_df(status_matrix['dates'].tolist(), repaired, roster), True, sort_members_by_roster(list(free), roster)
+
+def sweep_shift_settings(status_matrix, settings_list, roster=None, member_targets=None, k=1, profile="exact", model=None, progress_dir=None, stop_event=None, backend="auto"):
+    """
+    人数設定 {'min', 'max', 'fmin', 'fmax'} (日程ごとのリスト) をいくつも並べて solve_shift_schedule で解き比べる。
+    条件を満たせないことが is_schedule_feasible で分かる設定は解かずに 'infeasible' とする。
+    残りは最大 os.cpu_count() 個ずつ同時に解き、MIPのモデルは model (無ければ組み立てる) をスレッドの数だけ複製して使い回す。
+    backend="portfolio" を指定されたときは、設定どうしを並べる代わりに first_mip_backend で解く。
+    progress_dir には解き終えた数を sweep.txt に書く (read_sweep_progress)。stop_event が立つと、まだ始めていない設定は解かない。
+    戻り値: settings_list と同じ順の (お稽古のリスト, 成功したか, 全体の結果 (report)) のリスト (解かなかった設定は None)
+    """
+    if member_targets is None:
+        member_targets = {}
+    members = status_matrix['members'].tolist()
+    member_grade_map = get_member_grade_map(roster)
+    freshmen = {j for j, m in enumerate(members) if is_freshman_grade(member_grade_map.get(m, ""))}
+    results = [None] * len(settings_list)
+    done = 0
+    lock = threading.Lock()
+    def record(i, result):
+        nonlocal done
+        with lock:
+            results[i] = result
+            done += 1
+            if progress_dir is not None:
+                with open(os.path.join(progress_dir, "sweep.txt"), "w", encoding="utf-8") as f:
+                    f.write(f"{done}/{len(settings_list)}")
+
+    # 最大流で条件を満たせないと分かる設定は、モデルを解かずに済ませる
+    pending = []
+    for i, settings in enumerate(settings_list):
+        bounds = [read_bounds(d, settings['min'], settings['max'], settings['fmin'], settings['fmax']) for d in range(len(settings['min']))]
+        if is_schedule_feasible(status_matrix, bounds, member_targets, freshmen):
+            pending.append(i)
+        else:
+            record(i, (None, False, {'profile': profile, 'backend': 'flow', 'status': 'infeasible', 'objective': None, 'bound': None, 'gap': None, 'seconds': 0.0, 'presolve': None}))
+    if not pending:
+        return results
+
+    if backend == "auto":
+        backend = select_backend(status_matrix, roster, member_targets, k)
+    if backend == 'portfolio':
+        backend = first_mip_backend()
+    parallel = min(len(pending), os.cpu_count() or 1)
+    settings = SOLVER_PROFILES[profile]
+    point_settings = {**settings, 'threads': max(1, settings['threads'] // parallel)}
+    # solve_shift_schedule はモデルの人数設定を書き換えるので、同時に解くスレッドごとに別のモデルを渡す
+    models = deque([None] * parallel)
+    if SOLVER_BACKENDS[backend]['kind'] == 'mip':
+        if model is None or not is_decomposed_model_compatible(model, member_targets):
+            model = build_decomposed_model(status_matrix, roster, member_targets)
+        models = deque([model] + [copy.deepcopy(model) for _ in range(parallel - 1)])
+
+    def solve_point(i):
+        if stop_event is not None and stop_event.is_set(): return
+        with lock:
+            point_model = models.popleft()
+        try:
+            settings, report = settings_list[i], {}
+            schedules, success = solve_shift_schedule(status_matrix, settings['min'], settings['max'], roster, settings['fmin'], settings['fmax'], member_targets,
+                                                      model=point_model, k=k, stop_event=stop_event, profile=point_settings, report=report, backend=backend)
+            report['profile'] = profile
+            record(i, (schedules, success, report))
+        finally:
+            with lock:
+                models.append(point_model)
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        list(pool.map(solve_point, pending))
+    return results
+
+def read_sweep_progress(progress_dir):
+    """sweep_shift_settings が書いた (解き終えた数, 全体の数) を読む (まだ無ければ None)"""
+    path = os.path.join(progress_dir, "sweep.txt")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        done, total = f.read().split("/")
+    return int(done), int(total)
+
+def solve_fingerprint(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, k=1, profile="exact", backend="auto", initial_solution=None):
+    """
+    求解結果を決める入力(回答の行列・日程ごとの人数設定・参加回数・学年と名簿の順番・ペナルティの重み・別案の数・ソルバーと設定・初期解)だけから作るハッシュ。
+    時間切れで打ち切った解は初期解 (initial_solution、solve_shift_schedule を参照) で変わるので、初期解もキーに含める。
+    同じ値なら、どのセッションから来ても同じ文字列になる。
+    """
+    if member_targets is None:
+        member_targets = {}
+    members = status_matrix['members'].tolist()
+    member_grade_map = get_member_grade_map(roster)
+    rank_map = roster['rank'] if roster is not None else {}
+    key = (
+        status_matrix['matrix'].shape,
+        tuple(status_matrix['dates'].tolist()),
+        tuple(members),
+        tuple(read_bounds(d, min_list, max_list, fresh_min_list, fresh_max_list) for d in range(len(min_list))),
+        tuple(int(member_targets.get(m, 1)) for m in members),
+        tuple(member_grade_map.get(m) for m in members),
+        roster is not None,
+        tuple(rank_map.get(m) for m in members),
+        (GRADE_PENALTY, SPACING_PENALTY),
+        k,
+        profile,
+        backend,
+        # 日程の順・名前の順にそろえる (誰も入っていない日程は、辞書に無い日程と同じに扱う)
+        tuple((d, tuple(sorted(v))) for d, v in sorted(initial_solution.items()) if v) if initial_solution is not None else None,
+    )
+    digest = hashlib.sha256(repr(key).encode())
+    digest.update(np.ascontiguousarray(status_matrix['matrix']).tobytes())
+    return digest.hexdigest()
+
+def build_result_df(dates, assigned_by_date, roster=None):
+    results = []
+    for d in range(len(dates)):
+        assigned = sort_members_by_roster(list(assigned_by_date.get(d, [])), roster)
+        results.append({"日程": dates[d], "担当者": ", ".join(assigned), "人数": len(assigned)})
+    return pd.DataFrame(results)
+
+def model_fingerprint(status_matrix, roster=None):
+    """モデルの構造(出欠・学年)だけから作るハッシュ。同じならモデルを組み立て直さずに使い回せる。"""
+    member_grade_map = get_member_grade_map(roster)
+    members = status_matrix['members'].tolist()
+    key = (tuple(status_matrix['dates'].tolist()), tuple(members), tuple(member_grade_map.get(m) for m in members))
+    digest = hashlib.sha256(repr(key).encode())
+    digest.update(np.ascontiguousarray(status_matrix['matrix']).tobytes())
+    return digest.hexdigest()
+
+def solve_worker(conn):
+    """
+    セッションごとのバックグラウンドのプロセスで動かす。conn から solve_shift_schedule のキーワード引数を受け取って実行し、
+    ('done', (お稽古のリスト, 成功したか, 求解の記録, 全体の結果 (report), 打ち切られたか)) か ('error', メッセージ) を送り返す。
+    settings_list を含む引数は sweep_shift_settings に渡し、('done', (設定ごとの結果のリスト, 打ち切られたか)) を送り返す。
+    current_df を含む引数は repair_shift_schedule に渡し、('done', (お稽古のDataFrame, 成功したか, 動かし得た部員のリスト, 打ち切られたか)) を送り返す。
+    SIGINTを受けると、実行中のCBCは途中の最良解を返し、それ以降の求解も打ち切る。
+    組み立てたモデルは出欠表・名簿が変わるまで使い回す (MIPソルバーはモデルを作り直さずに取り替えられる)。
+    """
+    if hasattr(os, "setsid"):
+        os.setsid()  # 親からCBCごとSIGINTを送れるよう、自分のプロセスグループを作る
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    cached_key, cached_model = None, None
+    while conn.poll(WORKER_IDLE_TIMEOUT):
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        stop_event.clear()
+        try:
+            if 'current_df' in request:
+                schedule, success, moved_members = repair_shift_schedule(**request, stop_event=stop_event)
+                conn.send(('done', (schedule, success, moved_members, stop_event.is_set())))
+                continue
+            # 近似解法で解くときはモデルを組み立てない (ポートフォリオはMIPの戦略にこのモデルを渡す)
+            backend = request.get('backend', "auto")
+            if backend == "auto":
+                backend = select_backend(request['status_matrix'], request.get('roster'), request.get('member_targets'), request.get('k', 1))
+            model = None
+            if SOLVER_BACKENDS[backend]['kind'] in ('mip', 'portfolio'):
+                key = model_fingerprint(request['status_matrix'], request.get('roster'))
+                if key != cached_key or not is_decomposed_model_compatible(cached_model, request.get('member_targets') or {}):
+                    cached_key, cached_model = key, build_decomposed_model(request['status_matrix'], request.get('roster'), request.get('member_targets'))
+                model = cached_model
+            if 'settings_list' in request:
+                results = sweep_shift_settings(**request, model=model, stop_event=stop_event)
+                conn.send(('done', (results, stop_event.is_set())))
+                continue
+            solve_log, report = [], {}
+            schedules, success = solve_shift_schedule(**request, model=model, solve_log=solve_log, stop_event=stop_event, report=report)
+            conn.send(('done', (schedules, success, solve_log, report, stop_event.is_set())))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+if __name__ == "__main__" and len(sys.argv) == 4 and sys.argv[1] == "--portfolio-strategy":
+    run_portfolio_strategy(sys.argv[2], sys.argv[3])
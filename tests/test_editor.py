@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from editor import apply_grid_edit, can_move, can_swap, copy_schedule, edit_transition, is_member_locked, make_schedule, member_ranks
+from solver import make_status_matrix
+
+GRID_HTML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "edit_grid", "index.html")
+
+def make_matrix(rows, members):
+    """rows: 日程ごとの "○△×" の文字列 (部員の順)"""
+    codes = {"○": 2, "△": 1, "×": 0}
+    matrix = np.array([[codes[c] for c in row] for row in rows], dtype=np.int8)
+    dates = np.array([f"{d + 1}日" for d in range(len(rows))], dtype=object)
+    return make_status_matrix(matrix, dates, np.array(members, dtype=object))
+
+@pytest.fixture
+def status_matrix():
+    # a は1日目〜3日目、b は1・3・4日目、c は2・3日目、l は4日目にしか参加できない
+    return make_matrix(["○○××", "○×○×", "△○○×", "×○×○"], ["a", "b", "c", "l"])
+
+def schedule_of(status_matrix, assigned_by_date):
+    return make_schedule(status_matrix, assigned_by_date, member_ranks(status_matrix))
+
+def names(status_matrix, schedule):
+    members = status_matrix['members']
+    return [[members[j] for j in idx] for idx in schedule['by_date']]
+
+def test_move(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    selection, moves = edit_transition(status_matrix, schedule, {'type': 'member', 'member': "a", 'date': 0}, {'action': 'move', 'member': "a", 'from': 0, 'to': 2})
+    assert selection is None
+    assert moves == [(0, 0, 2)]
+    assert names(status_matrix, schedule) == [[], ["c"], ["a", "b"], ["l"]]
+    assert schedule['assigned'][2, 0] and not schedule['assigned'][0, 0]
+
+def test_move_to_unavailable_date_is_ignored(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    before = copy_schedule(schedule)
+    selection = {'type': 'member', 'member': "a", 'date': 0}
+    assert edit_transition(status_matrix, schedule, selection, {'action': 'move', 'member': "a", 'from': 0, 'to': 3}) == (selection, None)
+    assert names(status_matrix, schedule) == names(status_matrix, before)
+    assert (schedule['assigned'] == before['assigned']).all()
+
+def test_move_onto_a_date_the_member_is_already_on_is_ignored(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["a", "c"], 2: ["b"], 3: ["l"]})
+    assert not can_move(status_matrix, schedule, "a", 0, 1)
+    assert edit_transition(status_matrix, schedule, None, {'action': 'move', 'member': "a", 'from': 0, 'to': 1}) == (None, None)
+    assert names(status_matrix, schedule) == [["a"], ["a", "c"], ["b"], ["l"]]
+
+def test_locked_member_cannot_be_moved(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    assert is_member_locked(status_matrix, "l", 3)
+    assert not is_member_locked(status_matrix, "a", 0)
+    assert is_member_locked(status_matrix, "unknown", 0)
+    for dst in range(3):
+        assert not can_move(status_matrix, schedule, "l", 3, dst)
+    # b は4日目に参加できるが、l は3日目に参加できない
+    assert not can_swap(status_matrix, schedule, "b", 2, "l", 3)
+    assert edit_transition(status_matrix, schedule, None, {'action': 'swap', 'member_a': "b", 'from': 2, 'member_b': "l", 'to': 3}) == (None, None)
+    assert names(status_matrix, schedule) == [["a"], ["c"], ["b"], ["l"]]
+
+def test_swap(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    selection, moves = edit_transition(status_matrix, schedule, None, {'action': 'swap', 'member_a': "a", 'from': 0, 'member_b': "b", 'to': 2})
+    assert selection is None
+    assert moves == [(0, 0, 2), (1, 2, 0)]
+    assert names(status_matrix, schedule) == [["b"], ["c"], ["a"], ["l"]]
+
+def test_swap_with_unavailable_member_is_ignored(status_matrix):
+    # c は1日目に参加できない
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    assert not can_swap(status_matrix, schedule, "a", 0, "c", 1)
+    assert edit_transition(status_matrix, schedule, None, {'action': 'swap', 'member_a': "a", 'from': 0, 'member_b': "c", 'to': 1}) == (None, None)
+
+def test_swap_that_would_duplicate_a_member_is_ignored(status_matrix):
+    # a は3日目にも入っているので、1日目の a と3日目の b を入れ替えると3日目に a が2人になる
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["a", "b"], 3: ["l"]})
+    assert not can_swap(status_matrix, schedule, "a", 0, "b", 2)
+    assert edit_transition(status_matrix, schedule, None, {'action': 'swap', 'member_a': "a", 'from': 0, 'member_b': "b", 'to': 2}) == (None, None)
+    assert names(status_matrix, schedule) == [["a"], ["c"], ["a", "b"], ["l"]]
+
+def test_selection(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    selected = {'type': 'member', 'member': "a", 'date': 0}
+    assert edit_transition(status_matrix, schedule, None, {'action': 'select_member', 'member': "a", 'date': 0}) == (selected, None)
+    # 同じ部員をもう一度選ぶと選択を外す
+    assert edit_transition(status_matrix, schedule, selected, {'action': 'select_member', 'member': "a", 'date': 0}) == (None, None)
+    # その日程に入っていない部員は選べない
+    assert edit_transition(status_matrix, schedule, selected, {'action': 'select_member', 'member': "a", 'date': 1}) == (selected, None)
+    assert edit_transition(status_matrix, schedule, selected, {'action': 'select_date', 'date': 2}) == ({'type': 'date', 'date': 2}, None)
+    assert edit_transition(status_matrix, schedule, {'type': 'date', 'date': 2}, {'action': 'select_date', 'date': 2}) == (None, None)
+    assert edit_transition(status_matrix, schedule, selected, {'action': 'cancel'}) == (None, None)
+
+def test_stale_revision_is_ignored(status_matrix):
+    schedule = schedule_of(status_matrix, {0: ["a"], 1: ["c"], 2: ["b"], 3: ["l"]})
+    event = {'revision': 3, 'action': 'move', 'member': "a", 'from': 0, 'to': 2}
+    assert apply_grid_edit(status_matrix, schedule, 4, event) is None
+    assert apply_grid_edit(status_matrix, schedule, 4, None) is None
+    assert names(status_matrix, schedule) == [["a"], ["c"], ["b"], ["l"]]
+    assert apply_grid_edit(status_matrix, schedule, 3, event) == [(0, 0, 2)]
+    assert names(status_matrix, schedule) == [[], ["c"], ["a", "b"], ["l"]]
+
+# --- 編集グリッド (edit_grid/index.html) が同じ規則で移動先・交換先を出すか ---
+
+GRID_DRIVER = """
+const grid = require(process.argv[1]);
+const input = JSON.parse(require("fs").readFileSync(0, "utf8"));
+const args = input.args;
+const result = input.selections.map((selection) => {
+    const actions = [];
+    const keep = (action) => { if (action.type === "move" || action.type === "swap") actions.push(action); };
+    args.dates.forEach((_, d) => { const view = grid.dateView(args, selection, d); if (!view.disabled) keep(view.action); });
+    args.rows.forEach((row, d) => row.forEach((_, slot) => {
+        const view = grid.memberView(args, selection, d, slot);
+        if (!view.locked && !view.disabled) keep(view.action);
+    }));
+    return actions;
+});
+console.log(JSON.stringify(result));
+"""
+
+def grid_args(status_matrix, schedule):
+    """app.show_schedule_editor と同じ形の編集グリッドの引数"""
+    members, matrix = status_matrix['members'], status_matrix['matrix']
+    rows, available = [], {}
+    for d, idx in enumerate(schedule['by_date']):
+        rows.append([[members[j], members[j], int(matrix[d, j]), is_member_locked(status_matrix, members[j], d)] for j in idx])
+        for j in idx:
+            available[members[j]] = [[day, int(matrix[day, j])] for day in np.flatnonzero(matrix[:, j]).tolist()]
+    return {'revision': 0, 'dates': status_matrix['dates'].tolist(), 'rows': rows, 'available': available}
+
+def allowed_actions(status_matrix, schedule, selection):
+    """editor の規則で、selection から選べる移動・交換"""
+    members = status_matrix['members']
+    n_dates = len(schedule['by_date'])
+    actions = set()
+    if selection['type'] == 'member':
+        m, src = selection['member'], selection['date']
+        for dst in range(n_dates):
+            if can_move(status_matrix, schedule, m, src, dst):
+                actions.add(('move', m, src, dst))
+            for j in schedule['by_date'][dst]:
+                if can_swap(status_matrix, schedule, m, src, members[j], dst):
+                    actions.add(('swap', m, src, members[j], dst))
+    else:
+        dst = selection['date']
+        for src in range(n_dates):
+            for j in schedule['by_date'][src]:
+                if can_move(status_matrix, schedule, members[j], src, dst):
+                    actions.add(('move', members[j], src, dst))
+    return actions
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node が無い")
+@pytest.mark.parametrize("seed", range(5))
+def test_grid_matches_editor_rules(tmp_path, seed):
+    rnd = np.random.default_rng(seed)
+    matrix = rnd.choice([0, 1, 2], p=[0.4, 0.2, 0.4], size=(6, 9)).astype(np.int8)
+    members = [f"m{j}" for j in range(matrix.shape[1])]
+    status_matrix = make_status_matrix(matrix, np.array([f"{d + 1}日" for d in range(6)], dtype=object), np.array(members, dtype=object))
+    # 参加できる日程から1日 (一部の部員は2日) を選んだお稽古
+    assigned_by_date = {d: [] for d in range(6)}
+    for j, m in enumerate(members):
+        days = np.flatnonzero(matrix[:, j])
+        for d in rnd.choice(days, size=min(len(days), 1 + int(rnd.random() < 0.3)), replace=False).tolist():
+            assigned_by_date[d].append(m)
+    schedule = schedule_of(status_matrix, assigned_by_date)
+
+    with open(GRID_HTML, encoding="utf-8") as f:
+        html = f.read()
+    script = tmp_path / "grid.js"
+    script.write_text(html.split("<script>", 1)[1].split("</script>", 1)[0], encoding="utf-8")
+    selections = [{'type': 'member', 'member': m, 'date': d} for d, assigned in assigned_by_date.items() for m in assigned]
+    selections += [{'type': 'date', 'date': d} for d in range(6)]
+    output = subprocess.run(["node", "-e", GRID_DRIVER, str(script)], input=json.dumps({'args': grid_args(status_matrix, schedule), 'selections': selections}),
+                            capture_output=True, text=True, check=True).stdout
+    for selection, actions in zip(selections, json.loads(output)):
+        js_actions = set()
+        for action in actions:
+            if action['type'] == 'move':
+                js_actions.add(('move', action['member'], action['from'], action['to']))
+            else:
+                js_actions.add(('swap', action['member_a'], action['from'], action['member_b'], action['to']))
+        assert js_actions == allowed_actions(status_matrix, schedule, selection), selection
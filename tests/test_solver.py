@@ -0,0 +1,310 @@
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from solver import (GRADE_PENALTY, SPACING_PENALTY, aggregate_members, assignments_from_df, build_roster, build_shift_model, diagnose_infeasibility,
+                    find_forced_members, find_violations, first_mip_backend, get_member_grade_map, is_freshman_grade, is_schedule_feasible,
+                    make_status_matrix, presolve_forced_assignments, read_bounds, repair_shift_schedule, schedule_objective, select_backend,
+                    solve_assignment_flow, solve_fingerprint, solve_shift_schedule, sweep_shift_settings)
+
+def make_matrix(rows, members):
+    """rows: 日程ごとの "○△×" の文字列 (部員の順)"""
+    codes = {"○": 2, "△": 1, "×": 0}
+    matrix = np.array([[codes[c] for c in row] for row in rows], dtype=np.int8)
+    dates = np.array([f"{d + 1}日" for d in range(len(rows))], dtype=object)
+    return make_status_matrix(matrix, dates, np.array(members, dtype=object))
+
+def make_roster(grades):
+    """grades: {部員名: 学年} (名簿の順)"""
+    return build_roster(pd.DataFrame({'氏名': list(grades), '学年': list(grades.values())}))
+
+def random_matrix(seed, n_dates, n_members):
+    rnd = np.random.default_rng(seed)
+    matrix = rnd.choice([0, 1, 2], p=[0.3, 0.3, 0.4], size=(n_dates, n_members)).astype(np.int8)
+    members = [f"m{j}" for j in range(n_members)]
+    return make_status_matrix(matrix, np.array([f"{d + 1}日" for d in range(n_dates)], dtype=object), np.array(members, dtype=object))
+
+def objective(status_matrix, assigned_by_date, roster=None, member_targets=None):
+    """モデルの目的関数 (ペナルティ − 希望度) をモデルとは別に数え直す"""
+    member_targets = member_targets or {}
+    matrix = status_matrix['matrix']
+    member_index = status_matrix['member_index']
+    grades = get_member_grade_map(roster)
+    value = 0.0
+    dates_of_member = {}
+    for d, assigned in assigned_by_date.items():
+        value -= sum(int(matrix[d, member_index[m]]) for m in assigned)
+        same_grade = [grades[m] for m in assigned if grades.get(m)]
+        value += GRADE_PENALTY * (len(same_grade) - len(set(same_grade)))
+        for m in assigned:
+            dates_of_member.setdefault(m, []).append(d)
+    for m, days in dates_of_member.items():
+        if member_targets.get(m, 1) < 2: continue
+        for d1, d2 in itertools.combinations(sorted(days), 2):
+            value += SPACING_PENALTY * {1: 1, 2: 0.5}.get(d2 - d1, 0)
+    return value
+
+def feasible_schedules(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    """条件を満たすお稽古 {日程インデックス: [部員名]} をすべて列挙する (小さい出欠表用)"""
+    member_targets = member_targets or {}
+    matrix = status_matrix['matrix']
+    members = status_matrix['members'].tolist()
+    grades = get_member_grade_map(roster)
+    choices = []
+    for j, m in enumerate(members):
+        days = np.flatnonzero(matrix[:, j]).tolist()
+        choices.append(list(itertools.combinations(days, member_targets.get(m, 1))) if days else [()])
+    for pick in itertools.product(*choices):
+        assigned_by_date = {d: [] for d in range(len(min_list))}
+        for j, days in enumerate(pick):
+            for d in days:
+                assigned_by_date[d].append(members[j])
+        ok = True
+        for d, assigned in assigned_by_date.items():
+            val_min, val_max, f_min, f_max = read_bounds(d, min_list, max_list, fresh_min_list, fresh_max_list)
+            n_fresh = sum(is_freshman_grade(grades.get(m, "")) for m in assigned)
+            if not val_min <= len(assigned) <= val_max or n_fresh < f_min or (f_max is not None and n_fresh > f_max):
+                ok = False
+                break
+        if ok:
+            yield assigned_by_date
+
+def optimum(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    return min(objective(status_matrix, s, roster, member_targets) for s in feasible_schedules(status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets))
+
+def solve(status_matrix, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None, **kwargs):
+    report = {}
+    schedules, success = solve_shift_schedule(status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets, report=report, **kwargs)
+    assert success, report
+    return [assignments_from_df(status_matrix, df) for df in schedules], report
+
+def assert_valid(status_matrix, assigned_by_date, min_list, max_list, roster=None, fresh_min_list=None, fresh_max_list=None, member_targets=None):
+    assert find_violations(status_matrix, assigned_by_date, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets) == (set(), set())
+    for assigned in assigned_by_date.values():
+        assert len(assigned) == len(set(assigned))
+
+@pytest.fixture
+def status_matrix():
+    # a・b は1日目か2日目、c は2〜4日目、d は3・4日目にしか参加できず、x は4日目 (△)、e は1日目だけ
+    return make_matrix(["○△×××○", "△○○×××", "××△○××", "××○△△×"], ["a", "b", "c", "d", "x", "e"])
+
+# --- 既知の最適解 ---
+
+def test_known_optimum_without_roster(status_matrix):
+    # 全員1回参加なら、○だけに入れる a(1日目)・b(2日目)・c(4日目)・d(3日目)・e(1日目) と、△しかない x(4日目) が最適
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    (assigned_by_date,), report = solve(status_matrix, min_list, max_list)
+    assert report['status'] == 'optimal'
+    assert objective(status_matrix, assigned_by_date) == report['objective'] == -11
+    assert optimum(status_matrix, min_list, max_list) == -11
+    assert_valid(status_matrix, assigned_by_date, min_list, max_list)
+
+def test_known_optimum_with_grades_and_targets(status_matrix):
+    # a・b は同学年なので、同じ日に入ると学年重複のペナルティがかかる。c は2回参加で、隣り合う日程を避ける
+    roster = make_roster({"a": "2", "b": "2", "c": "3", "d": "1", "x": "1", "e": "4"})
+    member_targets = {"c": 2}
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    (assigned_by_date,), report = solve(status_matrix, min_list, max_list, roster, member_targets=member_targets)
+    assert report['status'] == 'optimal'
+    expected = optimum(status_matrix, min_list, max_list, roster, member_targets=member_targets)
+    assert objective(status_matrix, assigned_by_date, roster, member_targets) == pytest.approx(expected)
+    assert schedule_objective(status_matrix, assigned_by_date, roster, member_targets) == pytest.approx(expected)
+    assert report['objective'] == pytest.approx(expected)
+    assert_valid(status_matrix, assigned_by_date, min_list, max_list, roster, member_targets=member_targets)
+
+@pytest.mark.parametrize("backend, status", [("auto", 'optimal'), ("flow", 'optimal'), ("cbc", 'optimal'), ("lns", 'heuristic')])
+def test_explicit_backend_is_used_without_roster(status_matrix, backend, status):
+    # 名簿が無くても、指定された解き方で解く ("auto" だけが最小費用流を選ぶ)
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    (assigned_by_date,), report = solve(status_matrix, min_list, max_list, backend=backend)
+    assert report['backend'] == ("flow" if backend == "auto" else backend)
+    assert report['status'] == status
+    assert objective(status_matrix, assigned_by_date) == report['objective'] == -11
+
+def test_auto_never_picks_the_portfolio(monkeypatch):
+    # ポートフォリオは指定したときだけ使う。コアが多く、出欠表が大きくても "auto" はMIPソルバーを選ぶ
+    monkeypatch.setattr(os, "cpu_count", lambda: 64)
+    status_matrix = random_matrix(0, 100, 300)
+    roster = make_roster({m: "2" for m in status_matrix['members'].tolist()})
+    assert select_backend(status_matrix, roster) == first_mip_backend()
+    assert select_backend(status_matrix, None, k=3) == first_mip_backend()
+    assert select_backend(status_matrix) == 'flow'
+
+@pytest.mark.parametrize("seed", range(6))
+def test_random_optimum_with_penalties(seed):
+    status_matrix = random_matrix(seed, 4, 6)
+    members = status_matrix['members'].tolist()
+    roster = make_roster({m: str(1 + j % 3) for j, m in enumerate(members)})
+    member_targets = {members[0]: 2}
+    min_list, max_list, fresh_min_list, fresh_max_list = [1] * 4, [3] * 4, [0] * 4, [1] * 4
+    schedules = list(feasible_schedules(status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets))
+    if not schedules:
+        pytest.skip("条件を満たすお稽古が無い")
+    expected = min(objective(status_matrix, s, roster, member_targets) for s in schedules)
+    (assigned_by_date,), report = solve(status_matrix, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets)
+    assert report['status'] == 'optimal'
+    assert objective(status_matrix, assigned_by_date, roster, member_targets) == pytest.approx(expected)
+    assert report['objective'] == pytest.approx(expected)
+    assert_valid(status_matrix, assigned_by_date, min_list, max_list, roster, fresh_min_list, fresh_max_list, member_targets)
+
+# --- 同値類へのまとめ ---
+
+def test_aggregation_expands_to_valid_assignments():
+    # p1〜p4 は出欠も学年も同じなので一つの類にまとまり、変数は「その日に類から何人入るか」になる
+    status_matrix = make_matrix(["○○○○△×", "○○○○×○", "△△△△○○"], ["p1", "p2", "p3", "p4", "q", "r"])
+    roster = make_roster({"p1": "2", "p2": "2", "p3": "2", "p4": "2", "q": "3", "r": "1"})
+    classes = aggregate_members(status_matrix, get_member_grade_map(roster))
+    assert sorted(map(len, classes)) == [1, 1, 4]
+    model = build_shift_model(status_matrix, roster)
+    assert model['aggregated_members'] == {"p1", "p2", "p3", "p4"}
+
+    min_list, max_list = [2, 2, 1], [2, 3, 2]
+    (assigned_by_date,), report = solve(status_matrix, min_list, max_list, roster)
+    assert report['status'] == 'optimal'
+    # 類の人数が部員一人ひとりの割り当てに戻り、全員がちょうど1回、参加できる日程に入っている
+    assert sorted(m for assigned in assigned_by_date.values() for m in assigned) == ["p1", "p2", "p3", "p4", "q", "r"]
+    assert_valid(status_matrix, assigned_by_date, min_list, max_list, roster)
+    assert objective(status_matrix, assigned_by_date, roster) == pytest.approx(optimum(status_matrix, min_list, max_list, roster))
+
+# --- 事前処理 ---
+
+def test_presolve_fixes_only_forced_members(status_matrix):
+    member_targets = {"c": 3, "d": 1}
+    forced = [status_matrix['members'][j] for j in find_forced_members(status_matrix, member_targets)]
+    # x・e は1日しか参加できず、c は参加可能な3日すべてに入る。ほかの部員には選択肢がある
+    assert forced == ["c", "x", "e"]
+    reduced, forced_by_date, report = presolve_forced_assignments(status_matrix, member_targets)
+    assert forced_by_date == {0: ["e"], 1: ["c"], 2: ["c"], 3: ["c", "x"]}
+    assert report['fixed_members'] == 3 and report['fixed_assignments'] == 5
+    assert not reduced['matrix'][:, [2, 4, 5]].any()
+    assert (reduced['matrix'][:, [0, 1, 3]] == status_matrix['matrix'][:, [0, 1, 3]]).all()
+
+    # 固定した割り当ては条件を満たすどのお稽古にも含まれ、固定しなかった部員はどれかのお稽古で別の日程に入る
+    min_list, max_list = [0, 0, 0, 0], [3, 3, 3, 3]
+    schedules = list(feasible_schedules(status_matrix, min_list, max_list, member_targets=member_targets))
+    for d, assigned in forced_by_date.items():
+        for m in assigned:
+            assert all(m in s[d] for s in schedules)
+    for m in ["a", "b", "d"]:
+        assert len({tuple(d for d, assigned in s.items() if m in assigned) for s in schedules}) > 1
+
+# --- 最小費用流 ---
+
+@pytest.mark.parametrize("seed", range(8))
+def test_flow_is_optimal_without_penalties(seed):
+    status_matrix = random_matrix(seed, 4, 7)
+    min_list, max_list = [1, 1, 2, 0], [2, 3, 3, 2]
+    schedules = list(feasible_schedules(status_matrix, min_list, max_list))
+    assigned_by_date = solve_assignment_flow(status_matrix, min_list, max_list)
+    if not schedules:
+        assert assigned_by_date is None
+        return
+    assert_valid(status_matrix, assigned_by_date, min_list, max_list)
+    assert objective(status_matrix, assigned_by_date) == min(objective(status_matrix, s) for s in schedules)
+
+# --- 別案 (k-best) ---
+
+def test_k_best_returns_distinct_schedules_in_order(status_matrix):
+    roster = make_roster({"a": "2", "b": "2", "c": "3", "d": "1", "x": "1", "e": "4"})
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    schedules, report = solve(status_matrix, min_list, max_list, roster, k=3)
+    assert len(schedules) == 3
+    keys = [tuple(tuple(sorted(s[d])) for d in range(4)) for s in schedules]
+    assert len(set(keys)) == 3
+    values = [objective(status_matrix, s, roster) for s in schedules]
+    assert values == sorted(values)
+    assert values[0] == pytest.approx(optimum(status_matrix, min_list, max_list, roster))
+    for s in schedules:
+        assert_valid(status_matrix, s, min_list, max_list, roster)
+
+# --- 実行不可能の診断 ---
+
+def test_diagnose_infeasibility_finds_planted_conflict(status_matrix):
+    # 1日目に入るしかない e に加え、a も1日目だけにすると最大人数1名では入りきらない
+    status_matrix['matrix'][1, 0] = 0
+    status_matrix = make_status_matrix(status_matrix['matrix'], status_matrix['dates'], status_matrix['members'])
+    min_list, max_list = [0, 0, 0, 0], [1, 3, 3, 3]
+    schedules, success = solve_shift_schedule(status_matrix, min_list, max_list)
+    assert not success
+    findings = diagnose_infeasibility(status_matrix, min_list, max_list)
+    assert [f['dates'] for f in findings] == [["1日"]]
+    assert "a、e" in findings[0]['message']
+
+def test_diagnose_infeasibility_finds_short_dates(status_matrix):
+    # 3日目・4日目に参加できるのは c・d・x の3名だけなので、最小人数2名ずつは満たせない
+    min_list, max_list = [0, 0, 2, 2], [3, 3, 3, 3]
+    assert not list(feasible_schedules(status_matrix, min_list, max_list))
+    findings = diagnose_infeasibility(status_matrix, min_list, max_list)
+    assert findings and set(findings[0]['dates']) == {"3日", "4日"}
+
+def test_diagnose_infeasibility_is_empty_when_feasible(status_matrix):
+    assert diagnose_infeasibility(status_matrix, [1, 1, 1, 1], [2, 2, 2, 2]) == []
+
+def test_min_above_max_is_infeasible(status_matrix):
+    # 2日目の最小人数2名・最大人数1名は、参加できる部員が足りていても満たせない
+    bounds = [(1, 2, 0, None), (2, 1, 0, None), (1, 2, 0, None), (1, 2, 0, None)]
+    assert not is_schedule_feasible(status_matrix, bounds, {}, set())
+    assert is_schedule_feasible(status_matrix, [(1, 2, 0, None)] * 4, {}, set())
+    # 1年生最小が1年生最大を上回るときも同じ
+    assert not is_schedule_feasible(status_matrix, [(0, 3, 0, None), (0, 3, 0, None), (0, 3, 0, None), (0, 3, 2, 1)], {}, {3, 4})
+
+    settings = {'min': [1, 2, 1, 1], 'max': [2, 1, 2, 2], 'fmin': None, 'fmax': None}
+    (result,) = sweep_shift_settings(status_matrix, [settings])
+    schedules, success, report = result
+    assert not success and report['status'] == 'infeasible'
+
+# --- 編集後の解き直し ---
+
+def test_repair_keeps_pinned_members_in_place(status_matrix):
+    roster = make_roster({"a": "2", "b": "2", "c": "3", "d": "1", "x": "1", "e": "4"})
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    schedules, _ = solve_shift_schedule(status_matrix, min_list, max_list, roster)
+    before = assignments_from_df(status_matrix, schedules[0])
+    # 4日目の最大人数を1名に減らすと、4日目に入っている部員だけを動かせば直せる
+    max_list = [2, 2, 2, 1]
+    repaired_df, success, moved = repair_shift_schedule(status_matrix, schedules[0], min_list, max_list, roster, changed_dates=[3])
+    assert success
+    after = assignments_from_df(status_matrix, repaired_df)
+    assert_valid(status_matrix, after, min_list, max_list, roster)
+    assert set(moved) == set(before[3])
+    for d in range(4):
+        for m in before[d]:
+            if m not in moved:
+                assert m in after[d]
+
+def test_repair_leaves_a_valid_schedule_alone(status_matrix):
+    min_list, max_list = [1, 1, 1, 1], [2, 2, 2, 2]
+    schedules, _ = solve_shift_schedule(status_matrix, min_list, max_list)
+    repaired_df, success, moved = repair_shift_schedule(status_matrix, schedules[0], min_list, max_list)
+    assert success and moved == []
+    assert repaired_df is schedules[0]
+
+# --- 求解結果のキャッシュのキー ---
+
+def test_solve_fingerprint(status_matrix):
+    roster = make_roster({"a": "2", "b": "2", "c": "3", "d": "1", "x": "1", "e": "4"})
+    args = ([1, 1, 1, 1], [2, 2, 2, 2], roster, [0, 0, 0, 0], [1, 1, 1, 1], {"c": 2})
+    key = solve_fingerprint(status_matrix, *args)
+    # 同じ値なら、別に作った行列・リストでも同じキーになる
+    copied = make_status_matrix(status_matrix['matrix'].copy(), status_matrix['dates'].copy(), status_matrix['members'].copy())
+    assert solve_fingerprint(copied, [1, 1, 1, 1], [2, 2, 2, 2], make_roster({"a": "2", "b": "2", "c": "3", "d": "1", "x": "1", "e": "4"}), [0, 0, 0, 0], [1, 1, 1, 1], {"c": 2}) == key
+    assert solve_fingerprint(status_matrix, *args) == key
+    # 人数の上下限・1年生人数・参加回数・別案の数・設定のどれかが変われば別のキーになる
+    assert solve_fingerprint(status_matrix, [1, 1, 1, 1], [2, 2, 3, 2], *args[2:]) != key
+    assert solve_fingerprint(status_matrix, [1, 1, 1, 0], [2, 2, 2, 2], *args[2:]) != key
+    assert solve_fingerprint(status_matrix, *args[:4], [1, 1, 2, 1], args[5]) != key
+    assert solve_fingerprint(status_matrix, *args[:5], {"c": 3}) != key
+    assert solve_fingerprint(status_matrix, *args, k=3) != key
+    assert solve_fingerprint(status_matrix, *args, profile="quick") != key
+    # 初期解が違えば別のキーになる (日程・名前の並び順と、誰も入っていない日程の有無は問わない)
+    start = {0: ["a", "e"], 1: ["b"], 2: ["d"], 3: ["c", "x"]}
+    with_start = solve_fingerprint(status_matrix, *args, initial_solution=start)
+    assert with_start != key
+    assert solve_fingerprint(status_matrix, *args, initial_solution={3: ["x", "c"], 2: ["d"], 1: ["b"], 0: ["e", "a"], 4: []}) == with_start
+    assert solve_fingerprint(status_matrix, *args, initial_solution={0: ["b", "e"], 1: ["a"], 2: ["d"], 3: ["c", "x"]}) != with_start
+    changed = status_matrix['matrix'].copy()
+    changed[0, 0] = 1
+    assert solve_fingerprint(make_status_matrix(changed, status_matrix['dates'], status_matrix['members']), *args) != key